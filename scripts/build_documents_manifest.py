@@ -2,59 +2,65 @@ import typer
 import srsly
 from pathlib import Path
 import os
-import re
 import urllib.parse  # Add this for URL encoding/decoding
+from utils.scanner import scan_documents, diff_entries
 
-def natural_sort_key(s: str):
-    """Sort strings alphanumerically like Finder."""
-    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+def changes_path(documents_manifest: Path) -> Path:
+    """Where the added/changed/removed entries of the last scan are written"""
+    return documents_manifest.with_name(f"{documents_manifest.stem}_changes.jsonl")
+
+def write_changes(path: Path, changes: dict):
+    """
+    Write the scan diff as a manifest downstream stages can consume directly:
+    added and changed files keep their entry (with a "change" key), removed
+    files are listed with type "removed" so BatchProcessor skips them.
+    """
+    entries = [{**e, "change": "added"} for e in changes["added"]]
+    entries.extend({**e, "change": "changed"} for e in changes["changed"])
+    entries.extend({"path": e["path"], "type": "removed", "change": "removed"} for e in changes["removed"])
+    srsly.write_jsonl(path, entries)
 
 def build_documents_manifest(
     documents_dir: Path = typer.Argument(..., help="Directory to scan for files and folders"),
-    documents_manifest: Path = typer.Argument(..., help="Output file path (.jsonl)")
+    documents_manifest: Path = typer.Argument(..., help="Output file path (.jsonl)"),
+    threads: int = typer.Option(8, help="Threads scanning top-level folders in parallel")
 ):
     """
     Recursively scan the given documents directory and create a JSONL file listing
     all files and subfolders (relative paths only), sorted alphanumerically.
-    
+
     Required, because on a spinning disk, and lots of files, thigns were too slow.
+    The scan is diffed against the previous manifest by (path, size, mtime); the
+    manifest is only rewritten when something changed, and the differences are
+    written to <manifest>_changes.jsonl for downstream stages.
     """
-    
+
     # Safely handle the path with special characters and spaces
     documents_dir = Path(os.path.expanduser(str(documents_dir))).resolve()
     documents_manifest = Path(os.path.expanduser(str(documents_manifest))).resolve()
-    
+
     # Convert to .jsonl extension and ensure it is in the manifests directory
     documents_manifest = documents_manifest.with_suffix('.jsonl')
-    
+
     # Ensure the directory for the manifest file exists
     documents_manifest.parent.mkdir(parents=True, exist_ok=True)
-    
-    entries = []
-    
-    # Recursively list files & folders
-    for root, dirs, files in os.walk(documents_dir):
-        root_path = Path(root)
-        for d in dirs:
-            rel_path = root_path.joinpath(d).relative_to(documents_dir)
-            entries.append({"path": str(rel_path), "type": "directory"})
-        for f in files:
-            if f.lower().endswith(('.pdf', '.jpg', '.jpeg', '.tif', '.tiff', '.png', '.jxl')):
-                file_path = root_path.joinpath(f)
-                rel_path = file_path.relative_to(documents_dir)
-                entries.append({
-                    "path": str(rel_path),
-                    "type": "file",
-                    "mtime": os.path.getmtime(file_path),
-                    "size": os.path.getsize(file_path)
-                })
-    
-    # Sort all entries by alphanumeric order of their 'path'
-    entries.sort(key=lambda e: natural_sort_key(e["path"]))
-    
-    # Write the sorted entries to the JSONL file
-    srsly.write_jsonl(documents_manifest, entries)
+
+    entries = scan_documents(documents_dir, threads=threads)
+    previous = list(srsly.read_jsonl(documents_manifest)) if documents_manifest.exists() else []
+    changes = diff_entries(previous, entries)
+    write_changes(changes_path(documents_manifest), changes)
+    print(f"Added: {len(changes['added'])}, changed: {len(changes['changed'])}, removed: {len(changes['removed'])}")
+
+    # Directory additions/removals change the manifest without changing any file
+    if previous == entries:
+        print(f"No changes, keeping {documents_manifest} ({len(entries)} entries)")
+        return
+
+    # Write the sorted entries atomically so readers never see a partial manifest
+    tmp_path = documents_manifest.with_suffix('.jsonl.tmp')
+    srsly.write_jsonl(tmp_path, entries)
+    os.replace(tmp_path, documents_manifest)
     print(f"Saved {len(entries)} entries to {documents_manifest}")
 
 if __name__ == "__main__":
-    typer.run(build_documents_manifest)
\ No newline at end of file
+    typer.run(build_documents_manifest)
@@ -4,6 +4,7 @@ from PIL import Image
 from pdf2image import convert_from_path
 from utils.batch import BatchProcessor
 from utils.processor import process_file
+from utils.files import DirectoryIndex
 from rich.console import Console
 import srsly
 import shutil
@@ -54,13 +55,18 @@ def convert_to_jpg(file_path: Path, out_path: Path) -> dict:
 
 def check_crop_and_copy(
     source_folder: Path = typer.Argument(..., help="Source folder with original files"),
-    target_folder: Path = typer.Argument(..., help="Target folder to check/copy to")
+    target_folder: Path = typer.Argument(..., help="Target folder to check/copy to"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite")
 ):
     """Check missing files from manifest and recreate them"""
     manifest_path = target_folder / "crop_manifest.jsonl"
     if not manifest_path.exists():
         raise typer.Exit("Crop manifest not found")
     
+    # One listing per crop and source folder instead of a stat per file
+    index = DirectoryIndex()
+
     # Create list of files to process from manifest
     temp_manifest = target_folder / 'check_manifest.jsonl'
     with open(temp_manifest, 'w') as f:
@@ -85,12 +91,12 @@ def check_crop_and_copy(
                 output_path = Path(output)
                 if "documents" in output_path.parts:
                     output_path = Path(*output_path.parts[output_path.parts.index("documents")+1:])
-                if not (target_folder / "documents" / output_path).exists():
+                if not index.exists(target_folder / "documents" / output_path):
                     any_missing = True
                     break
             
             # If any output is missing and source exists, add to process list
-            if any_missing and original_file.exists():
+            if any_missing and index.exists(original_file):
                 f.write(srsly.json_dumps({
                     "type": "file",
                     "path": str(source_path)
@@ -103,7 +109,9 @@ def check_crop_and_copy(
             output_folder=target_folder,
             process_name="check_and_copy",
             processor_fn=process_document,
-            base_folder=source_folder
+            base_folder=source_folder,
+            workers=workers,
+            manifest_backend=manifest_backend
         )
         processor.process()
     finally:
@@ -253,7 +253,7 @@ def process_document(file_path: str, output_folder: Path, transcriptions_folder:
         
         # Look for image file with various extensions
         image_path = None
-        for ext in ['.jpg', '.jpeg', '.png', '.tif', '.tiff']:
+        for ext in ['.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff']:
             test_path = file_path.with_suffix(ext)
             if test_path.exists():
                 image_path = test_path
@@ -6,12 +6,18 @@ import cv2
 from pdf2image import convert_from_path
 from datetime import datetime
 import logging
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union
 import os
 import json
 import yaml
+import queue
+import threading
 from utils.batch import BatchProcessor
 from utils.processor import process_file
+from utils.analysis import draft_decode
+from utils.geometry import GeometryPlan
+from utils.image_io import check_format, save_image
+from utils.page_cache import configure as configure_page_cache
 from rich.console import Console
 from PIL import ExifTags
 
@@ -20,16 +26,68 @@ logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 console = Console()
 
-# Load YOLO model
-try:
+STAGE_PARAMS = {
+    "version": 1,
+    "model": "yolov8s-fichero.pt",
+    "conf_thresholds": [0.35, 0.15],
+    "padding": 30,
+    "jpeg_quality": 95,
+    # Codec for the cropped pages (see utils.image_io.IMAGE_FORMATS)
+    "image_format": "jpeg",
+    # Decode JPEGs at reduced DCT scale for detection; only the crop is decoded at full size
+    "jpeg_draft": True
+}
+
+# Models live in the project's models/ folder, wherever the script is run from
+MODELS_DIR = Path(__file__).resolve().parent.parent / "models"
+MODEL_FORMATS = ("pt", "onnx", "openvino")
+
+# Loaded on first detection so fully-resumed runs never pay for torch/ultralytics
+_yolo_model = None
+_model_format = "pt"
+
+def exported_model_path(model_path: Path, model_format: str) -> Path:
+    """Where ultralytics writes an exported copy of the model"""
+    if model_format == "onnx":
+        return model_path.with_suffix(".onnx")
+    if model_format == "openvino":
+        return model_path.parent / f"{model_path.stem}_openvino_model"
+    return model_path
+
+def resolve_model(model_format: str = "pt") -> Path:
+    """Return the model to load, exporting and caching it on first use for ONNX/OpenVINO.
+    The export is redone when the .pt file is newer than the cached copy."""
+    model_path = MODELS_DIR / STAGE_PARAMS["model"]
+    exported = exported_model_path(model_path, model_format)
+    if model_format == "pt" or (exported.exists() and exported.stat().st_mtime >= model_path.stat().st_mtime):
+        return exported
+    
     from ultralytics import YOLO
-    yolo_model = YOLO("models/yolov8s-fichero.pt")  # Keep original model
-    logger.info("Successfully loaded YOLO model")
-except Exception as e:
-    logger.error(f"Failed to load YOLO model: {e}")
-    raise
+    console.print(f"Exporting {model_path.name} to {model_format} (cached at {exported})")
+    # Dynamic shapes: the per-image path uses aspect-dependent sizes and batched mode varies N
+    return Path(YOLO(str(model_path)).export(format=model_format, imgsz=640, dynamic=True))
+
+def get_yolo_model():
+    """Load the YOLO model on first use"""
+    global _yolo_model
+    if _yolo_model is None:
+        try:
+            from ultralytics import YOLO
+            model_path = resolve_model(_model_format)
+            _yolo_model = YOLO(str(model_path), task="detect")
+            logger.info(f"Successfully loaded YOLO model {model_path}")
+        except Exception as e:
+            logger.error(f"Failed to load YOLO model: {e}")
+            raise
+    return _yolo_model
 
-def get_image_orientation(image_path: Path) -> tuple[str, int, dict]:
+def _open_source(source: Union[Path, Image.Image]) -> Image.Image:
+    """Return the PIL image for a path or an already decoded image"""
+    if isinstance(source, Image.Image):
+        return source
+    return Image.open(source)
+
+def get_image_orientation(image_path: Union[Path, Image.Image]) -> tuple[str, int, dict]:
     """Get the true orientation of an image using EXIF data and required rotation angle.
     Returns (orientation, rotation_angle, details) where:
     - orientation is "vertical" or "horizontal"
@@ -43,7 +101,7 @@ def get_image_orientation(image_path: Path) -> tuple[str, int, dict]:
     }
     
     try:
-        image = Image.open(image_path)
+        image = _open_source(image_path)
         width, height = image.size
         details["original_dimensions"] = {"width": width, "height": height}
         
@@ -98,29 +156,49 @@ def get_image_orientation(image_path: Path) -> tuple[str, int, dict]:
         details["reason"] = f"Error checking orientation: {str(e)}"
         return "unknown", 0, details
 
-def crop_with_yolo(image_path: Path, output_folder: Path, conf_threshold: float = 0.35) -> Optional[Tuple[Image.Image, Dict[str, Any]]]:
-    """Crop image using YOLOv8 model
-    Returns tuple of (cropped_image, crop_info) where crop_info contains box coordinates and confidence"""
-    try:
-        # Get true orientation and required rotation
-        true_orientation, rotation_angle, orientation_details = get_image_orientation(image_path)
-        
-        # Read original image and convert to PIL
-        original_pil = Image.open(image_path)
-        orig_width, orig_height = original_pil.size
-        
-        # Apply rotation if needed
-        if rotation_angle > 0:
-            original_pil = original_pil.rotate(rotation_angle, expand=True)
-            # Update dimensions after rotation
-            orig_width, orig_height = original_pil.size
-        
-        # Convert to numpy array for YOLO
-        original_img = cv2.cvtColor(np.array(original_pil), cv2.COLOR_RGB2BGR)
-        
-        # Resize image for model prediction while maintaining aspect ratio and stride requirement
-        model_size = 640
-        scale = min(model_size / orig_width, model_size / orig_height)
+def prepare_for_yolo(image_path: Union[Path, Image.Image], letterbox: bool = False) -> Dict[str, Any]:
+    """Orient an image and build its YOLO input.
+    A JPEG that is not decoded yet is read at reduced size (draft mode) for
+    detection; full resolution is only decoded by full_image() for the final crop.
+    With letterbox the input is padded to a fixed 640x640 square so several
+    images can share one batched forward pass."""
+    # Get true orientation and required rotation
+    true_orientation, rotation_angle, orientation_details = get_image_orientation(image_path)
+    
+    # Open original image (pixels are decoded lazily)
+    source = _open_source(image_path)
+    exif = source._getexif() if hasattr(source, '_getexif') else None
+    
+    # Dimensions after rotation
+    orig_width, orig_height = source.size
+    if rotation_angle in (90, 270):
+        orig_width, orig_height = orig_height, orig_width
+    
+    # Detection only needs ~640px, so decode JPEGs at the smallest sufficient DCT scale
+    model_size = 640
+    scale = min(model_size / orig_width, model_size / orig_height)
+    detect_pil = (draft_decode(source, model_size) if STAGE_PARAMS["jpeg_draft"] else None) or source
+    
+    # Apply rotation if needed
+    if rotation_angle > 0:
+        detect_pil = detect_pil.rotate(rotation_angle, expand=True)
+    
+    # Convert to numpy array for YOLO
+    rgb_pil = detect_pil if detect_pil.mode == 'RGB' else detect_pil.convert('RGB')
+    detect_img = cv2.cvtColor(np.array(rgb_pil), cv2.COLOR_RGB2BGR)
+    
+    # Resize image for model prediction while maintaining aspect ratio and stride requirement
+    offset = (0, 0)
+    if letterbox:
+        model_width = max(1, int(round(orig_width * scale)))
+        model_height = max(1, int(round(orig_height * scale)))
+        resized = cv2.resize(detect_img, (model_width, model_height), interpolation=cv2.INTER_AREA)
+        # Center on a grey square, as ultralytics' own letterbox does
+        offset = ((model_size - model_width) // 2, (model_size - model_height) // 2)
+        model_img = np.full((model_size, model_size, 3), 114, dtype=np.uint8)
+        model_img[offset[1]:offset[1] + model_height, offset[0]:offset[0] + model_width] = resized
+        imgsz = model_size
+    else:
         model_width = int(orig_width * scale)
         model_height = int(orig_height * scale)
         
@@ -128,99 +206,158 @@ def crop_with_yolo(image_path: Path, output_folder: Path, conf_threshold: float
         model_width = ((model_width + 31) // 32) * 32
         model_height = ((model_height + 31) // 32) * 32
         
-        model_img = cv2.resize(original_img, (model_width, model_height))
+        model_img = cv2.resize(detect_img, (model_width, model_height))
+        imgsz = (model_width, model_height)
+    
+    return {
+        "source": source,
+        "rotation_angle": rotation_angle,
+        "full_size": (orig_width, orig_height),
+        "detect_img": detect_img,
+        "model_img": model_img,
+        "imgsz": imgsz,
+        "scale": scale,
+        "offset": offset,
+        "exif": exif if rotation_angle == 0 else None
+    }
+
+def full_image(prepared: Dict[str, Any]) -> Image.Image:
+    """Full-resolution, oriented image for a prepared input (decoded once, on first use)"""
+    if prepared.get("full") is None:
+        full = prepared["source"]
+        if prepared["rotation_angle"] > 0:
+            full = full.rotate(prepared["rotation_angle"], expand=True)
+        prepared["full"] = full
+    return prepared["full"]
+
+def _crop_full(prepared: Dict[str, Any], box: Tuple[int, int, int, int]) -> Image.Image:
+    """Crop a full-resolution region and carry the original EXIF over"""
+    result = full_image(prepared).crop(box)
+    if result.mode != 'RGB':
+        result = result.convert('RGB')
+    if prepared.get("exif") is not None:
+        result.info['exif'] = prepared["exif"]
+    return result
+
+def detect_batch(model_imgs: List[np.ndarray], conf_threshold: float) -> List[np.ndarray]:
+    """Run one YOLO forward pass over letterboxed images.
+    Returns an (N, 6) array of x1, y1, x2, y2, confidence, class per image"""
+    results = get_yolo_model().predict(
+        source=model_imgs,
+        conf=conf_threshold,
+        imgsz=640,
+        iou=0.45,
+        verbose=False
+    )
+    return [r.boxes.data.cpu().numpy() for r in results]
+
+def crop_from_boxes(prepared: Dict[str, Any], boxes, conf_threshold: float) -> Optional[Tuple[Image.Image, Dict[str, Any]]]:
+    """Crop the full-resolution image to the best detection at or above conf_threshold"""
+    boxes = [box for box in boxes if float(box[4]) >= conf_threshold]
+    if not boxes:
+        logger.warning("No detections found")
+        return None
+    
+    orig_width, orig_height = prepared["full_size"]
+    scale = prepared["scale"]
+    offset_x, offset_y = prepared["offset"]
+    
+    # Get the best detection (highest confidence)
+    box = max(boxes, key=lambda x: x[4])
+    x1, y1, x2, y2, conf = map(float, box[:5])
+    
+    # Scale coordinates back to original image size
+    x1 = int((x1 - offset_x) / scale)
+    y1 = int((y1 - offset_y) / scale)
+    x2 = int((x2 - offset_x) / scale)
+    y2 = int((y2 - offset_y) / scale)
+    
+    # Apply padding only on left and bottom
+    padding = STAGE_PARAMS["padding"]
+    x1 = max(0, x1 - padding)  # Add padding to left
+    y1 = max(0, y1 - padding)  # Add padding to top
+    x2 = min(orig_width, x2)   # No padding on right
+    y2 = min(orig_height, y2 + padding)  # Add padding to bottom
+    
+    # Crop original image at full resolution
+    result = _crop_full(prepared, (x1, y1, x2, y2))
+    
+    # Create crop info dictionary
+    crop_info = {
+        "box": {
+            "x1": x1,
+            "y1": y1,
+            "x2": x2,
+            "y2": y2
+        },
+        "confidence": float(conf),
+        "method": "yolo",
+        "padding": padding,
+        "original_size": [orig_width, orig_height],
+        "cropped_size": [x2 - x1, y2 - y1]
+    }
+    
+    return result, crop_info
+
+def crop_with_yolo(image_path: Union[Path, Image.Image], output_folder: Path, conf_threshold: float = 0.35,
+                   prepared: Dict[str, Any] = None) -> Optional[Tuple[Image.Image, Dict[str, Any]]]:
+    """Crop image using YOLOv8 model
+    Pass `prepared` (from prepare_for_yolo) to reuse a decoded image across thresholds.
+    Returns tuple of (cropped_image, crop_info) where crop_info contains box coordinates and confidence"""
+    try:
+        if prepared is None:
+            prepared = prepare_for_yolo(image_path)
         
         # Run prediction with optimized settings
-        results = yolo_model.predict(
-            source=model_img,
+        results = get_yolo_model().predict(
+            source=prepared["model_img"],
             conf=conf_threshold,
-            imgsz=(model_width, model_height),
+            imgsz=prepared["imgsz"],
             iou=0.45,
             verbose=False
         )[0]
         
-        if not results.boxes:
-            logger.warning("No detections found")
-            return None
-            
-        # Get the best detection (highest confidence)
-        box = max(results.boxes.data, key=lambda x: x[4])
-        x1, y1, x2, y2, conf = map(float, box[:5])
-        
-        # Scale coordinates back to original image size
-        x1 = int(x1 / scale)
-        y1 = int(y1 / scale)
-        x2 = int(x2 / scale)
-        y2 = int(y2 / scale)
-        
-        # Apply padding only on left and bottom
-        padding = 30
-        x1 = max(0, x1 - padding)  # Add padding to left
-        y1 = max(0, y1 - padding)  # Add padding to top
-        x2 = min(orig_width, x2)   # No padding on right
-        y2 = min(orig_height, y2 + padding)  # Add padding to bottom
-        
-        # Crop original image at full resolution
-        cropped = original_img[y1:y2, x1:x2]
-        
-        # Convert to PIL Image and preserve EXIF
-        result = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-        
-        # Try to preserve EXIF data from original image
-        try:
-            if hasattr(original_pil, '_getexif'):
-                exif = original_pil._getexif()
-                if exif is not None:
-                    result.info['exif'] = exif
-        except Exception as e:
-            logger.warning(f"Could not preserve EXIF data: {e}")
-        
-        # Create crop info dictionary
-        crop_info = {
-            "box": {
-                "x1": x1,
-                "y1": y1,
-                "x2": x2,
-                "y2": y2
-            },
-            "confidence": float(conf),
-            "method": "yolo",
-            "padding": padding,
-            "original_size": [orig_width, orig_height],
-            "cropped_size": [x2 - x1, y2 - y1]
-        }
-            
-        return result, crop_info
+        return crop_from_boxes(prepared, results.boxes.data, conf_threshold)
     except Exception as e:
         logger.error(f"YOLO cropping failed: {e}")
         return None
 
-def detect_with_contours(image_path: Path) -> Optional[Image.Image]:
+def contour_box(img: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box (x, y, w, h) of the largest bright region in a BGR image"""
+    # Convert to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    # Apply threshold
+    _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+    
+    # Find contours
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    if not contours:
+        return None
+        
+    # Get the largest contour
+    largest_contour = max(contours, key=cv2.contourArea)
+    return cv2.boundingRect(largest_contour)
+
+def detect_with_contours(image_path: Union[Path, Image.Image]) -> Optional[Image.Image]:
     """Try to detect document using contour detection"""
     try:
         # Read image
-        img = cv2.imread(str(image_path))
+        if isinstance(image_path, Image.Image):
+            img = cv2.cvtColor(np.array(image_path.convert('RGB')), cv2.COLOR_RGB2BGR)
+        else:
+            img = cv2.imread(str(image_path))
         if img is None:
             return None
-            
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply threshold
-        _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
         
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        if not contours:
+        box = contour_box(img)
+        if box is None:
             return None
-            
-        # Get the largest contour
-        largest_contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(largest_contour)
+        x, y, w, h = box
         
         # Add padding
-        padding = 30
+        padding = STAGE_PARAMS["padding"]
         x = max(0, x - padding)
         y = max(0, y - padding)
         w = min(img.shape[1] - x, w + padding)
@@ -235,66 +372,107 @@ def detect_with_contours(image_path: Path) -> Optional[Image.Image]:
         logger.warning(f"Contour detection failed: {e}")
         return None
 
-def process_image(file_path: Path, out_path: Path) -> dict:
-    """Process a single image file"""
-    # Get source folder structure from input path
-    source_dir = Path(file_path).parts[1:]  # Skip the first part (documents)
-    
-    # Verify file exists and is readable
-    if not file_path.exists():
-        logger.error(f"File does not exist: {file_path}")
-        return {"success": False, "error": "File not found"}
-    
+def crop_prepared_with_contours(prepared: Dict[str, Any]) -> Optional[Tuple[Image.Image, Dict[str, Any]]]:
+    """Contour detection on the detection-size image, cropped from full resolution.
+    Returns (image, {"box": ...}) or None"""
     try:
-        # Try to open the image to verify it's readable
-        with Image.open(file_path) as img:
-            logger.debug(f"Successfully opened image: {file_path.name} (format: {img.format})")
+        box = contour_box(prepared["detect_img"])
+        if box is None:
+            return None
+        # Map from the detection image back to full resolution
+        full_width, full_height = prepared["full_size"]
+        fx = full_width / prepared["detect_img"].shape[1]
+        fy = full_height / prepared["detect_img"].shape[0]
+        x, y = int(box[0] * fx), int(box[1] * fy)
+        w, h = int(round(box[2] * fx)), int(round(box[3] * fy))
+        
+        # Add padding
+        padding = STAGE_PARAMS["padding"]
+        x = max(0, x - padding)
+        y = max(0, y - padding)
+        w = min(full_width - x, w + padding)
+        h = min(full_height - y, h + padding)
+        
+        box = {"x1": x, "y1": y, "x2": x + w, "y2": y + h}
+        return _crop_full(prepared, (x, y, x + w, y + h)), {"box": box}
     except Exception as e:
-        logger.error(f"Failed to open image {file_path.name}: {e}")
-        return {"success": False, "error": f"Failed to open image: {e}"}
+        logger.warning(f"Contour detection failed: {e}")
+        return None
+
+def crop_geometry(prepared: Optional[Dict[str, Any]], crop_info: Dict[str, Any]) -> Optional[GeometryPlan]:
+    """Source-to-crop transform: the EXIF rotation, then the crop box"""
+    if crop_info["method"] == "original":
+        return GeometryPlan.identity(crop_info["original_size"])
+    if prepared is None or "box" not in crop_info:
+        return None
+    plan = GeometryPlan.identity(prepared["source"].size)
+    if prepared["rotation_angle"] > 0:
+        plan = plan.rotate(prepared["rotation_angle"], expand=True)
+    box = crop_info["box"]
+    return plan.crop((box["x1"], box["y1"], box["x2"], box["y2"]))
+
+def crop_image(source: Union[Path, Image.Image], output_folder: Path = None,
+               detection: Tuple[Dict[str, Any], Any] = None) -> Tuple[Image.Image, Dict[str, Any]]:
+    """Run the crop cascade (YOLO 0.35, YOLO 0.15, contours, original) on a path
+    or an already decoded image. Returns (image, crop_info) with the attempts made.
     
+    `detection` is a (prepared, boxes) pair from a batched prediction at the lowest
+    threshold; the YOLO thresholds are then applied to those boxes instead of
+    running the model again."""
+    name = source.name if isinstance(source, Path) else "in-memory image"
     attempts = []
+    result = None
     
-    # Try YOLO with original confidence threshold
-    logger.debug(f"Attempting YOLO detection with confidence 0.35 for {file_path.name}")
-    result = crop_with_yolo(file_path, out_path.parent, conf_threshold=0.35)
-    attempts.append({
-        "method": "yolo",
-        "confidence": 0.35,
-        "success": bool(result)
-    })
+    # Decode and orient once; every threshold and the contour fallback reuse it
+    prepared = detection[0] if detection else None
+    if prepared is None:
+        try:
+            prepared = prepare_for_yolo(source)
+        except Exception as e:
+            logger.error(f"Could not prepare {name} for detection: {e}")
     
-    # If YOLO fails, try with lower confidence
-    if not result:
-        logger.debug(f"Attempting YOLO detection with confidence 0.15 for {file_path.name}")
-        result = crop_with_yolo(file_path, out_path.parent, conf_threshold=0.15)
+    # Try YOLO with the original confidence threshold, then lower ones
+    for conf_threshold in STAGE_PARAMS["conf_thresholds"]:
+        logger.debug(f"Attempting YOLO detection with confidence {conf_threshold} for {name}")
+        if detection:
+            result = crop_from_boxes(*detection, conf_threshold)
+        elif prepared:
+            result = crop_with_yolo(source, output_folder, conf_threshold=conf_threshold, prepared=prepared)
         attempts.append({
             "method": "yolo",
-            "confidence": 0.15,
+            "confidence": conf_threshold,
             "success": bool(result)
         })
+        if result:
+            break
     
     # If YOLO still fails, try contour detection
     if not result:
-        logger.debug(f"Attempting contour detection for {file_path.name}")
-        result = detect_with_contours(file_path)
+        logger.debug(f"Attempting contour detection for {name}")
+        if prepared:
+            result = crop_prepared_with_contours(prepared)
+        else:
+            cropped = detect_with_contours(source)
+            result = (cropped, {}) if cropped else None
         attempts.append({
             "method": "contour",
             "success": bool(result)
         })
         if result:
             # For contour detection, create a simplified crop info
+            cropped, contour_info = result
             crop_info = {
                 "method": "contour",
-                "original_size": list(Image.open(file_path).size),
-                "cropped_size": list(result.size)
+                **contour_info,
+                "original_size": list(prepared["full_size"] if prepared else _open_source(source).size),
+                "cropped_size": list(cropped.size)
             }
-            result = (result, crop_info)
+            result = (cropped, crop_info)
     
     # If all detection methods fail, use original image
     if not result:
-        logger.warning(f"Using original image as fallback for {file_path.name}")
-        original = Image.open(file_path)
+        logger.warning(f"Using original image as fallback for {name}")
+        original = _open_source(source)
         crop_info = {
             "method": "original",
             "original_size": list(original.size),
@@ -306,23 +484,58 @@ def process_image(file_path: Path, out_path: Path) -> dict:
             "success": True
         })
     
-    # Convert to JPG if needed
     image, crop_info = result
+    crop_info["attempts"] = attempts
+    geometry = crop_geometry(prepared, crop_info)
+    if geometry is not None:
+        crop_info["geometry"] = [geometry.to_dict()]
+    return image, crop_info
+
+def process_page(image: Image.Image, file_path: Path = None) -> tuple[list[Image.Image], dict]:
+    """Crop an in-memory page (EXIF is read from the image if present).
+    Returns ([cropped RGB image], crop_info)"""
+    cropped, crop_info = crop_image(image)
+    if cropped.mode != 'RGB':
+        cropped = cropped.convert('RGB')
+    return [cropped], crop_info
+
+def process_image(file_path: Path, out_path: Path, detection: Tuple[Dict[str, Any], Any] = None) -> dict:
+    """Process a single image file (optionally with boxes from a batched prediction)"""
+    # Get source folder structure from input path
+    source_dir = Path(file_path).parts[1:]  # Skip the first part (documents)
+    
+    if detection:
+        # Already decoded and predicted by the batched path
+        image, crop_info = crop_image(detection[0]["source"], out_path.parent, detection)
+        crop_info["inference"] = "batched"
+    else:
+        # Verify file exists and is readable
+        if not file_path.exists():
+            logger.error(f"File does not exist: {file_path}")
+            return {"success": False, "error": "File not found"}
+        
+        try:
+            # Open once; detection and fallbacks all share this image and its EXIF.
+            # Pixels are decoded lazily so JPEG detection can use draft mode.
+            source = Image.open(file_path)
+            logger.debug(f"Successfully opened image: {file_path.name} (format: {source.format})")
+        except Exception as e:
+            logger.error(f"Failed to open image {file_path.name}: {e}")
+            return {"success": False, "error": f"Failed to open image: {e}"}
+        
+        image, crop_info = crop_image(source, out_path.parent)
+    
+    # Convert to JPG if needed
     if image.format != 'JPEG':
         logger.debug(f"Converting {file_path.name} from {image.format} to JPEG")
         image = image.convert('RGB')
     
-    # Save the result as JPG with lowercase extension
-    out_path = out_path.with_suffix('.jpg')
-    image.save(out_path, 'JPEG', quality=95)
+    # Save the result with the configured codec (lowercase extension)
+    out_path, crop_info["codec"] = save_image(image, out_path, STAGE_PARAMS["image_format"], STAGE_PARAMS["jpeg_quality"])
     logger.debug(f"Saved cropped image to {out_path}")
     
     # Build output path preserving full source hierarchy
-    # Use the same directory structure but with lowercase .jpg extension
-    rel_path = Path(*source_dir[:-1]) / out_path.with_suffix('.jpg').name
-    
-    # Add attempts to the crop info
-    crop_info["attempts"] = attempts
+    rel_path = Path(*source_dir[:-1]) / out_path.name
     
     return {
         "outputs": [str(rel_path)],
@@ -349,19 +562,18 @@ def process_pdf(file_path: Path, out_path: Path) -> dict:
         page_path = pdf_dir / f"page_{i + 1}.jpg"
         image.save(page_path, "JPEG", quality=95)
         
-        # Process with YOLO
-        result = crop_with_yolo(page_path, pdf_dir, conf_threshold=0.35)
+        # Process with YOLO (on the rendered page, no need to decode the saved JPEG)
+        result = crop_with_yolo(image, pdf_dir, conf_threshold=0.35)
         
         if result:
-            # Save cropped page as JPG
-            cropped_path = pdf_dir / f"page_{i + 1}_cropped.jpg"
-            result[0].save(cropped_path, "JPEG", quality=95)
+            # Save cropped page with the configured codec
+            cropped_path, codec = save_image(result[0], pdf_dir / f"page_{i + 1}_cropped", STAGE_PARAMS["image_format"], STAGE_PARAMS["jpeg_quality"])
             
             # Build relative path preserving hierarchy
-            rel_path = Path(*source_dir) / f"{out_path.stem}" / f"page_{i + 1}_cropped.jpg"
+            rel_path = Path(*source_dir) / f"{out_path.stem}" / cropped_path.name
             outputs.append(str(rel_path))
             
-            details[f"page_{i + 1}"] = result[1]  # Include the crop info
+            details[f"page_{i + 1}"] = {**result[1], "codec": codec}  # Include the crop info
         else:
             details[f"page_{i + 1}"] = {
                 "success": False,
@@ -379,12 +591,12 @@ def process_pdf(file_path: Path, out_path: Path) -> dict:
         "details": details
     }
 
-def process_document(file_path: str, output_folder: Path) -> dict:
+def process_document(file_path: str, output_folder: Path, detection: Tuple[Dict[str, Any], Any] = None) -> dict:
     """Process a single document file"""
     file_path = Path(file_path)
     
     def process_fn(f: str, o: Path) -> dict:
-        return process_image(Path(f), o)
+        return process_image(Path(f), o, detection)
     
     return process_file(
         file_path=str(file_path),
@@ -400,18 +612,105 @@ def process_document(file_path: str, output_folder: Path) -> dict:
         }
     )
 
+def _prefetch(items: List[str], fn, depth: int):
+    """Yield (item, fn(item)) computed by a background thread at most `depth` items ahead"""
+    results = queue.Queue(maxsize=depth)
+    done = object()
+    
+    def worker():
+        for item in items:
+            results.put((item, fn(item)))
+        results.put(done)
+    
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        entry = results.get()
+        if entry is done:
+            return
+        yield entry
+
+def _prepare_file(file_path: str) -> Optional[Dict[str, Any]]:
+    """Decode and letterbox one file for batched detection (None if unreadable)"""
+    try:
+        prepared = prepare_for_yolo(Image.open(file_path), letterbox=True)
+        # Decode the full image here too so the main thread only runs the model
+        full_image(prepared).load()
+        return prepared
+    except Exception as e:
+        logger.error(f"Failed to prepare {Path(file_path).name} for batched detection: {e}")
+        return None
+
+def process_documents_batched(file_paths: List[str], output_folder: Path, yolo_batch: int = 8) -> List[dict]:
+    """Crop many files with one YOLO forward pass per `yolo_batch` images.
+    
+    A background thread decodes and letterboxes upcoming images while the model
+    runs. Each batch is predicted once at the lowest confidence threshold and the
+    0.35/0.15 cascade is applied to those boxes, so no image needs a second pass.
+    PDFs and images that fail to decode go through the regular per-file path."""
+    results = {}
+    images = [f for f in file_paths if Path(f).suffix.lower() in ('.jpg', '.jpeg', '.tif', '.tiff', '.png')]
+    for f in file_paths:
+        if f not in images:
+            results[f] = process_document(f, output_folder)
+    
+    batch = []
+    prefetched = _prefetch(images, _prepare_file, depth=yolo_batch)
+    for i, (file_path, prepared) in enumerate(prefetched, start=1):
+        batch.append((file_path, prepared))
+        if len(batch) < yolo_batch and i < len(images):
+            continue
+        
+        ready = [(f, p) for f, p in batch if p is not None]
+        detections = {}
+        if ready:
+            try:
+                boxes = detect_batch([p["model_img"] for _, p in ready], min(STAGE_PARAMS["conf_thresholds"]))
+                detections = {f: (p, b) for (f, p), b in zip(ready, boxes)}
+            except Exception as e:
+                logger.error(f"Batched YOLO prediction failed, falling back to per-image: {e}")
+        for f, _ in batch:
+            results[f] = process_document(f, output_folder, detections.get(f))
+        batch = []
+    
+    return [results[f] for f in file_paths]
+
 def crop(
     source_folder: Path = typer.Argument(..., help="Source folder containing documents"),
     source_manifest: Path = typer.Argument(..., help="Manifest file"),
-    output_folder: Path = typer.Argument(..., help="Output folder for cropped images")
+    output_folder: Path = typer.Argument(..., help="Output folder for cropped images"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite"),
+    yolo_batch: int = typer.Option(1, help="Images per batched YOLO forward pass; above 1 enables batched mode"),
+    model_format: str = typer.Option("pt", help="YOLO runtime: pt, onnx or openvino (exported once and cached next to the model)"),
+    image_format: str = typer.Option(STAGE_PARAMS["image_format"], help="Codec for cropped pages: jpeg, png, png-fast, webp, jxl or npy"),
+    page_cache: bool = typer.Option(False, help="Also keep raw memory-mapped copies of the pages under <assets>/page_cache for the next stage")
 ):
     """Crop images from documents using YOLO detection"""
+    global _model_format
+    if model_format not in MODEL_FORMATS:
+        raise typer.BadParameter(f"Unknown model format: {model_format}. Choose from {', '.join(MODEL_FORMATS)}")
+    _model_format = model_format
+    try:
+        STAGE_PARAMS["image_format"] = check_format(image_format)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    configure_page_cache(page_cache)
+    batch_fn = None
+    if yolo_batch > 1:
+        if workers > 1:
+            console.print("[yellow]Batched YOLO runs in a single process; ignoring --workers")
+        batch_fn = lambda paths, o: process_documents_batched(paths, o, yolo_batch)
     processor = BatchProcessor(
         input_manifest=source_manifest,
         output_folder=output_folder,
         process_name="crop",
         base_folder=source_folder,  # Paths in manifest already include documents/
-        processor_fn=lambda f, o: process_document(f, o)
+        processor_fn=lambda f, o: process_document(f, o),
+        workers=workers,
+        manifest_backend=manifest_backend,
+        # Batched mode letterboxes the model input, which can shift boxes slightly
+        params={**STAGE_PARAMS, "batched": yolo_batch > 1},
+        batch_fn=batch_fn
     )
     processor.process()
 
@@ -5,34 +5,148 @@ import numpy as np
 import cv2
 from utils.batch import BatchProcessor
 from utils.processor import process_file
+from utils.analysis import DEFAULT_ANALYSIS_MAX_SIDE, analysis_level
+from utils.image_io import IMAGE_SUFFIXES, check_format, image_suffix, load_image, save_image
+from utils.page_cache import configure as configure_page_cache
 from rich.console import Console
 from typing import Literal
 import pytesseract
 from sklearn.cluster import KMeans
 from collections import Counter
+import threading
 
 DocumentType = Literal['handwritten', 'typescript', 'mixed']
 PaperType = Literal['lined', 'plain']
 ContentType = Literal['text', 'diagram', 'mixed']
 
+# Models live in the project's models/ folder, wherever the script is run from
+MODELS_DIR = Path(__file__).resolve().parent.parent / "models"
+
+STAGE_PARAMS = {
+    "version": 2,
+    "jpeg_quality": 100,
+    # Codec for the enhanced pages (see utils.image_io.IMAGE_FORMATS)
+    "image_format": "jpeg",
+    # How the CLAHE profile is picked: "ocr" (Tesseract confidence) or "fast"
+    # (stroke and component features, much faster). The fast rules are not yet
+    # checked against OCR labels; train_doc_type.py reports their agreement
+    "doc_type_classifier": "ocr",
+    # Optional scikit-learn model in models/ (see train_doc_type.py) used by "fast"
+    "doc_type_model": "",
+    # Longest side (px) of the copy used for document analysis; 0 analyses at full resolution
+    "analysis_max_side": DEFAULT_ANALYSIS_MAX_SIDE
+}
+
+# Feature order used by the optional trained model
+DOC_TYPE_FEATURES = [
+    "components_per_mpx",
+    "component_height_cv",
+    "wide_component_ratio",
+    "stroke_width",
+    "stroke_width_cv",
+    "stroke_density"
+]
+
+# Pages with fewer components have too little ink for the feature classifiers
+MIN_DOC_TYPE_COMPONENTS = 20
+
+_doc_type_model = None
+
+def get_doc_type_model():
+    """Load the trained document-type model once per process (None if not configured)"""
+    global _doc_type_model
+    if _doc_type_model is None and STAGE_PARAMS["doc_type_model"]:
+        import joblib
+        _doc_type_model = joblib.load(MODELS_DIR / STAGE_PARAMS["doc_type_model"])
+    return _doc_type_model
+
+def stroke_density(binary: np.ndarray) -> float:
+    """Percentage of pixels on a stroke edge (morphological gradient of the binarized page)"""
+    kernel = np.ones((3, 3), np.uint8)
+    morph_grad = cv2.morphologyEx(binary, cv2.MORPH_GRADIENT, kernel)
+    return (cv2.countNonZero(morph_grad) / (morph_grad.shape[0] * morph_grad.shape[1])) * 100
+
+def rules_doc_type(features: dict) -> str:
+    """Majority vote of hand-set thresholds on page features (no model needed)"""
+    votes = [
+        features["component_height_cv"] > 0.35,
+        features["wide_component_ratio"] > 0.35,
+        features["stroke_width_cv"] > 0.45
+    ]
+    return 'handwritten' if sum(votes) >= 2 else 'typescript'
+
+def page_features(gray: np.ndarray) -> dict:
+    """
+    Cheap handwriting/typescript cues from a (reduced) grayscale page:
+    - typed glyphs are separate components of regular height, while cursive
+      joins letters into wide components of varying height
+    - stroke widths (twice the distance-transform ridge) vary with pen pressure
+    """
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    height, width = ink.shape
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    stats = stats[1:]
+    # Drop specks, and ruled lines or borders spanning the page
+    keep = (stats[:, cv2.CC_STAT_AREA] >= 6) & (stats[:, cv2.CC_STAT_WIDTH] < width * 0.3) & (stats[:, cv2.CC_STAT_HEIGHT] < height * 0.1)
+    comp_w = stats[keep, cv2.CC_STAT_WIDTH].astype(np.float64)
+    comp_h = stats[keep, cv2.CC_STAT_HEIGHT].astype(np.float64)
+
+    dist = cv2.distanceTransform(ink, cv2.DIST_L2, 3)
+    ridge = (dist > 0) & (dist >= cv2.dilate(dist, np.ones((3, 3), np.uint8)))
+    widths = dist[ridge] * 2
+
+    return {
+        "components": int(keep.sum()),
+        "components_per_mpx": float(keep.sum() / (height * width) * 1e6),
+        "component_height_cv": float(comp_h.std() / comp_h.mean()) if len(comp_h) else 0.0,
+        "wide_component_ratio": float(np.mean(comp_w > 2 * comp_h)) if len(comp_h) else 0.0,
+        "stroke_width": float(np.median(widths)) if len(widths) else 0.0,
+        "stroke_width_cv": float(widths.std() / widths.mean()) if len(widths) else 0.0,
+        "stroke_density": stroke_density(ink)
+    }
+
 class DocumentAnalyzer:
+    def __init__(self, classifier: str = "ocr"):
+        self.classifier = classifier
+
     def analyze_image(self, img_array: np.ndarray) -> dict:
         """
         Simplified document analysis.
-        Adds fallback morphological heuristic if OCR confidence is inconclusive.
+        Document type comes from page features (or OCR confidence with the
+        "ocr" classifier), with a morphological fallback when inconclusive.
         """
         gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
         
         # Document type detection
-        doc_type = self._detect_document_type(gray)
+        if self.classifier == "ocr":
+            doc_type = self._detect_document_type(gray)
+            analysis = {"document_type": doc_type, "classifier": "ocr"}
+        else:
+            features = page_features(gray)
+            doc_type, method = self._classify_features(features, gray)
+            analysis = {
+                "document_type": doc_type,
+                "classifier": method,
+                "features": {k: round(v, 4) for k, v in features.items()}
+            }
         
         # Background color (yellowing) analysis
-        is_yellowed = self._detect_yellowing(img_array)
-        
-        return {
-            "document_type": doc_type,
-            "is_yellowed": is_yellowed
-        }
+        analysis["is_yellowed"] = self._detect_yellowing(img_array)
+        return analysis
+
+    def _classify_features(self, features: dict, gray: np.ndarray) -> tuple[str, str]:
+        """Pick handwritten/typescript from page features. Returns (type, method)"""
+        if features["components"] < MIN_DOC_TYPE_COMPONENTS:
+            # Too little ink to judge shapes
+            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            return self._morphological_heuristic(binary), "morphological"
+
+        model = get_doc_type_model()
+        if model is not None:
+            row = [[features[name] for name in model["features"]]]
+            return str(model["model"].predict(row)[0]), "model"
+
+        return rules_doc_type(features), "rules"
     
     def _detect_document_type(self, gray: np.ndarray) -> str:
         """
@@ -69,11 +183,8 @@ class DocumentAnalyzer:
         - If there's a large amount of small connected strokes, assume handwriting
         - Otherwise, assume typescript
         """
-        kernel = np.ones((3, 3), np.uint8)
-        morph_grad = cv2.morphologyEx(binary, cv2.MORPH_GRADIENT, kernel)
         # Density of 'edges' or strokes
-        non_zero = cv2.countNonZero(morph_grad)
-        density = (non_zero / (morph_grad.shape[0] * morph_grad.shape[1])) * 100
+        density = stroke_density(binary)
         
         # Heuristic threshold for stroke density
         return 'handwritten' if density > 0.5 else 'typescript'
@@ -93,54 +204,210 @@ class DocumentAnalyzer:
         
         return max(0, min(1, raw_yellow))
 
+# CLAHE settings (and optional lightness stretch) per document type
+CLAHE_PROFILES = {
+    "handwritten": {"clip_limit": 2.2, "grid": (8, 8), "alpha": 1.1, "beta": -5},
+    "typescript": {"clip_limit": 1.6, "grid": (16, 16)}
+}
+SHARPEN_SIGMA = 3
+# Rows enhanced at a time; bounds working memory on huge scans
+STRIP_ROWS = 1024
+
+def _runs(values: np.ndarray) -> list[tuple[int, int]]:
+    """(start, end) index ranges over which `values` stays the same"""
+    breaks = np.flatnonzero(np.diff(values)) + 1
+    edges = np.concatenate(([0], breaks, [len(values)]))
+    return list(zip(edges[:-1], edges[1:]))
+
+class TiledCLAHE:
+    """
+    OpenCV's CLAHE, split into two streaming passes so a page can be
+    processed strip by strip: tile histograms are accumulated over the
+    strips first, then each strip is mapped through the bilinearly
+    interpolated tile LUTs. Clip limit, excess redistribution, reflect-101
+    padding and the float32 interpolation follow cv2.createCLAHE.
+    """
+
+    def __init__(self, clip_limit: float, grid: tuple[int, int]):
+        self.clip_limit = clip_limit
+        self.tiles_x, self.tiles_y = grid
+
+    def start(self, width: int, height: int):
+        """Lay out the tiles for a page and reset the histograms"""
+        tiles_x, tiles_y = self.tiles_x, self.tiles_y
+        if width % tiles_x == 0 and height % tiles_y == 0:
+            self.pad_x = self.pad_y = 0
+        else:
+            self.pad_x, self.pad_y = tiles_x - width % tiles_x, tiles_y - height % tiles_y
+        self.height = height
+        self.tile_w = (width + self.pad_x) // tiles_x
+        self.tile_h = (height + self.pad_y) // tiles_y
+        self.hists = np.zeros((tiles_y, tiles_x, 256), dtype=np.int64)
+
+        # Column interpolation weights are the same for every row
+        txf = np.arange(width, dtype=np.float32) * (np.float32(1) / np.float32(self.tile_w)) - np.float32(0.5)
+        tx1 = np.floor(txf).astype(np.int32)
+        self.xa = (txf - tx1).astype(np.float32)
+        self.xa1 = np.float32(1) - self.xa
+        self.tx1 = np.maximum(tx1, 0)
+        self.tx2 = np.minimum(tx1 + 1, tiles_x - 1)
+        self.col_runs = _runs(tx1)
+
+    @property
+    def padded_height(self) -> int:
+        return self.height + self.pad_y
+
+    def source_rows(self, start: int, end: int) -> np.ndarray:
+        """Page rows for padded rows [start, end), mirrored past the bottom edge"""
+        rows = np.arange(start, end)
+        return np.where(rows < self.height, rows, 2 * (self.height - 1) - rows)
+
+    def accumulate(self, l: np.ndarray, start: int):
+        """Add padded rows [start, start + len(l)) of the lightness channel to the tile histograms"""
+        if self.pad_x:
+            l = cv2.copyMakeBorder(l, 0, 0, 0, self.pad_x, cv2.BORDER_REFLECT_101)
+        end = start + len(l)
+        for ty in range(start // self.tile_h, min(self.tiles_y, -(-end // self.tile_h))):
+            r0, r1 = max(start, ty * self.tile_h) - start, min(end, (ty + 1) * self.tile_h) - start
+            for tx in range(self.tiles_x):
+                tile = l[r0:r1, tx * self.tile_w:(tx + 1) * self.tile_w]
+                self.hists[ty, tx] += cv2.calcHist([tile], [0], None, [256], [0, 256])[:, 0].astype(np.int64)
+
+    def compute_luts(self):
+        """Clip and redistribute each tile histogram, then build its equalization LUT"""
+        area = self.tile_w * self.tile_h
+        clip = max(int(self.clip_limit * area / 256), 1)
+        hists = self.hists.reshape(-1, 256)
+        excess = np.maximum(hists - clip, 0).sum(axis=1)
+        hists = np.minimum(hists, clip) + (excess // 256)[:, None]
+        for hist, residual in zip(hists, excess % 256):
+            if residual:
+                step = max(256 // residual, 1)
+                hist[np.arange(0, 256, step)[:residual]] += 1
+        scale = np.float32(255) / np.float32(area)
+        luts = np.rint(np.cumsum(hists, axis=1).astype(np.float32) * scale)
+        self.luts = np.clip(luts, 0, 255).astype(np.uint8).reshape(self.tiles_y, self.tiles_x, 256)
+
+    def apply(self, l: np.ndarray, start: int) -> np.ndarray:
+        """Equalize page rows [start, start + len(l)) of the lightness channel"""
+        tyf = np.arange(start, start + len(l), dtype=np.float32) * (np.float32(1) / np.float32(self.tile_h)) - np.float32(0.5)
+        ty1 = np.floor(tyf).astype(np.int32)
+        ya = (tyf - ty1).astype(np.float32)[:, None]
+        ya1 = np.float32(1) - ya
+        ty2 = np.minimum(ty1 + 1, self.tiles_y - 1)
+        ty1c = np.maximum(ty1, 0)
+
+        out = np.empty_like(l)
+        for r0, r1 in _runs(ty1):
+            top, bottom = self.luts[ty1c[r0]], self.luts[ty2[r0]]
+            for c0, c1 in self.col_runs:
+                block = l[r0:r1, c0:c1]
+                t1, t2 = self.tx1[c0], self.tx2[c0]
+                xa, xa1 = self.xa[c0:c1], self.xa1[c0:c1]
+                upper = cv2.LUT(block, top[t1]) * xa1 + cv2.LUT(block, top[t2]) * xa
+                lower = cv2.LUT(block, bottom[t1]) * xa1 + cv2.LUT(block, bottom[t2]) * xa
+                res = upper * ya1[r0:r1] + lower * ya[r0:r1]
+                out[r0:r1, c0:c1] = np.clip(np.rint(res), 0, 255)
+        return out
+
 class DocumentEnhancer:
-    def enhance(self, img: np.ndarray, doc_type: str, is_yellowed: float) -> np.ndarray:
+    """
+    Enhances pages in horizontal strips so working memory is bounded by the
+    strip size, not the scan size. CLAHE tile histograms are gathered in a
+    first pass over the strips; the second pass equalizes, corrects the
+    colour cast and sharpens each strip (with enough extra rows for the blur)
+    in reusable buffers and writes it into the output. CLAHE objects are
+    reused across pages.
+    """
+
+    def __init__(self, strip_rows: int = STRIP_ROWS):
+        self.strip_rows = strip_rows
+        self._clahe = {}
+        self._buffers = {}
+
+    def _get_clahe(self, doc_type: str, profile: dict) -> TiledCLAHE:
+        if doc_type not in self._clahe:
+            self._clahe[doc_type] = TiledCLAHE(profile["clip_limit"], profile["grid"])
+        return self._clahe[doc_type]
+
+    def _buffer(self, name: str, shape: tuple) -> np.ndarray:
+        """A reusable uint8 work buffer of the given shape (grown when needed)"""
+        size = int(np.prod(shape))
+        buf = self._buffers.get(name)
+        if buf is None or buf.size < size:
+            buf = self._buffers[name] = np.empty(size, dtype=np.uint8)
+        return buf[:size].reshape(shape)
+
+    def _lab(self, rgb: np.ndarray) -> np.ndarray:
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB, dst=self._buffer("lab", rgb.shape))
+
+    def enhance(self, img: np.ndarray, doc_type: str, is_yellowed: float, out: np.ndarray = None) -> np.ndarray:
         """
         Core document enhancement logic with gentle color correction
         """
-        # Convert to LAB for processing
-        lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
-        l, a, b = cv2.split(lab)
-        
-        # STEP 1: Enhance text contrast using CLAHE
-        if doc_type == 'handwritten':
-            clahe = cv2.createCLAHE(clipLimit=2.2, tileGridSize=(8, 8))
-            l = clahe.apply(l)
-            l = cv2.convertScaleAbs(l, alpha=1.1, beta=-5)
-        else:
-            clahe = cv2.createCLAHE(clipLimit=1.6, tileGridSize=(16, 16))
-            l = clahe.apply(l)
-        
-        # STEP 2: Handle color cast carefully
-        if is_yellowed > 0.1:
-            # Gentler yellow reduction
-            yellow_reduction = min(8, int(3 * is_yellowed))
-            b = cv2.subtract(b, yellow_reduction)
-            
-            # Very subtle a-channel adjustment
-            a = cv2.convertScaleAbs(a, alpha=0.98, beta=0)
-        
-        # Merge corrected channels
-        enhanced_lab = cv2.merge([l, a, b])
-        enhanced_rgb = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2RGB)
-        
-        # STEP 3: Sharpen
-        gaussian_blur = cv2.GaussianBlur(enhanced_rgb, (0, 0), 3)
-        sharpened = cv2.addWeighted(enhanced_rgb, 1.5, gaussian_blur, -0.5, 0)
-        
-        return sharpened
+        height, width = img.shape[:2]
+        profile = CLAHE_PROFILES['handwritten' if doc_type == 'handwritten' else 'typescript']
+        clahe = self._get_clahe(doc_type, profile)
+        clahe.start(width, height)
+
+        # Pass 1: CLAHE tile histograms of the lightness channel
+        for start in range(0, clahe.padded_height, self.strip_rows):
+            rows = clahe.source_rows(start, min(start + self.strip_rows, clahe.padded_height))
+            strip = self._buffer("strip", (len(rows), width, 3))
+            np.take(img, rows, axis=0, out=strip)
+            clahe.accumulate(cv2.extractChannel(self._lab(strip), 0), start)
+        clahe.compute_luts()
+
+        # Pass 2: enhance each strip plus the rows the unsharp mask's blur reaches
+        blur_radius = int(np.ceil(4 * SHARPEN_SIGMA))
+        out = np.empty_like(img) if out is None else out
+        for y0 in range(0, height, self.strip_rows):
+            y1 = min(height, y0 + self.strip_rows)
+            s0, s1 = max(0, y0 - blur_radius), min(height, y1 + blur_radius)
+            lab = self._lab(img[s0:s1])
+
+            # STEP 1: Enhance text contrast using CLAHE
+            l = clahe.apply(cv2.extractChannel(lab, 0), s0)
+            if "alpha" in profile:
+                l = cv2.convertScaleAbs(l, alpha=profile["alpha"], beta=profile["beta"])
+            cv2.insertChannel(l, lab, 0)
+
+            # STEP 2: Handle color cast carefully
+            if is_yellowed > 0.1:
+                # Gentler yellow reduction
+                yellow_reduction = min(8, int(3 * is_yellowed))
+                cv2.insertChannel(cv2.subtract(cv2.extractChannel(lab, 2), yellow_reduction), lab, 2)
+                # Very subtle a-channel adjustment
+                cv2.insertChannel(cv2.convertScaleAbs(cv2.extractChannel(lab, 1), alpha=0.98, beta=0), lab, 1)
+            rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB, dst=self._buffer("rgb", lab.shape))
 
-def enhance_image(image: Image.Image) -> tuple[Image.Image, dict]:
-    """Simplified enhancement pipeline"""
+            # STEP 3: Sharpen
+            blurred = cv2.GaussianBlur(rgb, (0, 0), SHARPEN_SIGMA, dst=self._buffer("blur", rgb.shape))
+            sharpened = cv2.addWeighted(rgb, 1.5, blurred, -0.5, 0, dst=self._buffer("sharp", rgb.shape))
+            out[y0:y1] = sharpened[y0 - s0:y1 - s0]
+
+        return out
+
+# One enhancer (CLAHE objects and strip buffers) per worker thread, reused across pages
+_local = threading.local()
+
+def get_enhancer() -> DocumentEnhancer:
+    if not hasattr(_local, "enhancer"):
+        _local.enhancer = DocumentEnhancer()
+    return _local.enhancer
+
+def enhance_image(image: Image.Image, analysis_max_side: int = None, classifier: str = "ocr") -> tuple[Image.Image, dict]:
+    """Simplified enhancement pipeline: analyse a reduced copy, enhance at full resolution"""
     img_array = np.array(image)
     
     # Analyze document
-    analyzer = DocumentAnalyzer()
-    analysis = analyzer.analyze_image(img_array)
+    level = analysis_level(image, analysis_max_side)
+    analyzer = DocumentAnalyzer(classifier)
+    analysis = analyzer.analyze_image(img_array if level.factor == 1 else np.array(level.image))
+    analysis["analysis_scale"] = level.factor
     
     # Enhance document
-    enhancer = DocumentEnhancer()
-    enhanced = enhancer.enhance(
+    enhanced = get_enhancer().enhance(
         img_array,
         analysis['document_type'],
         analysis['is_yellowed']
@@ -148,9 +415,23 @@ def enhance_image(image: Image.Image) -> tuple[Image.Image, dict]:
     
     return Image.fromarray(enhanced), {"analysis": analysis}
 
+def process_page(image: Image.Image, file_path: Path = None) -> tuple[list[Image.Image], dict]:
+    """Enhance an in-memory RGB page. Returns ([enhanced], details)"""
+    enhanced, params = enhance_image(
+        image,
+        analysis_max_side=STAGE_PARAMS["analysis_max_side"],
+        classifier=STAGE_PARAMS["doc_type_classifier"]
+    )
+    details = {
+        "original_size": list(image.size),
+        "enhanced_size": list(enhanced.size),
+        "enhancement_params": params
+    }
+    return [enhanced], details
+
 def process_image(file_path: Path, out_path: Path) -> dict:
     """Process a single image file for enhancement"""
-    img = Image.open(file_path)
+    img, read_stats = load_image(file_path)
     if img.mode != 'RGB':
         img = img.convert('RGB')
 
@@ -158,21 +439,15 @@ def process_image(file_path: Path, out_path: Path) -> dict:
     source_dir = Path(file_path).parts[-4:-1]
     
     # Enhance image and get parameters
-    enhanced, params = enhance_image(img)
+    (enhanced,), details = process_page(img, file_path)
     
     # Save enhanced image
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    enhanced.save(out_path, "JPEG", quality=100)
+    out_path, write_stats = save_image(enhanced, out_path, STAGE_PARAMS["image_format"], STAGE_PARAMS["jpeg_quality"])
+    details["codec"] = {"read": read_stats, "write": write_stats}
     
     # Build output path preserving full source hierarchy
     rel_path = Path(*source_dir) / out_path.name
     
-    details = {
-        "original_size": list(img.size),
-        "enhanced_size": list(enhanced.size),
-        "enhancement_params": params
-    }
-    
     return {
         "outputs": [str(rel_path)],
         "details": details
@@ -189,27 +464,44 @@ def process_document(file_path: str, output_folder: Path) -> dict:
         file_path=str(file_path),
         output_folder=output_folder,
         process_fn=process_fn,
-        file_types={
-            '.jpg': process_fn,
-            '.jpeg': process_fn,
-            '.tif': process_fn,
-            '.tiff': process_fn,
-            '.png': process_fn
-        }
+        file_types={suffix: process_fn for suffix in IMAGE_SUFFIXES}
     )
 
 def enhance(
     rotated_folder: Path = typer.Argument(..., help="Input rotated images folder"),
     rotated_manifest: Path = typer.Argument(..., help="Input rotated manifest file"),
-    enhanced_folder: Path = typer.Argument(..., help="Output folder for enhanced images")
+    enhanced_folder: Path = typer.Argument(..., help="Output folder for enhanced images"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite"),
+    analysis_max_side: int = typer.Option(STAGE_PARAMS["analysis_max_side"], help="Longest side (px) used for document analysis; 0 for full resolution"),
+    doc_type_classifier: str = typer.Option(STAGE_PARAMS["doc_type_classifier"], help="Document type classifier: fast or ocr"),
+    doc_type_model: str = typer.Option(STAGE_PARAMS["doc_type_model"], help="Trained classifier in models/ used by the fast classifier"),
+    image_format: str = typer.Option(STAGE_PARAMS["image_format"], help="Codec for enhanced pages: jpeg, png, png-fast, webp, jxl or npy"),
+    page_cache: bool = typer.Option(False, help="Also keep raw memory-mapped copies of the pages under <assets>/page_cache for the next stage"),
+    skip_existing: bool = typer.Option(False, help="Record inputs whose output file already exists as skipped instead of reprocessing them")
 ):
     """Enhance image quality of rotated document pages"""
+    if doc_type_classifier not in ("fast", "ocr"):
+        raise typer.BadParameter(f"Unknown classifier: {doc_type_classifier}")
+    try:
+        STAGE_PARAMS["image_format"] = check_format(image_format)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    configure_page_cache(page_cache)
+    STAGE_PARAMS["analysis_max_side"] = analysis_max_side
+    STAGE_PARAMS["doc_type_classifier"] = doc_type_classifier
+    STAGE_PARAMS["doc_type_model"] = doc_type_model
     processor = BatchProcessor(
         input_manifest=rotated_manifest,
         output_folder=enhanced_folder,
         process_name="enhance",
         base_folder=rotated_folder / "documents",  # Add /documents to match rotation's structure
-        processor_fn=lambda f, o: process_document(f, o)
+        processor_fn=lambda f, o: process_document(f, o),
+        workers=workers,
+        manifest_backend=manifest_backend,
+        params=STAGE_PARAMS,
+        skip_existing=skip_existing,
+        output_suffix=image_suffix(STAGE_PARAMS["image_format"])
     )
     processor.process()
 
@@ -496,7 +496,9 @@ def process_document(file_path: str, output_folder: Path) -> dict:
 def fuzzy_clean(
     recombined_folder: Path = typer.Argument(..., help="Path to the recombined files"),
     recombined_manifest: Path = typer.Argument(..., help="Path to the recombined manifest file"),
-    cleaned_folder: Path = typer.Argument(..., help="Output folder for cleaned files")
+    cleaned_folder: Path = typer.Argument(..., help="Output folder for cleaned files"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite")
 ):
     """Clean up text from recombined transcriptions"""
     
@@ -512,7 +514,9 @@ def fuzzy_clean(
         process_name="fuzzy_clean",
         processor_fn=lambda f, o: process_document(f, o),
         base_folder=recombined_folder,
-        use_source=True  # Use source path from manifest since we're processing MD files
+        use_source=True,  # Use source path from manifest since we're processing MD files
+        workers=workers,
+        manifest_backend=manifest_backend
     )
     
     return processor.process()
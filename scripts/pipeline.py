@@ -0,0 +1,222 @@
+"""
+Streaming Image-Prep Pipeline
+
+Runs crop -> split -> rotate -> enhance -> remove_background on each source
+document in memory. The source is decoded once, every stage's `process_page`
+hands its PIL images straight to the next stage, and only the final artifacts
+are encoded (plus optional per-stage snapshots for debugging).
+
+Each stage reports its crop or rotation as a geometry transform; they are
+composed per page, so the manifest records one source-to-output affine for
+every final image.
+
+The pipeline's own manifest (pipeline_manifest.jsonl) has one entry per
+source document listing all of its final pages; it is what reruns check.
+From it the pipeline also writes the last stage's manifest with one entry per
+page, keyed by the page as that stage would have read it, so the downstream
+commands in project.yml (segment, transcribe, recombine_segments, ...) work
+unchanged.
+"""
+
+import typer
+from PIL import Image
+from pathlib import Path
+from pdf2image import convert_from_path
+from typing import List
+from rich.console import Console
+from utils.batch import BatchProcessor
+from utils.manifest import ManifestProcessor
+from utils.processor import process_file
+from utils.geometry import GeometryPlan
+from utils.image_io import IMAGE_SUFFIXES, check_format, image_suffix, save_image
+from utils.page_cache import configure as configure_page_cache
+
+import crop as crop_stage
+import split as split_stage
+import rotate as rotate_stage
+import enhance as enhance_stage
+import remove_background as remove_background_stage
+
+console = Console()
+
+# Stage name -> (module, process_name used by the standalone stage). Pages are
+# encoded with each stage's own STAGE_PARAMS["image_format"].
+STAGES = {
+    "crop": (crop_stage, "crop"),
+    "split": (split_stage, "split"),
+    "rotate": (rotate_stage, "rotate"),
+    "enhance": (enhance_stage, "enhance"),
+    "remove_background": (remove_background_stage, "remove_multi_obj_black_bg"),
+}
+
+def parse_stages(stages: str) -> List[str]:
+    """Parse a comma-separated stage list, keeping pipeline order"""
+    names = [name.strip() for name in stages.split(",") if name.strip()]
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        raise typer.BadParameter(f"Unknown stages: {', '.join(unknown)}. Choose from {', '.join(STAGES)}")
+    return [name for name in STAGES if name in names]
+
+def save_page(image: Image.Image, path: Path, stage: str) -> tuple[Path, dict]:
+    """Encode a page with the given stage's output codec. Returns (path, codec stats)"""
+    params = STAGES[stage][0].STAGE_PARAMS
+    return save_image(image, path, params["image_format"], params.get("jpeg_quality", 100))
+
+def run_stages(pages: List[tuple[str, Image.Image]], file_path: Path, stages: List[str],
+               snapshot_stages: List[str], snapshot_root: Path, rel_dir: Path) -> tuple[list, dict]:
+    """
+    Push (name, image) pages through the stages in memory.
+    Returns the final (name, image) pages and per-stage details keyed by page name;
+    each final page's details include its composed source-to-page "geometry".
+    """
+    details = {}
+    plans = {name: GeometryPlan.identity(image.size) for name, image in pages}
+    for stage in stages:
+        module = STAGES[stage][0]
+        next_pages = []
+        for name, image in pages:
+            if image.mode != 'RGB' and stage != "crop":
+                image = image.convert('RGB')
+            outputs, stage_details = module.process_page(image, file_path)
+            details.setdefault(name, {})[stage] = stage_details
+            geometry = stage_details.get("geometry")
+            if geometry is None and len(outputs) == 1 and outputs[0].size == image.size:
+                # Stages that only change pixel values (enhance) keep the geometry
+                geometry = [GeometryPlan.identity(image.size).to_dict()]
+            geometry = geometry or []
+            for i, output in enumerate(outputs):
+                # Splitting is the only stage that fans out
+                out_name = f"{name}_part_{i+1}" if len(outputs) > 1 else name
+                if out_name != name:
+                    details[out_name] = {"parent": name}
+                # A stage that does not report its geometry ends the chain
+                plan = plans.get(name)
+                plans[out_name] = plan.then(GeometryPlan.from_dict(geometry[i])) if plan and len(geometry) == len(outputs) else None
+                next_pages.append((out_name, output))
+                if stage in snapshot_stages:
+                    save_page(output, snapshot_root / stage / "documents" / rel_dir / out_name, stage)
+        pages = next_pages
+    for name, _ in pages:
+        if plans.get(name):
+            details.setdefault(name, {})["geometry"] = plans[name].to_dict()
+    return pages, details
+
+def process_image(file_path: Path, out_path: Path, stages: List[str], snapshot_stages: List[str], snapshot_root: Path) -> dict:
+    """Run the in-memory pipeline on a single image or PDF"""
+    rel_dir = Path(*out_path.parent.parts[out_path.parent.parts.index('documents')+1:])
+    if file_path.suffix.lower() == '.pdf':
+        pages = [(f"{out_path.stem}_page_{i+1}", page) for i, page in enumerate(convert_from_path(file_path, dpi=300))]
+    else:
+        # Decoded lazily by the first stage; crop reads EXIF orientation from it
+        pages = [(out_path.stem, Image.open(file_path))]
+
+    final_pages, details = run_stages(pages, file_path, stages, snapshot_stages, snapshot_root, rel_dir)
+
+    outputs = []
+    for name, image in final_pages:
+        saved, details.setdefault(name, {})["codec"] = save_page(image, out_path.parent / name, stages[-1])
+        outputs.append(str(saved))
+
+    return {
+        "outputs": outputs,
+        "details": {
+            "stages": stages,
+            "snapshots": snapshot_stages,
+            "pages": details
+        }
+    }
+
+def write_page_manifest(documents: ManifestProcessor, output_folder: Path, stages: List[str], backend: str):
+    """
+    Write the last stage's manifest from the per-document pipeline manifest:
+    one entry per final page, its source named with the previous stage's codec
+    """
+    process_name = STAGES[stages[-1]][1]
+    pages = ManifestProcessor(manifest_path=output_folder / f"{process_name}_manifest.jsonl", backend=backend)
+    # Rebuilt every run, so pages of reprocessed documents do not linger
+    pages.entries.clear()
+    for doc in documents.iter_entries(success=True):
+        page_details = doc.get("details", {}).get("pages", {})
+        for output in doc.get("outputs", []):
+            page = Path(output)
+            if len(stages) > 1:
+                source = page.with_suffix(image_suffix(STAGES[stages[-2]][0].STAGE_PARAMS["image_format"]))
+            else:
+                source = page.with_suffix(Path(doc["source"]).suffix)
+            pages.save_entry({
+                "source": str(source),
+                "outputs": [output],
+                "document": doc["source"],
+                "processed_at": doc.get("processed_at"),
+                "success": True,
+                "params_fingerprint": doc.get("params_fingerprint"),
+                "details": page_details.get(page.stem, {})
+            })
+    pages.compact()
+
+def process_document(file_path: str, output_folder: Path, stages: List[str], snapshot_stages: List[str]) -> dict:
+    """Process a single document file"""
+    file_path = Path(file_path)
+    snapshot_root = output_folder / "snapshots"
+
+    def process_fn(f: Path, o: Path) -> dict:
+        return process_image(Path(f), o, stages, snapshot_stages, snapshot_root)
+
+    return process_file(
+        file_path=str(file_path),
+        output_folder=output_folder,
+        process_fn=process_fn,
+        file_types={
+            '.pdf': process_fn,
+            **{suffix: process_fn for suffix in IMAGE_SUFFIXES}
+        }
+    )
+
+def pipeline(
+    source_folder: Path = typer.Argument(..., help="Source folder containing documents"),
+    source_manifest: Path = typer.Argument(..., help="Documents manifest file"),
+    output_folder: Path = typer.Argument(..., help="Output folder for the final stage's images"),
+    stages: str = typer.Option(",".join(STAGES), help="Comma-separated stages to chain, in pipeline order"),
+    snapshots: str = typer.Option("", help="Comma-separated stages whose intermediate images are also saved"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite"),
+    image_format: str = typer.Option("", help="Codec for the final pages (jpeg, png, png-fast, webp, jxl or npy); defaults to the last stage's"),
+    page_cache: bool = typer.Option(False, help="Also keep raw memory-mapped copies of the final pages under <assets>/page_cache for the next stage")
+):
+    """Run the image-prep stages in memory, writing only final artifacts"""
+    stage_names = parse_stages(stages)
+    if not stage_names:
+        raise typer.BadParameter("No stages selected")
+    if image_format:
+        last_params = STAGES[stage_names[-1]][0].STAGE_PARAMS
+        if image_format == "jpeg" and last_params.get("output_mode") == "rgba":
+            raise typer.BadParameter("jpeg cannot store the alpha channel")
+        try:
+            last_params["image_format"] = check_format(image_format)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+    configure_page_cache(page_cache)
+    snapshot_stages = parse_stages(snapshots) if snapshots else []
+
+    console.print(f"[green]Pipeline: {' -> '.join(stage_names)}")
+    if snapshot_stages:
+        console.print(f"Saving snapshots for: {', '.join(snapshot_stages)}")
+
+    processor = BatchProcessor(
+        input_manifest=source_manifest,
+        output_folder=output_folder,
+        process_name="pipeline",
+        base_folder=source_folder,
+        processor_fn=lambda f, o: process_document(f, o, stage_names, snapshot_stages),
+        workers=workers,
+        manifest_backend=manifest_backend,
+        params={
+            "stages": {name: STAGES[name][0].STAGE_PARAMS for name in stage_names},
+            "snapshots": snapshot_stages
+        }
+    )
+    processor.process()
+    write_page_manifest(processor.output_proc, output_folder, stage_names, manifest_backend)
+
+if __name__ == "__main__":
+    typer.run(pipeline)
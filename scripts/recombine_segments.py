@@ -2,49 +2,44 @@ import typer
 from pathlib import Path
 from rich.console import Console
 from utils.batch import BatchProcessor
-from utils.files import ensure_dirs
+from utils.files import DirectoryIndex, ensure_dirs
+from utils.manifest import ManifestProcessor
+from utils.segment_handler import SegmentHandler
 import json
 import re
 from collections import defaultdict
 
 console = Console()
 
-def load_bg_removal_manifest(manifest_path: Path) -> dict:
-    """Load background removal manifest and create source->output mapping"""
-    mapping = {}
-    with open(manifest_path) as f:
-        for line in f:
-            entry = json.loads(line)
-            if entry.get("success"):
-                # Strip any project folder prefix from source
-                source = entry["source"]
-                if "documents/" in source:
-                    source = source.split("documents/")[1]
-                output = entry["outputs"][0]
-                mapping[source] = output
-    return mapping
+def load_bg_removal_manifest(manifest_path: Path, backend: str = "jsonl") -> ManifestProcessor:
+    """Open the background removal manifest for source->output lookups"""
+    return ManifestProcessor(manifest_path=manifest_path, backend=backend)
+
+def get_bg_removed_output(bg_manifest: ManifestProcessor, source: str):
+    """Get the background-removed output for a source, if it succeeded"""
+    entry = bg_manifest.get_entry(source)
+    if entry and entry.get("success") and entry.get("outputs"):
+        return entry["outputs"][0]
+    return None
 
 def numerical_sort(value):
     parts = re.split(r'(\d+)', value)
     return [int(part) if part.isdigit() else part for part in parts]
 
-def group_segments_by_parent(manifest_path: Path) -> dict:
+def group_segments_by_parent(manifest_path: Path, backend: str = "jsonl") -> dict:
     """Group segment files by their parent image"""
     console.print(f"[blue]Loading segments from manifest: {manifest_path}")
     groups = defaultdict(list)
     try:
-        with open(manifest_path) as f:
-            for line in f:
-                entry = json.loads(line)
-                if "source" in entry and entry.get("outputs"):
-                    source = entry["source"]
-                    # Use the source file as the parent rather than parent_image
-                    # This will group by actual image file instead of folder
-                    if "_segments/" in source:
-                        # Extract the parent image path from the segment path
-                        parent = source.split("_segments/")[0] + ".jpg"
-                        groups[parent].append(source)
-                        console.print(f"[blue]Added segment {source} to parent {parent}")
+        manifest = ManifestProcessor(manifest_path=manifest_path, backend=backend)
+        # One pass over all entries: error entries carry no parent_image but
+        # still count as skipped segments, so the parent comes from the path
+        for entry in manifest.iter_entries():
+            source = entry.get("source", "")
+            if "_segments/" in source and entry.get("outputs"):
+                parent = str(SegmentHandler.get_parent_image(source))
+                groups[parent].append(source)
+                console.print(f"[blue]Added segment {source} to parent {parent}")
     except Exception as e:
         console.print(f"[red]Error reading manifest {manifest_path}: {e}")
         raise
@@ -52,7 +47,8 @@ def group_segments_by_parent(manifest_path: Path) -> dict:
     console.print(f"[blue]Found {len(groups)} parent images")
     return dict(groups)
 
-def process_document(file_path: str, output_folder: Path, bg_mapping: dict, segments_mapping: dict, input_folder: Path) -> dict:
+def process_document(file_path: str, output_folder: Path, bg_manifest: ManifestProcessor, segments_mapping: dict, input_folder: Path,
+                     index: DirectoryIndex = None) -> dict:
     """Process segments belonging to the same source image"""
     try:
         console.print(f"\n[blue]====== Processing document ======")
@@ -73,13 +69,14 @@ def process_document(file_path: str, output_folder: Path, bg_mapping: dict, segm
             }
 
         # Get segments folder path and verify files exist
+        index = index or DirectoryIndex()
         md_files = []
         missing_segments = 0
         for segment in sorted(segment_files, key=lambda x: numerical_sort(Path(x).stem)):
             # Convert .jpg to .md and look in documents subfolder
             md_path = input_folder / "documents" / segment.replace('.jpg', '.md')
             console.print(f"[blue]Looking for segment file: {md_path}")
-            if md_path.exists():
+            if index.exists(md_path):
                 md_files.append(md_path)
             else:
                 missing_segments += 1
@@ -125,7 +122,7 @@ def process_document(file_path: str, output_folder: Path, bg_mapping: dict, segm
             
         return {
             "source": str(rel_path),  # Store relative path from documents/
-            "bg_removed": bg_mapping.get(str(rel_path)),  # Use relative path
+            "bg_removed": get_bg_removed_output(bg_manifest, str(rel_path)),  # Use relative path
             "outputs": [str(rel_path.with_suffix('.md'))],  # Use same relative path with .md
             "segments_joined": len(md_files),
             "segments_skipped": missing_segments,
@@ -140,7 +137,8 @@ def recombine_segments(
     input_folder: Path = typer.Argument(..., help="Path to the transcribed segments folder"),
     output_folder: Path = typer.Argument(..., help="Output folder for recombined files"),
     input_manifest: Path = typer.Argument(..., help="Path to the transcriptions manifest file"),
-    bg_removal_manifest: Path = typer.Argument(..., help="Path to the background removal manifest file")
+    bg_removal_manifest: Path = typer.Argument(..., help="Path to the background removal manifest file"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite")
 ):
     """Recombine transcribed segments back into full documents"""
     
@@ -149,17 +147,20 @@ def recombine_segments(
     ensure_dirs(output_folder / "documents")  # Create documents subfolder
     
     # Load manifests
-    bg_mapping = load_bg_removal_manifest(bg_removal_manifest)
-    segments_mapping = group_segments_by_parent(input_manifest)
+    bg_manifest = load_bg_removal_manifest(bg_removal_manifest, manifest_backend)
+    segments_mapping = group_segments_by_parent(input_manifest, manifest_backend)
     
     # Get unique parent images to process
     parent_images = list(segments_mapping.keys())
     console.print(f"[green]Found {len(parent_images)} parent images to process")
     
+    # Segment transcriptions are looked up in one listing per segments folder
+    index = DirectoryIndex()
+
     # Process each parent image
     results = []
     for parent in parent_images:
-        result = process_document(parent, output_folder, bg_mapping, segments_mapping, input_folder)
+        result = process_document(parent, output_folder, bg_manifest, segments_mapping, input_folder, index)
         results.append(result)
         
     try:
@@ -3,31 +3,68 @@ from PIL import Image
 from pathlib import Path
 import numpy as np
 import cv2
-from typing import Literal
+from typing import Literal, Optional
 
 from utils.batch import BatchProcessor
 from utils.processor import process_file
+from utils.geometry import GeometryPlan
+from utils.image_io import IMAGE_SUFFIXES, check_format, image_suffix, load_image, save_image
+from utils.page_cache import configure as configure_page_cache
+
+STAGE_PARAMS = {
+    "version": 2,
+    "black_thresh": 80,
+    "black_coverage_cutoff": 0.01,
+    # Longest side (px) of the copy the mask and alpha are built on; 0 for full resolution
+    "mask_max_side": 1000,
+    # "rgba" keeps the alpha; "rgb" writes the cropped page composited onto
+    # white, which downstream stages read without flattening
+    "output_mode": "rgba",
+    # With output_mode "rgb", also write the alpha as <page>.alpha.png
+    "alpha_sidecar": False,
+    # Codec for the pages (see utils.image_io.IMAGE_FORMATS); jpeg only for "rgb"
+    "image_format": "png",
+    "jpeg_quality": 95
+}
 
 class BlackBackgroundRemoverMulti:
     """
     A pipeline that:
     1) Thresholds for black background
-    2) Finds all external contours
-    3) Keeps a subset of contours based on heuristic (e.g., biggest or center-located)
+    2) Finds all external regions (filled connected components)
+    3) Keeps a subset of them based on heuristic (e.g., biggest or center-located)
     4) Morphologically refine, blur => alpha
     5) Crop final image to bounding box of alpha
+
+    Pixels darker than `black_thresh` count as background; pages with less
+    than `black_coverage_cutoff` of them are left untouched. Components and
+    the alpha are computed on a copy whose longest side is at most
+    `mask_max_side` (0 for full resolution).
     """
 
+    def __init__(self, mask_max_side: int = 1000, black_thresh: int = 80, black_coverage_cutoff: float = 0.01):
+        self.mask_max_side = mask_max_side
+        self.black_thresh = black_thresh
+        self.black_coverage_cutoff = black_coverage_cutoff
+
     def remove_background(self, img_array: np.ndarray) -> tuple[np.ndarray, dict]:
+        """Cropped RGBA page + debug params"""
+        rgb, alpha, params = self.remove_background_layers(img_array)
+        rgba = cv2.cvtColor(rgb, cv2.COLOR_RGB2RGBA)
+        if alpha is not None:
+            rgba[:, :, 3] = alpha
+        return rgba, params
+
+    def remove_background_layers(self, img_array: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray], dict]:
         """
         Steps:
         A) Check black coverage to skip if almost no black background.
-        B) Threshold for black => doc=white
-        C) Find contours, keep the ones we want (heuristics).
-        D) Combine kept contours into a mask
+        B) Threshold for black => doc=white, then reduce
+        C) Fill holes, find components, keep the ones we want (heuristics).
+        D) Combine kept components into a mask
         E) Morph open/close, blur => partial transparency
-        F) Crop to bounding box of alpha
-        G) Return final RGBA + debug params
+        F) Crop to bounding box of alpha, upsample alpha
+        G) Return the cropped RGB view, its alpha (None when fully opaque) + debug params
         """
 
         # Convert to grayscale
@@ -36,15 +73,13 @@ class BlackBackgroundRemoverMulti:
         image_area = h * w
 
         # A) Check black coverage (optional):
-        BLACK_THRESH = 80
-        black_pixels = np.count_nonzero(gray < BLACK_THRESH)
+        BLACK_THRESH = self.black_thresh
+        black_pixels = cv2.countNonZero(cv2.compare(gray, BLACK_THRESH, cv2.CMP_LT))
         black_ratio = black_pixels / float(image_area)
-        black_coverage_cutoff = 0.01  # if <1% black, skip removal
+        black_coverage_cutoff = self.black_coverage_cutoff  # below this, skip removal
         if black_ratio < black_coverage_cutoff:
             # skip => fully opaque
-            rgba_skip = cv2.cvtColor(img_array, cv2.COLOR_RGB2RGBA)
-            rgba_skip[:, :, 3] = 255
-            return rgba_skip, {
+            return img_array, None, {
                 "method": "skipped_almost_no_black",
                 "black_ratio": black_ratio,
                 "black_coverage_cutoff": black_coverage_cutoff,
@@ -55,112 +90,86 @@ class BlackBackgroundRemoverMulti:
         _, bin_mask = cv2.threshold(gray, BLACK_THRESH, 255, cv2.THRESH_BINARY)
         # bin_mask: 255 => doc/foreground, 0 => black background
 
-        # C) Find external contours
-        contours, _ = cv2.findContours(bin_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
+        # The mask and alpha are built on a reduced copy; only the final alpha
+        # is upsampled, and only over the crop box
+        scale = min(1.0, self.mask_max_side / max(h, w)) if self.mask_max_side else 1.0
+        small_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        small = cv2.resize(bin_mask, small_size, interpolation=cv2.INTER_AREA) if scale < 1 else bin_mask
+        _, small = cv2.threshold(small, 127, 255, cv2.THRESH_BINARY)
+        sx, sy = w / small_size[0], h / small_size[1]
+
+        # C) Fill holes (ink inside the page), so each component is what a filled
+        # external contour covers, then take every component's area and box at once
+        outside = cv2.copyMakeBorder(small, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        cv2.floodFill(outside, None, (0, 0), 255)
+        filled = small | cv2.bitwise_not(outside[1:-1, 1:-1])
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(filled, connectivity=8)
+        stats = stats[1:]  # Label 0 is the black background
+        if len(stats) == 0:
             # fallback => fully opaque
-            rgba_fallback = cv2.cvtColor(img_array, cv2.COLOR_RGB2RGBA)
-            rgba_fallback[:, :, 3] = 255
-            return rgba_fallback, {
+            return img_array, None, {
                 "method": "no_contour_found_fallback",
                 "black_thresh": BLACK_THRESH
             }
 
-        # We must decide which contours to keep. Example logic:
-        #   1. Compute area of each contour
-        #   2. Possibly compute bounding box or distance from center
-        #   3. Keep the largest contour, plus any that are "close to center" or have decent area
-        # This is entirely up to your data. We'll show a simple approach.
-
-        # compute areas
-        contour_areas = [cv2.contourArea(c) for c in contours]
-        total_foreground_area = sum(contour_areas)
-
-        # Sort by area descending
-        sorted_by_area = sorted(zip(contours, contour_areas), key=lambda x: x[1], reverse=True)
-
-        # Example heuristic:
-        #   - Always keep the largest contour if it's at least 20% of total foreground
-        #   - Keep any other contour that is at least 20% the size of the largest
-        #   - Possibly keep a contour that is near the center if it's not too tiny
-        # NOTE: Tweak these numbers for your scenario
-
-        largest_contour_area = sorted_by_area[0][1]
-        keep_contours = []
-
-        # define some thresholds
+        # Keep the largest component, plus any that is a large share of the
+        # foreground or of the largest, or whose box is centred on the page
         MIN_FRAC_OF_FOREGROUND = 0.2  # must be >= 20% of the total foreground area
-        MIN_FRAC_OF_LARGEST = 0.2     # must be >= 20% of the largest contour's area
-        # or consider bounding-box near center
-
-        for contour, area in sorted_by_area:
-            if area == 0:
-                continue
-            # fraction of total
-            frac_of_foreground = area / total_foreground_area
-            # fraction of largest contour
-            frac_of_largest = area / largest_contour_area
-
-            # check center-dist if needed
-            # bounding box
-            x, y, cw, ch = cv2.boundingRect(contour)
-            center_x = x + cw/2
-            center_y = y + ch/2
-            # maybe check distance from image center
-            img_center_x = w / 2
-            img_center_y = h / 2
-            dist_x = abs(center_x - img_center_x)
-            dist_y = abs(center_y - img_center_y)
-
-            # For example: keep if it’s big, or if it's near center
-            # (You can refine "near center" with a threshold, or keep only largest + 2nd largest, etc.)
-            if (frac_of_foreground > MIN_FRAC_OF_FOREGROUND) or \
-               (frac_of_largest > MIN_FRAC_OF_LARGEST) or \
-               (dist_x < w*0.1 and dist_y < h*0.1):
-                keep_contours.append(contour)
-
-        # If "keep_contours" ends up empty, fallback to just keep the largest
-        if not keep_contours:
-            keep_contours = [sorted_by_area[0][0]]
-
-        # D) Combine kept contours into a single mask
-        doc_mask = np.zeros_like(bin_mask, dtype=np.uint8)
-        for c in keep_contours:
-            cv2.drawContours(doc_mask, [c], -1, color=255, thickness=-1)
-
-        # E) Morphological open/close, blur => partial transparency
-        kernel_open = cv2.getStructuringElement(cv2.MORPH_RECT, (5,5))
-        doc_mask_opened = cv2.morphologyEx(doc_mask, cv2.MORPH_OPEN, kernel_open)
-
-        kernel_close = cv2.getStructuringElement(cv2.MORPH_RECT, (7,7))
-        doc_mask_closed = cv2.morphologyEx(doc_mask_opened, cv2.MORPH_CLOSE, kernel_close)
-
-        blurred_mask = cv2.GaussianBlur(doc_mask_closed, (21, 21), 0)
-        blurred_mask = cv2.normalize(blurred_mask, None, 0, 255, cv2.NORM_MINMAX)
-
-        alpha_flt = blurred_mask.astype(np.float32) / 255.0
-        alpha_flt *= 0.95
-        final_mask = (alpha_flt * 255).astype(np.uint8)
-
-        # Create RGBA
-        rgba = cv2.cvtColor(img_array, cv2.COLOR_RGB2RGBA)
-        rgba[:, :, 3] = final_mask
-
-        # F) Crop to bounding box of non-zero alpha (so it's as tight as possible)
-        #    Find all coords where alpha > 0
-        ys, xs = np.nonzero(final_mask > 0)
-        if len(xs) == 0 or len(ys) == 0:
+        MIN_FRAC_OF_LARGEST = 0.2     # must be >= 20% of the largest component's area
+        areas = stats[:, cv2.CC_STAT_AREA] * (sx * sy)
+        total_foreground_area = float(areas.sum())
+        largest_contour_area = float(areas.max())
+        center_x = (stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH] / 2) * sx
+        center_y = (stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT] / 2) * sy
+        near_center = (np.abs(center_x - w / 2) < w * 0.1) & (np.abs(center_y - h / 2) < h * 0.1)
+        keep = (areas / total_foreground_area > MIN_FRAC_OF_FOREGROUND) | \
+               (areas / largest_contour_area > MIN_FRAC_OF_LARGEST) | near_center
+        if not keep.any():
+            keep[np.argmax(areas)] = True
+
+        # D) Combine kept components into a single mask
+        lut = np.zeros(num_labels, dtype=np.uint8)
+        lut[1:][keep] = 255
+        doc_mask = lut[labels]
+
+        # E) Morphological open/close, blur => partial transparency (kernels
+        # scaled from their full-resolution sizes)
+        def odd(size: float) -> int:
+            return max(1, int(round(size * scale)) | 1)
+        doc_mask = cv2.morphologyEx(doc_mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (odd(5),) * 2))
+        doc_mask = cv2.morphologyEx(doc_mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (odd(7),) * 2))
+        # Sigma OpenCV derives for a 21x21 kernel
+        sigma = 0.3 * ((21 - 1) * 0.5 - 1) + 0.8
+        blurred_mask = cv2.GaussianBlur(doc_mask, (0, 0), max(sigma * scale, 0.1))
+        cv2.normalize(blurred_mask, blurred_mask, 0, 255, cv2.NORM_MINMAX)
+        # 95% opacity at most
+        small_alpha = (blurred_mask * np.float32(0.95)).astype(np.uint8)
+
+        # F) Crop box: the alpha's extent within the kept components' boxes
+        # (widened by how far the blur spreads), mapped to full resolution
+        kept = stats[keep]
+        reach = int(np.ceil(3 * max(sigma * scale, 0.1))) + 1
+        bx0 = max(0, int(kept[:, cv2.CC_STAT_LEFT].min()) - reach)
+        by0 = max(0, int(kept[:, cv2.CC_STAT_TOP].min()) - reach)
+        bx1 = min(small_size[0], int((kept[:, cv2.CC_STAT_LEFT] + kept[:, cv2.CC_STAT_WIDTH]).max()) + reach)
+        by1 = min(small_size[1], int((kept[:, cv2.CC_STAT_TOP] + kept[:, cv2.CC_STAT_HEIGHT]).max()) + reach)
+        ys, xs = np.nonzero(small_alpha[by0:by1, bx0:bx1])
+        if len(xs) == 0:
             # if everything got removed, fallback
-            return rgba, {
+            return img_array, np.zeros((h, w), dtype=np.uint8), {
                 "method": "empty_alpha_fallback",
                 "black_thresh": BLACK_THRESH
             }
-
-        minx, maxx = xs.min(), xs.max()
-        miny, maxy = ys.min(), ys.max()
-
-        # Crop
-        cropped_rgba = rgba[miny:maxy+1, minx:maxx+1, :]
+        x0, x1 = bx0 + int(xs.min()), bx0 + int(xs.max())
+        y0, y1 = by0 + int(ys.min()), by0 + int(ys.max())
+        if scale < 1:
+            # Upsampled alpha is non-zero up to half a reduced pixel further out
+            minx, maxx = max(0, int((x0 - 0.5) * sx)), min(w - 1, int(np.ceil((x1 + 1.5) * sx)))
+            miny, maxy = max(0, int((y0 - 0.5) * sy)), min(h - 1, int(np.ceil((y1 + 1.5) * sy)))
+            alpha = cv2.resize(small_alpha, (w, h), interpolation=cv2.INTER_LINEAR)[miny:maxy + 1, minx:maxx + 1]
+        else:
+            minx, maxx, miny, maxy = x0, x1, y0, y1
+            alpha = small_alpha[miny:maxy + 1, minx:maxx + 1]
 
         # debug params
         params = {
@@ -169,52 +178,101 @@ class BlackBackgroundRemoverMulti:
             "black_ratio": black_ratio,
             "total_foreground_area": total_foreground_area,
             "largest_contour_area": largest_contour_area,
-            "num_contours_found": len(contours),
-            "num_contours_kept": len(keep_contours),
-            "crop_bbox": [int(minx), int(miny), int(maxx), int(maxy)]
+            "num_contours_found": len(stats),
+            "num_contours_kept": int(keep.sum()),
+            "mask_scale": round(scale, 4),
+            "crop_bbox": [minx, miny, maxx, maxy]
         }
-        return cropped_rgba, params
+        return img_array[miny:maxy + 1, minx:maxx + 1], alpha, params
+
+
+def composite_on_white(rgb: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """Flatten an RGB page and its alpha onto white, as viewers and downstream stages do"""
+    alpha3 = cv2.merge([alpha, alpha, alpha])
+    return cv2.add(cv2.multiply(rgb, alpha3, scale=1 / 255), cv2.bitwise_not(alpha3))
+
+
+def remove_background_layers(image: Image.Image, output_mode: str = "rgba") -> tuple[Image.Image, Optional[np.ndarray], dict]:
+    """
+    Remove the background and crop. In "rgba" mode the page keeps its alpha;
+    in "rgb" mode it is composited onto white. Returns (page, alpha or None
+    when fully opaque, params).
+    """
+    img_array = np.asarray(image)
+    remover = BlackBackgroundRemoverMulti(
+        STAGE_PARAMS["mask_max_side"],
+        black_thresh=STAGE_PARAMS["black_thresh"],
+        black_coverage_cutoff=STAGE_PARAMS["black_coverage_cutoff"]
+    )
+    rgb, alpha, analysis_params = remover.remove_background_layers(img_array)
+
+    if output_mode == "rgb":
+        page = Image.fromarray(rgb if alpha is None else composite_on_white(rgb, alpha))
+    else:
+        rgba = cv2.cvtColor(rgb, cv2.COLOR_RGB2RGBA)
+        rgba[:, :, 3] = 255 if alpha is None else alpha
+        page = Image.fromarray(rgba, mode='RGBA')
+    return page, alpha, {"analysis": analysis_params, "output_mode": output_mode}
 
 
 def remove_background_from_image(image: Image.Image) -> tuple[Image.Image, dict]:
     """
     Public pipeline: remove black background, keep multiple objects by heuristic, and crop.
     """
-    img_array = np.array(image)
-    remover = BlackBackgroundRemoverMulti()
-    cropped_rgba, analysis_params = remover.remove_background(img_array)
+    page, _, params = remove_background_layers(image, STAGE_PARAMS["output_mode"])
+    return page, params
 
-    # Convert back to PIL
-    out_pil = Image.fromarray(cropped_rgba, mode='RGBA')
-    return out_pil, {"analysis": analysis_params}
+
+def page_details(image: Image.Image, bg_removed: Image.Image, params: dict) -> dict:
+    plan = GeometryPlan.identity(image.size)
+    bbox = params["analysis"].get("crop_bbox")
+    if bbox:
+        plan = plan.crop((bbox[0], bbox[1], bbox[2] + 1, bbox[3] + 1))
+    return {
+        "original_size": list(image.size),
+        "bg_removed_size": list(bg_removed.size),
+        "geometry": [plan.to_dict()],
+        "bg_removal_params": params
+    }
+
+
+def process_page(image: Image.Image, file_path: Path = None) -> tuple[list[Image.Image], dict]:
+    """
+    Remove the background from an in-memory RGB page. Returns ([page], details);
+    the page is RGBA, or RGB on white with output_mode "rgb".
+    """
+    bg_removed, params = remove_background_from_image(image)
+    return [bg_removed], page_details(image, bg_removed, params)
 
 
 def process_image(file_path: Path, out_path: Path) -> dict:
     """
     Process a single image file with the multi-object black background approach, then crop.
     """
-    img = Image.open(file_path)
+    img, read_stats = load_image(file_path)
     if img.mode != 'RGB':
         img = img.convert('RGB')
 
-    bg_removed, params = remove_background_from_image(img)
+    bg_removed, alpha, params = remove_background_layers(img, STAGE_PARAMS["output_mode"])
+    details = page_details(img, bg_removed, params)
+    details["output_mode"] = STAGE_PARAMS["output_mode"]
 
     # Get source folder structure from input path
     source_dir = Path(*file_path.parts[file_path.parts.index('documents')+1:])
     
-    # Save as PNG and ensure .png extension
-    out_path = out_path.with_suffix('.png')
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    bg_removed.save(out_path, "PNG")  # Remove quality parameter as it's not used for PNG
+    # Save with the configured codec and its extension
+    out_path, write_stats = save_image(bg_removed, out_path, STAGE_PARAMS["image_format"], STAGE_PARAMS["jpeg_quality"])
+    details["codec"] = {"read": read_stats, "write": write_stats}
+
+    # RGB pages can keep their mask next to them (<page>.alpha.png)
+    if STAGE_PARAMS["output_mode"] == "rgb" and STAGE_PARAMS["alpha_sidecar"]:
+        mask = np.full(bg_removed.size[::-1], 255, dtype=np.uint8) if alpha is None else alpha
+        alpha_path, _ = save_image(Image.fromarray(mask), out_path.with_name(f"{out_path.stem}.alpha.png"), "png-fast")
+        details["alpha_sidecar"] = str(source_dir.with_name(alpha_path.name))
     
-    # Ensure output path in manifest also has .png extension
-    rel_path = source_dir.with_suffix('.png')
+    # Ensure output path in manifest has the same extension
+    rel_path = source_dir.with_suffix(out_path.suffix)
 
-    details = {
-        "original_size": list(img.size),
-        "bg_removed_size": list(bg_removed.size),
-        "bg_removal_params": params
-    }
     return {
         "outputs": [str(rel_path)],
         "details": details
@@ -234,30 +292,48 @@ def process_document(file_path: str, output_folder: Path) -> dict:
         file_path=str(file_path),
         output_folder=output_folder,
         process_fn=process_fn,
-        file_types={
-            '.jpg': process_fn,
-            '.jpeg': process_fn,
-            '.tif': process_fn,
-            '.tiff': process_fn,
-            '.png': process_fn
-        }
+        file_types={suffix: process_fn for suffix in IMAGE_SUFFIXES}
     )
 
 
 def remove_background(
     rotated_folder: Path = typer.Argument(..., help="Folder with input images"),
     rotated_manifest: Path = typer.Argument(..., help="Manifest file"),
-    bgremoved_folder: Path = typer.Argument(..., help="Output folder")
+    bgremoved_folder: Path = typer.Argument(..., help="Output folder"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite"),
+    output_mode: str = typer.Option(STAGE_PARAMS["output_mode"], help="rgba (transparent background) or rgb (cropped page on white)"),
+    alpha_sidecar: bool = typer.Option(False, help="With --output-mode rgb, also write the alpha mask as <page>.alpha.png"),
+    image_format: Optional[str] = typer.Option(None, help="Codec for pages: jpeg (rgb only), png, png-fast, webp, jxl or npy; defaults to png for rgba, jpeg for rgb"),
+    page_cache: bool = typer.Option(False, help="Also keep raw memory-mapped copies of the pages under <assets>/page_cache for the next stage"),
+    skip_existing: bool = typer.Option(False, help="Record inputs whose output file already exists as skipped instead of reprocessing them")
 ):
     """
     CLI for multi-object black/dark background removal with bounding box crop.
     """
+    if output_mode not in ("rgba", "rgb"):
+        raise typer.BadParameter(f"Unknown output mode: {output_mode}")
+    image_format = image_format or ("jpeg" if output_mode == "rgb" else "png")
+    if image_format == "jpeg" and output_mode == "rgba":
+        raise typer.BadParameter("jpeg cannot store the alpha channel; use --output-mode rgb")
+    try:
+        STAGE_PARAMS["image_format"] = check_format(image_format)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    STAGE_PARAMS["output_mode"] = output_mode
+    STAGE_PARAMS["alpha_sidecar"] = alpha_sidecar and output_mode == "rgb"
+    configure_page_cache(page_cache)
     processor = BatchProcessor(
         input_manifest=rotated_manifest,
         output_folder=bgremoved_folder,
         process_name="remove_multi_obj_black_bg",
         base_folder=rotated_folder / "documents",
-        processor_fn=lambda f, o: process_document(f, o)
+        processor_fn=lambda f, o: process_document(f, o),
+        workers=workers,
+        manifest_backend=manifest_backend,
+        params=STAGE_PARAMS,
+        skip_existing=skip_existing,
+        output_suffix=image_suffix(STAGE_PARAMS["image_format"])
     )
     processor.process()
 
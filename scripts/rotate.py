@@ -5,17 +5,79 @@ import numpy as np
 import cv2
 from utils.batch import BatchProcessor
 from utils.processor import process_file
+from utils.files import link_or_copy
+from utils.geometry import GeometryPlan
+from utils.image_io import IMAGE_SUFFIXES, check_format, image_suffix, load_image, save_image
+from utils.page_cache import configure as configure_page_cache, link as link_cached_page
+from utils.analysis import DEFAULT_ANALYSIS_MAX_SIDE, analysis_level
 from rich.console import Console
 
 console = Console()
 
-def hough_line_rotate(image: Image.Image, blur_kernel=(5, 5), canny_threshold1=50, canny_threshold2=150) -> tuple[Image.Image, dict]:
+STAGE_PARAMS = {
+    "version": 3,
+    "blur_kernel": [5, 5],
+    "canny_threshold1": 50,
+    "canny_threshold2": 150,
+    "jpeg_quality": 100,
+    # Codec for the rotated pages (see utils.image_io.IMAGE_FORMATS)
+    "image_format": "jpeg",
+    # Only near-horizontal segments vote; the skew is the peak of their
+    # length-weighted angle histogram
+    "max_angle": 2.0,
+    "angle_bin": 0.1,
+    # Pages whose skew is smaller than min_angle (degrees), or measured with
+    # less than min_confidence, are passed through unchanged
+    "min_angle": 0.05,
+    "min_confidence": 0.2,
+    # Longest side (px) of the copy used to measure skew; 0 analyses at full resolution
+    "analysis_max_side": DEFAULT_ANALYSIS_MAX_SIDE
+}
+
+def line_angles(lines: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Angles (degrees, folded into [-90, 90)) and lengths of HoughLinesP segments"""
+    segments = lines.reshape(-1, 4).astype(np.float64)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    angles = np.degrees(np.arctan2(dy, dx))
+    # A segment's direction does not matter, only its slope
+    angles = (angles + 90) % 180 - 90
+    return angles, np.hypot(dx, dy)
+
+def histogram_angle(angles: np.ndarray, weights: np.ndarray, max_angle: float = 2.0,
+                    bin_width: float = 0.1) -> tuple[float, float]:
+    """
+    Dominant angle of a weighted angle histogram.
+    The peak bin (smoothed with its neighbours) is refined to the weighted mean
+    of the angles around it. Returns (angle, share of the total weight at the peak).
+    """
+    edges = np.arange(-max_angle, max_angle + bin_width, bin_width)
+    hist, edges = np.histogram(angles, bins=edges, weights=weights)
+    smoothed = np.convolve(hist, np.ones(3), mode="same")
+    peak = int(np.argmax(smoothed))
+    center = (edges[peak] + edges[peak + 1]) / 2
+    near = np.abs(angles - center) <= 1.5 * bin_width
+    angle = float(np.average(angles[near], weights=weights[near]))
+    return angle, float(weights[near].sum() / weights.sum())
+
+def angle_confidence(peak_share: float, num_valid: int, min_lines: int = 10) -> float:
+    """How far to trust a measured skew: agreement at the peak, discounted when few lines voted"""
+    return peak_share * min(1.0, num_valid / min_lines)
+
+def hough_line_rotate(image: Image.Image, blur_kernel=(5, 5), canny_threshold1=50, canny_threshold2=150,
+                      analysis_max_side: int = None, max_angle: float = 2.0,
+                      angle_bin: float = 0.1, min_angle: float = 0.0,
+                      min_confidence: float = 0.0) -> tuple[Image.Image, dict]:
     """
     Rotate image based on Hough Line Transform.
+    The angle is measured on a reduced copy (Hough lengths scaled to match) and
+    the rotation is applied to the full-resolution image. When no line is
+    found, the angle is below min_angle or its confidence below min_confidence,
+    the input image itself is returned and debug_info["decision"] says why.
     Returns (rotated_image, debug_info)
     """
-    img_array = np.array(image)
-    img_gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+    level = analysis_level(image, analysis_max_side)
+    img_gray = cv2.cvtColor(np.array(level.image), cv2.COLOR_BGR2GRAY)
     img_blurred = cv2.GaussianBlur(img_gray, blur_kernel, 0)
     edges = cv2.Canny(img_blurred, canny_threshold1, canny_threshold2)
     
@@ -23,37 +85,73 @@ def hough_line_rotate(image: Image.Image, blur_kernel=(5, 5), canny_threshold1=5
         "found_lines": False,
         "rotation_angle": 0,
         "num_lines": 0,
-        "edge_points": int(np.sum(edges > 0))
+        "edge_points": int(np.count_nonzero(edges)),
+        "analysis_scale": level.factor,
+        "confidence": 0.0,
+        "decision": "skip_no_lines"
     }
     
-    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100, minLineLength=100, maxLineGap=10)
+    # Votes and segment lengths shrink with the image; the angle step is refined so
+    # shorter segments still resolve small skews. The gap stays in level pixels so
+    # stair-stepped baselines are joined into long segments.
+    px = level.to_level
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180 / level.factor, threshold=px(100), minLineLength=px(100), maxLineGap=10)
     if lines is not None:
-        angles = []
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-            angle = np.degrees(np.arctan2(y2 - y1, x2 - x1))
-            if -2 <= angle <= 2:  # Ensure the angle is within a small range
-                angles.append(angle)
-        
-        debug_info["num_lines"] = len(lines)
+        angles, lengths = line_angles(lines)
+        valid = np.abs(angles) <= max_angle  # Ensure the angle is within a small range
+        debug_info["num_lines"] = len(angles)
         
-        if angles:
-            median_angle = np.median(angles)
+        if valid.any():
+            # Weighted by squared length: a slightly skewed line rasterises into many
+            # short exactly-horizontal steps, which must not outvote the long
+            # segments that follow the real slope
+            angle, peak_share = histogram_angle(angles[valid], lengths[valid] ** 2, max_angle, angle_bin)
             debug_info["found_lines"] = True
-            debug_info["rotation_angle"] = float(median_angle)
-            debug_info["num_valid_angles"] = len(angles)
-            
-            center = (img_array.shape[1] // 2, img_array.shape[0] // 2)
-            M_rotate = cv2.getRotationMatrix2D(center, median_angle, 1.0)
-            rotated = cv2.warpAffine(img_array, M_rotate, (img_array.shape[1], img_array.shape[0]), borderValue=(255, 255, 255))
+            debug_info["rotation_angle"] = angle
+            debug_info["num_valid_angles"] = int(valid.sum())
+            debug_info["peak_share"] = round(peak_share, 3)
+            debug_info["confidence"] = round(angle_confidence(peak_share, int(valid.sum())), 3)
+            if debug_info["confidence"] < min_confidence:
+                debug_info["decision"] = "skip_unreliable"
+                return image, debug_info
+            if abs(angle) < min_angle:
+                debug_info["decision"] = "skip_near_zero"
+                return image, debug_info
+            debug_info["decision"] = "rotate"
             
-            return Image.fromarray(rotated), debug_info
+            width, height = image.size
+            plan = GeometryPlan.identity(image.size).rotate(angle, center=(width // 2, height // 2))
+            debug_info["geometry"] = [plan.to_dict()]
+            return plan.render(image, fill=255), debug_info
     
     return image, debug_info
 
+def process_page(image: Image.Image, file_path: Path = None) -> tuple[list[Image.Image], dict]:
+    """Rotate an in-memory RGB page. Returns ([rotated], details)"""
+    rotated, debug_info = hough_line_rotate(
+        image,
+        blur_kernel=tuple(STAGE_PARAMS["blur_kernel"]),
+        canny_threshold1=STAGE_PARAMS["canny_threshold1"],
+        canny_threshold2=STAGE_PARAMS["canny_threshold2"],
+        analysis_max_side=STAGE_PARAMS["analysis_max_side"],
+        max_angle=STAGE_PARAMS["max_angle"],
+        angle_bin=STAGE_PARAMS["angle_bin"],
+        min_angle=STAGE_PARAMS["min_angle"],
+        min_confidence=STAGE_PARAMS["min_confidence"]
+    )
+    details = {
+        "original_size": list(image.size),
+        "rotated_size": list(rotated.size),
+        "geometry": debug_info.pop("geometry", [GeometryPlan.identity(image.size).to_dict()]),
+        "debug": debug_info
+    }
+    return [rotated], details
+
 def process_image(file_path: Path, out_path: Path) -> dict:
     """Process a single image file for rotation"""
-    img = Image.open(file_path)
+    # Left undecoded when it is a JPEG: skew is measured on a draft decode and
+    # unrotated pages are never decoded at full size
+    img, read_stats = load_image(file_path, lazy=True)
     if img.mode != 'RGB':
         img = img.convert('RGB')
 
@@ -61,21 +159,27 @@ def process_image(file_path: Path, out_path: Path) -> dict:
     source_dir = Path(file_path).parts[-4:-1]
     
     # Rotate image and get debug info
-    rotated, debug_info = hough_line_rotate(img)
+    (rotated,), details = process_page(img, file_path)
     
-    # Save rotated image
+    out_path = out_path.with_suffix(image_suffix(STAGE_PARAMS["image_format"]))
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    rotated.save(out_path, "JPEG", quality=100)
+    details["codec"] = {"read": read_stats}
+    if rotated is img and Path(file_path).suffix.lower() == out_path.suffix.lower():
+        # Nothing to rotate: reuse the input bytes instead of re-encoding them.
+        # No hardlink: split (or check_split_and_copy) rewriting its page in
+        # place would silently change this output as well
+        details["output_method"] = link_or_copy(file_path, out_path, hardlink=False)
+        # Same bytes, so the input's raw copy (if any) serves the output too
+        details["codec"]["page_cache"] = link_cached_page(file_path, out_path)
+    else:
+        # An earlier version may have left a hardlink to the input here
+        out_path.unlink(missing_ok=True)
+        out_path, details["codec"]["write"] = save_image(rotated, out_path, STAGE_PARAMS["image_format"], STAGE_PARAMS["jpeg_quality"])
+        details["output_method"] = "encode"
     
     # Build output path preserving full source hierarchy
     rel_path = Path(*source_dir) / out_path.name
     
-    details = {
-        "original_size": list(img.size),
-        "rotated_size": list(rotated.size),
-        "debug": debug_info
-    }
-    
     return {
         "outputs": [str(rel_path)],
         "details": details
@@ -92,27 +196,38 @@ def process_document(file_path: str, output_folder: Path) -> dict:
         file_path=str(file_path),
         output_folder=output_folder,
         process_fn=process_fn,
-        file_types={
-            '.jpg': process_fn,
-            '.jpeg': process_fn,
-            '.tif': process_fn,
-            '.tiff': process_fn,
-            '.png': process_fn
-        }
+        file_types={suffix: process_fn for suffix in IMAGE_SUFFIXES}
     )
 
 def rotate(
     splits_folder: Path = typer.Argument(..., help="Input splits folder"),
     splits_manifest: Path = typer.Argument(..., help="Input splits manifest file"), 
-    rotated_folder: Path = typer.Argument(..., help="Output folder for rotated images")
+    rotated_folder: Path = typer.Argument(..., help="Output folder for rotated images"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite"),
+    analysis_max_side: int = typer.Option(STAGE_PARAMS["analysis_max_side"], help="Longest side (px) used to measure skew; 0 for full resolution"),
+    image_format: str = typer.Option(STAGE_PARAMS["image_format"], help="Codec for rotated pages: jpeg, png, png-fast, webp, jxl or npy"),
+    page_cache: bool = typer.Option(False, help="Also keep raw memory-mapped copies of the pages under <assets>/page_cache for the next stage"),
+    skip_existing: bool = typer.Option(False, help="Record inputs whose output file already exists as skipped instead of reprocessing them")
 ):
     """Rotate split document pages"""
+    STAGE_PARAMS["analysis_max_side"] = analysis_max_side
+    try:
+        STAGE_PARAMS["image_format"] = check_format(image_format)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    configure_page_cache(page_cache)
     processor = BatchProcessor(
         input_manifest=splits_manifest,
         output_folder=rotated_folder,
         process_name="rotate",
         base_folder=splits_folder / "documents",  # Add /documents to match split.py's structure
-        processor_fn=lambda f, o: process_document(f, o)
+        processor_fn=lambda f, o: process_document(f, o),
+        workers=workers,
+        manifest_backend=manifest_backend,
+        params=STAGE_PARAMS,
+        skip_existing=skip_existing,
+        output_suffix=image_suffix(STAGE_PARAMS["image_format"])
     )
     processor.process()
 
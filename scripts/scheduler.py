@@ -0,0 +1,281 @@
+"""
+Workflow Scheduler for project.yml
+
+Runs a project.yml workflow as a dependency graph instead of a strict
+sequence, streaming individual pages downstream as soon as a stage
+finishes them.
+
+How the graph is built:
+- Each command's inputs are its explicit `deps` plus the paths in its script
+  arguments. A command depends on the latest earlier command in the workflow
+  whose `outputs` contain one of those paths (the path itself or a parent
+  folder; a .jsonl manifest has to match exactly).
+- A command backed by BatchProcessor whose manifest argument is exactly the
+  `<process_name>_manifest.jsonl` of an earlier BatchProcessor command is a
+  *streaming* consumer. It runs in-process in its own thread and receives
+  that stage's manifest entries through a bounded queue as they are written.
+  Inputs whose latest producer is the stream source do not block it.
+- Every other dependency is a barrier: the command starts only once the
+  dependency has finished. Commands that are not BatchProcessor stages run
+  as subprocesses, exactly as `weasel run` would.
+- A streaming edge is turned into a barrier when one of the consumer's
+  barriers itself waits on the stream source, which would otherwise deadlock
+  on a full queue.
+
+Bounded queues give backpressure: a producer blocks when its slowest
+streaming consumer is `queue_size` entries behind.
+"""
+
+import typer
+import yaml
+import re
+import os
+import sys
+import shlex
+import queue
+import threading
+import subprocess
+import importlib
+from pathlib import Path
+from typing import List, Optional, Set
+from rich.console import Console
+from utils.streaming import StageStream, stream_context
+
+console = Console()
+
+VAR_PATTERN = re.compile(r"\$\{vars\.([A-Za-z0-9_]+)\}")
+
+def resolve_vars(value: str, project_vars: dict) -> str:
+    """Substitute ${vars.name} references, following nested references"""
+    for _ in range(10):
+        resolved = VAR_PATTERN.sub(lambda m: str(project_vars.get(m.group(1), m.group(0))), value)
+        if resolved == value:
+            break
+        value = resolved
+    return value
+
+def normalize(path: str) -> str:
+    return os.path.normpath(path)
+
+def covers(output: str, path: str) -> bool:
+    """True if `path` is the output itself or lies inside the output folder"""
+    return path == output or path.startswith(output.rstrip(os.sep) + os.sep)
+
+class CommandNode:
+    """One project.yml command and its place in the workflow graph"""
+
+    def __init__(self, name: str, command: dict, project_vars: dict, project_root: Path):
+        self.name = name
+        self.scripts = [resolve_vars(s, project_vars) for s in command.get("script", [])]
+        self.outputs = [normalize(resolve_vars(o, project_vars)) for o in command.get("outputs", [])]
+        self.deps = [normalize(resolve_vars(d, project_vars)) for d in command.get("deps", [])]
+        self.module = None
+        self.cli_name = None
+        self.process_name = None
+        self.args: List[str] = []
+        self.stream_source: Optional["CommandNode"] = None
+        self.blocking: Set["CommandNode"] = set()
+        self.input_queue: Optional[queue.Queue] = None
+        self.consumer_queues: List[queue.Queue] = []
+        self.done = threading.Event()
+        self.failed = False
+        self._parse_script(project_root)
+
+    def _parse_script(self, project_root: Path):
+        """Detect single-script BatchProcessor stages that can run in-process"""
+        if len(self.scripts) != 1:
+            return
+        tokens = shlex.split(self.scripts[0])
+        if len(tokens) < 2 or tokens[0] not in ("python", "python3") or not tokens[1].endswith(".py"):
+            return
+        script_path = project_root / tokens[1]
+        self.args = tokens[2:]
+        if not script_path.exists():
+            return
+        source = script_path.read_text()
+        cli = re.search(r"typer\.run\((\w+)\)", source)
+        if "BatchProcessor(" in source and cli:
+            self.module = script_path.stem
+            self.cli_name = cli.group(1)
+            process_name = re.search(r"process_name=[\"'](\w+)[\"']", source)
+            self.process_name = process_name.group(1) if process_name else None
+
+    @property
+    def streamable(self) -> bool:
+        return self.module is not None
+
+    def inputs(self) -> List[str]:
+        paths = list(self.deps)
+        paths.extend(normalize(arg) for arg in self.args if not arg.startswith("-"))
+        return paths
+
+    def produces(self, path: str) -> bool:
+        if path.endswith(".jsonl"):
+            return path in self.outputs or path in self.published_manifests()
+        return any(covers(output, path) for output in self.outputs)
+
+    def published_manifests(self) -> List[str]:
+        """Where this stage's BatchProcessor writes the manifest it streams"""
+        if not self.streamable or not self.process_name:
+            return []
+        name = f"{self.process_name}_manifest.jsonl"
+        return [output for output in self.outputs if os.path.basename(output) == name] + \
+               [normalize(os.path.join(output, name)) for output in self.outputs if not output.endswith(".jsonl")]
+
+    def ancestors(self) -> Set["CommandNode"]:
+        """Every node this one waits on, directly or transitively"""
+        seen = set()
+        stack = list(self.blocking) + ([self.stream_source] if self.stream_source else [])
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.extend(node.blocking)
+            if node.stream_source:
+                stack.append(node.stream_source)
+        return seen
+
+    def describe(self) -> str:
+        mode = f"in-process ({self.module}.{self.cli_name})" if self.streamable else "subprocess"
+        parts = [mode]
+        if self.stream_source:
+            parts.append(f"streams from {self.stream_source.name}")
+        if self.blocking:
+            parts.append(f"after {', '.join(sorted(n.name for n in self.blocking))}")
+        return "; ".join(parts)
+
+def build_graph(nodes: List[CommandNode], queue_size: int):
+    """Work out streaming and barrier edges between workflow commands"""
+    for i, node in enumerate(nodes):
+        earlier = list(reversed(nodes[:i]))  # latest producer wins
+        inputs = node.inputs()
+
+        if node.streamable:
+            for path in inputs:
+                if not path.endswith(".jsonl"):
+                    continue
+                # Only a stage that writes this very manifest publishes its entries
+                source = next((n for n in earlier if path in n.published_manifests()), None)
+                if source:
+                    node.stream_source = source
+                    break
+
+        for path in inputs:
+            producer = next((n for n in earlier if n.produces(path)), None)
+            if producer and producer is not node.stream_source:
+                node.blocking.add(producer)
+
+        source = node.stream_source
+        if source and any(dep is source or source in dep.ancestors() for dep in node.blocking):
+            node.blocking.add(source)
+            node.stream_source = None
+
+    for node in nodes:
+        if node.stream_source:
+            node.input_queue = queue.Queue(maxsize=queue_size)
+            node.stream_source.consumer_queues.append(node.input_queue)
+
+def run_in_process(node: CommandNode, stream: StageStream):
+    """Invoke a stage's typer CLI in this thread, wired to its stream"""
+    module = importlib.import_module(node.module)
+    app = typer.Typer(add_completion=False)
+    app.command()(getattr(module, node.cli_name))
+    command = typer.main.get_command(app)
+    with stream_context(stream):
+        command.main(args=node.args, prog_name=node.name, standalone_mode=False)
+
+def run_subprocess(node: CommandNode, project_root: Path):
+    for script in node.scripts:
+        subprocess.run(script, shell=True, cwd=project_root, check=True)
+
+def run_node(node: CommandNode, project_root: Path):
+    """Thread body: wait for barriers, run the command, then release dependents"""
+    stream = StageStream(node.name, node.input_queue, node.consumer_queues)
+    try:
+        for dep in node.blocking:
+            dep.done.wait()
+        failed_deps = [dep.name for dep in node.blocking if dep.failed]
+        if failed_deps:
+            node.failed = True
+            console.print(f"[yellow]Skipping {node.name}: failed dependencies {', '.join(failed_deps)}")
+            return
+        console.print(f"[green]Starting {node.name}: {node.describe()}")
+        if node.streamable:
+            run_in_process(node, stream)
+        else:
+            run_subprocess(node, project_root)
+        console.print(f"[green]Finished {node.name}")
+    except BaseException as e:
+        node.failed = True
+        console.print(f"[red]{node.name} failed: {type(e).__name__}: {e}")
+    finally:
+        stream.finish()
+        node.done.set()
+
+def load_project(project_file: Path, overrides: dict = None) -> tuple[dict, dict]:
+    """Read project.yml and its vars, with optional var overrides"""
+    project = yaml.safe_load(Path(project_file).read_text())
+    project_vars = {**project.get("vars", {}), **(overrides or {})}
+    return project, project_vars
+
+def run_workflow(project_file: Path, workflow: str, queue_size: int = 32, dry_run: bool = False,
+                 overrides: dict = None) -> List[str]:
+    """Run a workflow as a DAG and return the names of the commands that failed"""
+    project_file = Path(project_file).resolve()
+    project_root = project_file.parent
+    project, project_vars = load_project(project_file, overrides)
+
+    if workflow not in project.get("workflows", {}):
+        raise typer.BadParameter(f"Unknown workflow: {workflow}")
+    commands = {c["name"]: c for c in project.get("commands", [])}
+    missing = [name for name in project["workflows"][workflow] if name not in commands]
+    if missing:
+        raise typer.BadParameter(f"Workflow references unknown commands: {', '.join(missing)}")
+
+    nodes = [CommandNode(name, commands[name], project_vars, project_root) for name in project["workflows"][workflow]]
+    build_graph(nodes, queue_size)
+
+    console.print(f"[blue]Workflow {workflow}:")
+    for node in nodes:
+        console.print(f"  {node.name}: {node.describe()}")
+    if dry_run:
+        return []
+
+    # Match weasel: create declared directories, run from the project root
+    for directory in project.get("directories", []):
+        (project_root / resolve_vars(directory, project_vars)).mkdir(parents=True, exist_ok=True)
+    os.chdir(project_root)
+    scripts_dir = str(Path(__file__).resolve().parent)
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+
+    # Import stage modules up front so import errors surface before any work starts
+    for node in nodes:
+        if node.streamable:
+            importlib.import_module(node.module)
+
+    threads = [threading.Thread(target=run_node, args=(node, project_root), name=node.name, daemon=True) for node in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return [node.name for node in nodes if node.failed]
+
+def scheduler(
+    project_file: Path = typer.Argument(Path("project.yml"), help="Project file describing commands and workflows"),
+    workflow: str = typer.Argument(..., help="Workflow to run"),
+    queue_size: int = typer.Option(32, help="Max manifest entries buffered between two streaming stages"),
+    dry_run: bool = typer.Option(False, help="Print the execution plan without running it")
+):
+    """Run a project.yml workflow as a DAG, streaming pages between stages"""
+    failed = run_workflow(project_file, workflow, queue_size=queue_size, dry_run=dry_run)
+    if failed:
+        console.print(f"[red]Failed: {', '.join(failed)}")
+        raise typer.Exit(1)
+    if not dry_run:
+        console.print(f"[green]Workflow {workflow} completed")
+
+if __name__ == "__main__":
+    typer.run(scheduler)
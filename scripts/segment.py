@@ -14,8 +14,16 @@ import os
 from utils.batch import BatchProcessor
 from utils.processor import process_file
 from utils.segment_handler import SegmentHandler
+from utils.hashing import file_hash, params_fingerprint
+from utils.geometry import GeometryPlan
+from utils.image_io import IMAGE_SUFFIXES, load_image
 
 console = Console()
+
+STAGE_PARAMS = {
+    "version": 2,
+    "jpeg_quality": 95
+}
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 def natural_sort_key(s):
@@ -30,15 +38,11 @@ def get_kernel_size(image: Image.Image):
         return 5
     return 7
 
-def deskew_image(pil_img: Image.Image) -> Image.Image:
+def deskew_angle(pil_img: Image.Image) -> float:
     """
-    Deskew an image using OpenCV's minAreaRect on the largest contour.
-    This approach tries to detect the most prominent rotation in the image
-    and rotate the image to correct it.
-    If no rotation is found, returns the original image.
+    Find the rotation that deskews an image, using OpenCV's minAreaRect on the
+    largest contour. Returns 0.0 if no rotation is needed or found.
     """
-    # Convert PIL to OpenCV, keeping original for final output
-    original_img = pil_img.copy()
     cv_img = np.array(pil_img.convert('L'))  # grayscale for processing only
     # Threshold and invert to get text as white on black for better contour detection
     _, thresh = cv2.threshold(cv_img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
@@ -46,7 +50,7 @@ def deskew_image(pil_img: Image.Image) -> Image.Image:
     # Find contours
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if not contours:
-        return original_img  # No contours => can't deskew
+        return 0.0  # No contours => can't deskew
 
     # Pick the largest contour by area
     largest_contour = max(contours, key=cv2.contourArea)
@@ -63,15 +67,18 @@ def deskew_image(pil_img: Image.Image) -> Image.Image:
 
     if abs(angle) < 0.1:
         # Very small angle => no real deskew needed
-        return original_img  # Return original colored image
+        return 0.0
+    return float(angle)
 
-    (h, w) = cv_img.shape
-    center = (w // 2, h // 2)
-    # Compute rotation matrix
-    M = cv2.getRotationMatrix2D(center, angle, 1.0)
-    # Rotate
-    rotated = original_img.rotate(angle, resample=Image.BICUBIC, expand=False)
-    return rotated
+def deskew_image(pil_img: Image.Image) -> Image.Image:
+    """
+    Deskew an image using OpenCV's minAreaRect on the largest contour.
+    If no rotation is found, returns a copy of the original image.
+    """
+    angle = deskew_angle(pil_img)
+    if not angle:
+        return pil_img.copy()
+    return pil_img.rotate(angle, resample=Image.BICUBIC, expand=False)
 
 def get_text_baseline_angle(img: Image.Image) -> float:
     """Calculate text baseline angle using Tesseract word-level bounding boxes."""
@@ -230,6 +237,7 @@ def merge_thin_empty_segments(segments, min_height=50, min_text_ratio=0.1):
                     prev_segment["image"] = new_img
                     prev_segment["bottom"] = current["bottom"]
                     prev_segment["text_len"] += current["text_len"]
+                    prev_segment["plan"] = None
                     i += 1
                     continue
             # If couldn't merge with previous, try next segment
@@ -244,6 +252,7 @@ def merge_thin_empty_segments(segments, min_height=50, min_text_ratio=0.1):
                         next_segment["image"].width,
                         next_segment["bottom"] - next_segment["top"]
                     ))
+                    next_segment["plan"] = None
                     i += 1
                     continue
         very_thin_merged.append(current)
@@ -288,6 +297,7 @@ def merge_thin_empty_segments(segments, min_height=50, min_text_ratio=0.1):
                     prev_segment["image"] = new_img
                     prev_segment["bottom"] = current["bottom"]
                     prev_segment["text_len"] += current["text_len"]
+                    prev_segment["plan"] = None
                     i += 1
                     continue
             
@@ -310,6 +320,7 @@ def merge_thin_empty_segments(segments, min_height=50, min_text_ratio=0.1):
                     new_img.paste(next_img, (0, current["bottom"] - current["top"] - overlap))
                     
                     next_segment["image"] = new_img
+                    next_segment["plan"] = None
                     next_segment["top"] = current["top"]
                     next_segment["text_len"] += current["text_len"]
                     i += 1
@@ -363,7 +374,11 @@ def adaptive_segment_image(img: Image.Image, min_text_length=10) -> list:
       4. Merges boxes and covers every vertical region (no data lost).
       5. Subdivides large segments so chunks don't get too big.
       6. Returns a list of dicts, each with:
-         { "image": cropped_segment, "top": top_px, "bottom": bottom_px, "text_len": length_of_OCR_text }
+         { "image": cropped_segment, "top": top_px, "bottom": bottom_px, "text_len": length_of_OCR_text,
+           "plan": GeometryPlan from img to the segment, or None once merged }
+
+    The deskew, the segment crop and the baseline correction are composed into
+    one transform per segment, so each segment is resampled once from `img`.
     """
     # Set Tesseract to use in-memory mode if available
     if hasattr(pytesseract, 'set_temp_directory'):
@@ -379,11 +394,16 @@ def adaptive_segment_image(img: Image.Image, min_text_length=10) -> list:
             "image": img,
             "top": 0,
             "bottom": height,
-            "text_len": len(text_in_img)
+            "text_len": len(text_in_img),
+            "plan": GeometryPlan.identity(img.size)
         }]
         
-    # 1. Deskew the image
-    deskewed_img = deskew_image(img)
+    # 1. Deskew the image (used for analysis; segments are rendered from img)
+    page_plan = GeometryPlan.identity(img.size)
+    angle = deskew_angle(img)
+    if angle:
+        page_plan = page_plan.rotate(angle)
+    deskewed_img = page_plan.render(img, resample=Image.BICUBIC, fill=0)
     width, height = deskewed_img.size
 
     # 2. Collect Tesseract bounding boxes (word-level).
@@ -479,19 +499,20 @@ def adaptive_segment_image(img: Image.Image, min_text_length=10) -> list:
             "image": roi,  # Keep original colors
             "top": actual_top,
             "bottom": actual_bottom,
-            "text_len": len(text_in_segment)
+            "text_len": len(text_in_segment),
+            "plan": page_plan.crop((0, actual_top, width, actual_bottom))
         })
     
     # Calculate average baseline angle from all segments
     avg_angle = calculate_average_baseline(segments)
     
-    # Apply same rotation to all segments with text
+    # Apply same rotation to all segments with text, rendering deskew, crop and
+    # rotation from the input in one pass rather than rotating the deskewed crop
     deskewed_segments = []
     for segment in segments:
-        if segment["text_len"] > 0:
-            center = (segment["image"].width/2, segment["image"].height/2)
-            segment["image"] = segment["image"].rotate(-avg_angle, center=center, 
-                                                 expand=False, resample=Image.BICUBIC)
+        if segment["text_len"] > 0 and abs(avg_angle) > 0:
+            segment["plan"] = segment["plan"].rotate(-avg_angle)
+            segment["image"] = segment["plan"].render(img, resample=Image.BICUBIC, fill=0)
         deskewed_segments.append(segment)
     
     # Merge thin empty segments with neighbors
@@ -512,7 +533,9 @@ def process_image(file_path: Path, out_path: Path) -> dict:
                 raise FileNotFoundError(f"Input file not found: {file_path}")
 
             # Load and process image
-            image = SegmentHandler.load_segment(file_path)
+            image, read_stats = load_image(file_path)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
             segments = adaptive_segment_image(image)
             
             segment_paths = []
@@ -525,7 +548,7 @@ def process_image(file_path: Path, out_path: Path) -> dict:
                 out_segment_path = segments_folder / segment_filename
                 
                 # Save segment
-                roi.save(out_segment_path, "JPEG", quality=95, optimize=True)
+                roi.save(out_segment_path, "JPEG", quality=STAGE_PARAMS["jpeg_quality"], optimize=True)
                 
                 # Get relative paths
                 rel_path = SegmentHandler.get_relative_path(file_path)
@@ -539,6 +562,9 @@ def process_image(file_path: Path, out_path: Path) -> dict:
                     "text_len": segment_data["text_len"],
                     "parent_image": str(file_path)
                 })
+                if segment_data.get("plan") is not None:
+                    # Parent-to-segment transform, for mapping text positions back
+                    segment_info[-1]["geometry"] = segment_data["plan"].to_dict()
 
             return {
                 "outputs": segment_paths,
@@ -547,6 +573,7 @@ def process_image(file_path: Path, out_path: Path) -> dict:
                 "details": {
                     "num_segments": len(segments),
                     "segments": segment_info,
+                    "codec": {"read": read_stats},
                     "parent_info": {
                         "path": str(file_path),
                         "relative_path": str(paths["parent_path"])
@@ -555,7 +582,11 @@ def process_image(file_path: Path, out_path: Path) -> dict:
             }
 
         # Process with safety wrapper and metadata
-        metadata = {"source": str(file_path)}
+        metadata = {
+            "source": str(file_path),
+            "input_hash": file_hash(file_path),
+            "params_fingerprint": params_fingerprint(STAGE_PARAMS)
+        }
         return SegmentHandler.process_safely(segments_folder, process, metadata)
 
     except Exception as e:
@@ -573,17 +604,15 @@ def process_document(file_path: str, output_folder: Path) -> dict:
         file_path=str(file_path),
         output_folder=output_folder,
         process_fn=process_fn,
-        file_types={
-            '.jpg': process_fn,
-            '.jpeg': process_fn,
-            '.png': process_fn
-        }
+        file_types={suffix: process_fn for suffix in IMAGE_SUFFIXES}
     )
 
 def segment(
     source_folder: Path = typer.Argument(..., help="Source folder containing images"),
     source_manifest: Path = typer.Argument(..., help="Manifest file"),
-    output_folder: Path = typer.Argument(..., help="Output folder for segmented images")
+    output_folder: Path = typer.Argument(..., help="Output folder for segmented images"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite")
 ):
     """
     Batch segmentation CLI that processes background-removed images.
@@ -595,7 +624,10 @@ def segment(
         process_name="segment",
         base_folder=source_folder / "documents",  # Add /documents to base folder path
         processor_fn=lambda f, o: process_document(f, o),
-        use_source=False
+        use_source=False,
+        workers=workers,
+        manifest_backend=manifest_backend,
+        params=STAGE_PARAMS
     )
     processor.process()
 
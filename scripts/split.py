@@ -37,33 +37,119 @@ import cv2
 from pdf2image import convert_from_path
 from utils.batch import BatchProcessor
 from utils.processor import process_file
+from utils.geometry import GeometryPlan
+from utils.image_io import IMAGE_SUFFIXES, check_format, load_image, save_image
+from utils.page_cache import configure as configure_page_cache
 from rich.console import Console
 import json
 from typing import Set
 
 console = Console()
 
-def analyze_page_content(img_array: np.ndarray) -> tuple[float, float, float]:
+STAGE_PARAMS = {
+    "version": 1,
+    "threshold_ratio": 0.20,
+    "compare_slices": 3,
+    "jpeg_quality": 100,
+    # Codec for the split pages (see utils.image_io.IMAGE_FORMATS)
+    "image_format": "jpeg"
+}
+
+def column_sums(img_array: np.ndarray) -> np.ndarray:
+    """Sum of every pixel column, computed once per image and shared by all split heuristics"""
+    return img_array.sum(axis=0, dtype=np.int64)
+
+def count_local_minima(values: np.ndarray) -> int:
+    """Number of strict interior local minima in a 1-D profile"""
+    if len(values) < 3:
+        return 0
+    inner = values[1:-1]
+    return int(np.count_nonzero((inner < values[:-2]) & (inner < values[2:])))
+
+class PageFeatures:
+    """
+    Pixel statistics used by split detection, computed once per page.
+
+    Edges, density maps and column/row profiles are derived from the grayscale
+    array a single time and reduced to scalars. The scalars are all the
+    classification logic needs, so `to_dict()` can be stored in the split
+    manifest and `from_dict()` lets a page be re-classified later without
+    reading its pixels again.
+
+    Features must come from the full-resolution page: edge density, edge
+    profile variances, text density and the column-profile patterns all
+    change with scale, and the detection thresholds were tuned on full
+    resolution scans.
+    """
+
+    def __init__(self, values: dict, img_array: np.ndarray = None, col_sums: np.ndarray = None):
+        self.values = values
+        # Pixel-level data, only available when built from an image
+        self.img_array = img_array
+        self.col_sums = col_sums
+
+    @classmethod
+    def from_array(cls, img_array: np.ndarray, col_sums: np.ndarray = None) -> "PageFeatures":
+        """Extract all features from a full-resolution grayscale page in one pass"""
+        height, width = img_array.shape
+        mid = width // 2
+        if col_sums is None:
+            col_sums = column_sums(img_array)
+
+        # Density maps, reduced to per-column counts once
+        text_cols = np.count_nonzero(img_array < 200, axis=0)
+        content_cols = np.count_nonzero(img_array < 240, axis=0)
+
+        # Edge map and its row/column profiles
+        edges = cv2.Canny(img_array, 100, 200)
+        horizontal_profile = np.sum(edges, axis=1) / width
+        vertical_profile = np.sum(edges, axis=0) / height
+
+        # Centre patterns around the likely binding
+        center_sums = col_sums[mid-100:mid+100]
+        smooth_sums = np.convolve(center_sums, np.ones(5)/5, mode='valid')  # Smoothing
+
+        half_pixels = height * mid
+        values = {
+            "width": int(width),
+            "height": int(height),
+            "aspect_ratio": float(width / height),
+            "edge_density": float(np.count_nonzero(edges) / (width * height)),
+            "text_density": float(text_cols.sum() / (width * height)),
+            "left_density": float(text_cols[:mid].sum() / half_pixels),
+            "right_density": float(text_cols[mid:].sum() / (height * (width - mid))),
+            "left_content": float(content_cols[:mid].sum() / half_pixels),
+            "right_content": float(content_cols[mid:].sum() / half_pixels),
+            "horizontal_variance": float(np.var(horizontal_profile)),
+            "vertical_variance": float(np.var(vertical_profile)),
+            "center_pattern_wide": float(np.std(center_sums)),
+            "center_pattern_narrow": float(np.std(col_sums[mid-50:mid+50])),
+            "center_diff_std": float(np.std(np.diff(center_sums))),
+            "pattern_peaks": count_local_minima(smooth_sums)
+        }
+        return cls(values, img_array, col_sums)
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "PageFeatures":
+        """Rebuild features from a manifest entry (no pixel data)"""
+        return cls(dict(values))
+
+    def to_dict(self) -> dict:
+        return dict(self.values)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["values"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+def analyze_page_content(features: PageFeatures) -> tuple[float, float, float]:
     """
     Enhanced content analysis that also detects vertical patterns
     Returns (left_density, right_density, pattern_strength)
     """
-    height, width = img_array.shape
-    mid = width // 2
-    
-    # Consider pixels darker than 240 as content
-    threshold = 240
-    left_content = np.sum(img_array[:, :mid] < threshold)
-    right_content = np.sum(img_array[:, mid:] < threshold)
-    
-    # Calculate vertical pattern strength (for notebook detection)
-    center_region = img_array[:, mid-100:mid+100]
-    vertical_sums = np.sum(center_region, axis=0)
-    pattern_strength = np.std(np.diff(vertical_sums))
-    
-    # Calculate density as percentage
-    total_pixels = height * (width // 2)
-    return (left_content / total_pixels, right_content / total_pixels, pattern_strength)
+    # Pixels darker than 240 count as content; pattern strength is for notebook detection
+    return (features.left_content, features.right_content, features.center_diff_std)
 
 def convert_to_serializable(obj):
     """Convert numpy/custom types to JSON serializable Python types"""
@@ -155,32 +241,26 @@ def is_likely_label_from_name(file_path: Path) -> bool:
         is_in_photo_album
     )
 
-def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_ratio: float, file_path: Path = None) -> dict:
-    """Enhanced document type detection with strict priority ordering"""
-    # Calculate basic metrics first
-    edges = cv2.Canny(img_array, 100, 200)
-    edge_density = np.sum(edges > 0) / (width * height)
-    text_density = np.mean(img_array < 200)
+def detect_document_type(features: PageFeatures, file_path: Path = None) -> dict:
+    """
+    Enhanced document type detection with strict priority ordering.
+    Works only on precomputed features, so it can be re-run from a manifest entry.
+    """
+    width = features.width
+    aspect_ratio = features.aspect_ratio
+    edge_density = features.edge_density
+    text_density = features.text_density
+    h_var = features.horizontal_variance
+    v_var = features.vertical_variance
 
     # Calculate content distribution
-    left_half = img_array[:, :width//2]
-    right_half = img_array[:, width//2:]
-    left_density = np.mean(left_half < 200)
-    right_density = np.mean(right_half < 200)
-    content_balance = abs(left_density - right_density)
-    
-    # More aggressive notebook detection
-    center_width = 100  # Pixels to check on each side of center
-    center_x = width // 2
-    center_region = img_array[:, center_x-center_width:center_x+center_width]
-    vertical_pattern = np.std(np.sum(center_region, axis=0))
-    
-    # Calculate periodic binding pattern
-    vertical_sums = np.sum(center_region, axis=0)
-    smooth_sums = np.convolve(vertical_sums, np.ones(5)/5, mode='valid')  # Smoothing
-    pattern_peaks = len([i for i in range(1, len(smooth_sums)-1) 
-                       if smooth_sums[i] < smooth_sums[i-1] and 
-                          smooth_sums[i] < smooth_sums[i+1]])
+    content_balance = abs(features.left_density - features.right_density)
+    
+    # More aggressive notebook detection: pattern 100px each side of center
+    vertical_pattern = features.center_pattern_wide
+    
+    # Periodic binding pattern
+    pattern_peaks = features.pattern_peaks
     
     # Enhanced double page detection - combines multiple factors
     is_double_page = (
@@ -227,11 +307,6 @@ def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_
         }
     
     # Then check for photos
-    horizontal_profile = np.sum(edges, axis=1) / width
-    vertical_profile = np.sum(edges, axis=0) / height
-    h_var = np.var(horizontal_profile)
-    v_var = np.var(vertical_profile)
-    
     is_photo = (
         ("photo" in str(file_path).lower() if file_path else False) or
         (
@@ -254,9 +329,8 @@ def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_
             "vertical_variance": float(v_var)
         }
     
-    # Finally check for notebooks - update the criteria
-    center_region = img_array[:, width//2-50:width//2+50]
-    vertical_pattern = np.std(np.sum(center_region, axis=0))
+    # Finally check for notebooks - pattern 50px each side of center
+    vertical_pattern = features.center_pattern_narrow
     
     is_notebook = (
         aspect_ratio > 1.35 and
@@ -291,12 +365,6 @@ def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_
             "text_density": float(text_density)
         }
     
-    # Rest of document type detection with updated criteria
-    horizontal_profile = np.sum(edges, axis=1) / width
-    vertical_profile = np.sum(edges, axis=0) / height
-    h_var = np.var(horizontal_profile)
-    v_var = np.var(vertical_profile)
-    
     # More precise photo detection
     is_photo = (
         edge_density > 0.12 and 
@@ -323,12 +391,6 @@ def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_
             "vertical_variance": float(v_var),
             "is_likely_label_from_name": bool(is_likely_first)
         }
-        
-    # Check for notebook characteristics first
-    center_region = img_array[:, width//2-50:width//2+50]
-    vertical_pattern = np.std(np.sum(center_region, axis=0))
-    edges = cv2.Canny(img_array, 100, 200)
-    edge_density = np.sum(edges > 0) / (width * height)
     
     # Notebook detection criteria (must check first)
     is_notebook = (
@@ -351,17 +413,6 @@ def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_
             "vertical_pattern": float(vertical_pattern)
         }
     
-    # Rest of document type detection...
-    # Calculate basic metrics first
-    edges = cv2.Canny(img_array, 100, 200)
-    edge_density = np.sum(edges > 0) / (width * height)
-    
-    # Check for horizontal/vertical line dominance
-    horizontal_profile = np.sum(edges, axis=1) / width
-    vertical_profile = np.sum(edges, axis=0) / height
-    h_var = np.var(horizontal_profile)
-    v_var = np.var(vertical_profile)
-    
     # Enhanced photo detection (photos often have high edge density and variance)
     is_photo = (
         edge_density > 0.15 and 
@@ -371,7 +422,6 @@ def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_
     
     # Enhanced label detection (prioritize this check)
     is_likely_label = file_path and is_likely_label_from_name(file_path)
-    text_density = np.mean(img_array < 200)  # Measure text content
     
     # Strict label criteria
     is_label = (
@@ -395,10 +445,9 @@ def detect_document_type(img_array: np.ndarray, width: int, height: int, aspect_
         }
     
     # Only check for notebook characteristics if not a label/photo
-    center_pattern = np.std(np.sum(img_array[:, width//2-50:width//2+50], axis=0))
     is_notebook = (
         aspect_ratio > 1.35 and
-        center_pattern > 500 and
+        vertical_pattern > 500 and
         not (is_photo or is_label)
     )
     
@@ -451,11 +500,15 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
     if aspect_ratio < 1.2 or width < 1000:  # Added minimum width check
         return False, None, None, debug_info
     
-    # Convert to grayscale numpy array
+    # Convert to grayscale at full resolution (the feature thresholds assume it)
     img_array = np.array(image.convert("L"))
+    # Every column-profile heuristic below reads from this one array
+    col_sums = column_sums(img_array)
+    features = PageFeatures.from_array(img_array, col_sums)
+    debug_info["features"] = features.to_dict()
     
     # Detect document type with strict priority
-    doc_type = detect_document_type(img_array, width, height, aspect_ratio, file_path)
+    doc_type = detect_document_type(features, file_path)
     
     # Never split labels, photos, covers or first pages
     if doc_type["is_label"] or doc_type["is_photo"] or doc_type["is_cover"] or (file_path and is_likely_label_from_name(file_path)):
@@ -467,18 +520,12 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
         # Find optimal split point near center
         center_x = width // 2
         search_range = 200
-        split_x = center_x
-        min_sum = float('inf')
-        
-        for x in range(center_x - search_range, center_x + search_range):
-            if 0 <= x < width:
-                vertical_sum = np.sum(img_array[:, x])
-                if vertical_sum < min_sum:
-                    min_sum = vertical_sum
-                    split_x = x
+        start = max(0, center_x - search_range)
+        split_x = start + int(np.argmin(col_sums[start:center_x + search_range]))
+        min_sum = col_sums[split_x]
         
         debug_info.update(doc_type)
-        avg_darkness = min_sum / height
+        avg_darkness = float(min_sum / height)
         return True, split_x, avg_darkness, debug_info
     
     # Don't split covers, labels, envelopes, or photos
@@ -487,7 +534,7 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
         return False, None, None, debug_info
     
     # Analyze content distribution
-    left_density, right_density, pattern_strength = analyze_page_content(img_array)
+    left_density, right_density, pattern_strength = analyze_page_content(features)
     debug_info["content_density"] = {"left": float(left_density), "right": float(right_density)}
     
     # If one side is mostly empty (< 2% content) and other has content (> 10%),
@@ -496,9 +543,7 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
     if min(left_density, right_density) < 0.02 and max(left_density, right_density) > 0.10:
         return False, None, None, debug_info
     
-    # Adjust the scanning region to be more centered
-    # Use 40% of width instead of 30% to catch more potential splits
-    threshold_ratio = 0.20
+    # Scan the central 2 * threshold_ratio of the width for the gutter
     mid_region_start = int(width * (0.5 - threshold_ratio))
     mid_region_end = int(width * (0.5 + threshold_ratio))
     
@@ -511,29 +556,20 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
     
     # Update debug info with region bounds
     debug_info.update({
-        "mid_region_start": int(mid_region_start),
-        "mid_region_end": int(mid_region_end)
+        "mid_region_start": mid_region_start,
+        "mid_region_end": mid_region_end
     })
     
     # Look for darkest vertical line in middle region
-    min_sum = float('inf')
-    split_x = None
-    
-    for x in range(mid_region_start, mid_region_end):
-        vertical_sum = np.sum(img_array[:, x])
-        if (vertical_sum < min_sum):
-            min_sum = vertical_sum
-            split_x = x
-            
+    mid_sums = col_sums[mid_region_start:mid_region_end]
+    split_x = mid_region_start + int(np.argmin(mid_sums))
+    min_sum = mid_sums.min()
+
     # Determine if split is needed based on darkness of line
     avg_darkness = min_sum / height
     
     # Compare surrounding slices around the split_x index
-    slice_values = []
-    for offset in range(-compare_slices, compare_slices + 1):
-        x_check = split_x + offset
-        if 0 <= x_check < width:
-            slice_values.append(np.sum(img_array[:, x_check]) / height)
+    slice_values = (col_sums[max(0, split_x - compare_slices):split_x + compare_slices + 1] / height).tolist()
     avg_slice_value = float(np.mean(slice_values)) if slice_values else float('inf')
     
     # Require a stronger difference so we don't split if the middle line isn't distinctly darker
@@ -566,7 +602,7 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
     is_notebook = False
     if aspect_ratio > 1.4:
         # Check for consistent vertical line pattern
-        vertical_sums = [np.sum(img_array[:, x]) / height for x in range(mid_region_start, mid_region_end)]
+        vertical_sums = mid_sums / height
         variations = np.diff(vertical_sums)
         pattern_strength = np.std(variations)
         is_notebook = pattern_strength > 10  # Higher variation suggests spiral binding
@@ -585,7 +621,7 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
     
     # Enhanced notebook detection
     # Look for periodic patterns in middle region that suggest spiral binding
-    vertical_pattern = np.std([np.sum(img_array[:, x]) for x in range(mid_region_start, mid_region_end)])
+    vertical_pattern = np.std(mid_sums)
     is_notebook = (aspect_ratio > 1.35 and vertical_pattern > 1000)
     
     # More aggressive splitting for notebooks
@@ -596,13 +632,13 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
         search_range = 200  # Look 200px around center
         split_x = center_x  # Default to center
         
-        # Search for darkest line near center
-        for x in range(center_x - search_range, center_x + search_range):
-            if x >= 0 and x < width:
-                vertical_sum = np.sum(img_array[:, x])
-                if vertical_sum < min_sum:
-                    min_sum = vertical_sum
-                    split_x = x
+        # Search for darkest line near center, keeping it only if darker than the mid-region minimum
+        start = max(0, center_x - search_range)
+        center_sums = col_sums[start:center_x + search_range]
+        darkest = int(np.argmin(center_sums))
+        if center_sums[darkest] < min_sum:
+            min_sum = center_sums[darkest]
+            split_x = start + darkest
     
     # Labels typically have much smaller height and limited content
     is_label = height < 1000 and width < 2000
@@ -612,7 +648,7 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
     # For GHC_B05 files that shouldn't split, add filename pattern check
     if file_path and any(x in str(file_path).lower() for x in ["ghc_b05_doc04", "ghc_b05_doc06"]):
         # These specific documents shouldn't be split unless they meet stricter criteria
-        if edge_density < 0.02 or vertical_pattern < 3000:
+        if features.edge_density < 0.02 or vertical_pattern < 3000:
             should_split = False
     
     # Update debug info with final values - ensure all values are serializable
@@ -629,7 +665,8 @@ def detect_split_point(image: Image.Image, threshold_ratio: float = 0.15, compar
         "mid_region_end": mid_region_end,
         "content_density": debug_info["content_density"],
         "vertical_pattern": float(vertical_pattern),
-        "is_label": bool(is_label)
+        "is_label": bool(is_label),
+        "features": features.to_dict()
     })
     
     # Update debug info with document type info
@@ -649,50 +686,66 @@ def split_image(image: Image.Image, file_path: Path = None) -> tuple[list[Image.
     Returns:
         Tuple of (list of image parts, debug information)
     """
-    should_split, split_point, avg_darkness, debug_info = detect_split_point(image, file_path=file_path)
+    should_split, split_point, avg_darkness, debug_info = detect_split_point(
+        image,
+        threshold_ratio=STAGE_PARAMS["threshold_ratio"],
+        compare_slices=STAGE_PARAMS["compare_slices"],
+        file_path=file_path
+    )
     
     if (not should_split):
+        debug_info["geometry"] = [GeometryPlan.identity(image.size).to_dict()]
         return [image], debug_info
         
     # Split into left and right pages
     width, height = image.size
-    left_page = image.crop((0, 0, split_point, height))
-    right_page = image.crop((split_point, 0, width, height))
+    plans = [
+        GeometryPlan.identity(image.size).crop((0, 0, split_point, height)),
+        GeometryPlan.identity(image.size).crop((split_point, 0, width, height))
+    ]
+    debug_info["geometry"] = [plan.to_dict() for plan in plans]
     
-    return [left_page, right_page], debug_info
+    return [plan.render(image) for plan in plans], debug_info
+
+def process_page(image: Image.Image, file_path: Path = None) -> tuple[list[Image.Image], dict]:
+    """Split an in-memory RGB page. Returns (parts, details)"""
+    parts, debug_info = split_image(image, file_path=file_path)
+    details = convert_to_serializable({
+        "original_size": list(image.size),
+        # One source-to-part transform per part
+        "geometry": debug_info.pop("geometry"),
+        "debug": debug_info
+    })
+    for i, part in enumerate(parts):
+        details[f"part_{i+1}_size"] = list(part.size)
+    return parts, details
 
 def process_image(file_path: Path, out_path: Path) -> dict:
     """Process a single image file for splitting"""
-    img = Image.open(file_path)
+    img, read_stats = load_image(file_path)
     if (img.mode != 'RGB'):
         img = img.convert('RGB')
     
-    parts, debug_info = split_image(img, file_path=file_path)
+    parts, details = process_page(img, file_path)
+    details["codec"] = {"read": read_stats, "write": []}
     outputs = []
     
-    details = convert_to_serializable({
-        "original_size": list(img.size),
-        "debug": debug_info
-    })
-    
     # Get source folder structure from input path
     source_dir = Path(file_path).parts[-4:-1]  # Gets ['FHC', 'GHC_B05', etc]
     
     for i, part in enumerate(parts):
         # Create output filename with correct folder structure
         if len(parts) > 1:
-            part_name = f"{out_path.stem}_part_{i+1}.jpg"
+            part_name = f"{out_path.stem}_part_{i+1}"
         else:
-            part_name = f"{out_path.stem}.jpg"
+            part_name = out_path.stem
             
-        part_path = out_path.parent / part_name
-        part_path.parent.mkdir(parents=True, exist_ok=True)
-        part.save(part_path, "JPEG", quality=100)
+        part_path, write_stats = save_image(part, out_path.parent / part_name, STAGE_PARAMS["image_format"], STAGE_PARAMS["jpeg_quality"])
+        details["codec"]["write"].append(write_stats)
         
         # Build output path preserving full source hierarchy
-        rel_path = Path(*source_dir) / part_name
+        rel_path = Path(*source_dir) / part_path.name
         outputs.append(str(rel_path))
-        details[f"part_{i+1}_size"] = list(part.size)
     
     return {
         "outputs": outputs,
@@ -760,26 +813,34 @@ def process_document(file_path: str, output_folder: Path) -> dict:
         process_fn=process_fn,
         file_types={
             '.pdf': process_pdf,
-            '.jpg': process_fn,
-            '.jpeg': process_fn,
-            '.tif': process_fn,
-            '.tiff': process_fn,
-            '.png': process_fn
+            **{suffix: process_fn for suffix in IMAGE_SUFFIXES}
         }
     )
 
 def split(
     crops_folder: Path = typer.Argument(..., help="Input crops folder"),
     crops_manifest: Path = typer.Argument(..., help="Input crops manifest file"),
-    splits_folder: Path = typer.Argument(..., help="Output folder for split images")
+    splits_folder: Path = typer.Argument(..., help="Output folder for split images"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    manifest_backend: str = typer.Option("jsonl", help="Manifest store: jsonl or sqlite"),
+    image_format: str = typer.Option(STAGE_PARAMS["image_format"], help="Codec for split pages: jpeg, png, png-fast, webp, jxl or npy"),
+    page_cache: bool = typer.Option(False, help="Also keep raw memory-mapped copies of the pages under <assets>/page_cache for the next stage")
 ):
     """Split cropped book pages into individual pages"""
+    try:
+        STAGE_PARAMS["image_format"] = check_format(image_format)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    configure_page_cache(page_cache)
     processor = BatchProcessor(
         input_manifest=crops_manifest,
         output_folder=splits_folder,
         process_name="split",  # Add required process_name parameter
         base_folder=crops_folder / "documents",  # Add /documents to match crop.py's structure
-        processor_fn=lambda f, o: process_document(f, o)
+        processor_fn=lambda f, o: process_document(f, o),
+        workers=workers,
+        manifest_backend=manifest_backend,
+        params=STAGE_PARAMS
     )
     processor.process()
 
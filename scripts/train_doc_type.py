@@ -0,0 +1,112 @@
+"""
+Train the fast document-type classifier used by enhance.py.
+
+Labels come from the `document_type` already recorded in an enhance manifest
+(pages analysed with the OCR classifier, or corrected by hand); features are
+taken from the manifest when recorded, otherwise computed from the enhance
+input images. The result is a small decision tree saved to models/, used with
+`enhance.py --doc-type-model <name>`.
+
+It first reports how often the built-in rules (`--doc-type-classifier fast`
+without a model) agree with those labels; `--report-only` stops there.
+"""
+
+import typer
+import srsly
+import numpy as np
+import cv2
+from pathlib import Path
+from PIL import Image
+from rich.console import Console
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.model_selection import cross_val_score
+import joblib
+
+from enhance import DOC_TYPE_FEATURES, MIN_DOC_TYPE_COMPONENTS, MODELS_DIR, STAGE_PARAMS, page_features, rules_doc_type
+from utils.analysis import analysis_level
+
+console = Console()
+
+def entry_label(entry: dict):
+    """(document_type, analysis) for an entry labelled by OCR or by hand, else None"""
+    analysis = entry.get("details", {}).get("enhancement_params", {}).get("analysis", {})
+    # Pages typed by the rules/model classifier would only teach it its own output
+    if analysis.get("classifier", "ocr") not in ("ocr", "manual"):
+        return None
+    if analysis.get("document_type") not in ("handwritten", "typescript"):
+        return None
+    return analysis["document_type"], analysis
+
+def entry_features(entry: dict, analysis: dict, images_folder: Path) -> dict:
+    if analysis.get("features"):
+        return analysis["features"]
+    image = Image.open(images_folder / entry["source"])
+    level = analysis_level(image, STAGE_PARAMS["analysis_max_side"])
+    gray = cv2.cvtColor(np.array(level.image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    return page_features(gray)
+
+def report_rules_agreement(features: list, labels: list):
+    """Print how often the rule vote matches the recorded document types"""
+    pairs = [(rules_doc_type(f), label) for f, label in zip(features, labels)
+             if f.get("components", MIN_DOC_TYPE_COMPONENTS) >= MIN_DOC_TYPE_COMPONENTS]
+    if not pairs:
+        console.print("[yellow]No labelled pages with enough ink to check the rules")
+        return
+    agree = sum(predicted == label for predicted, label in pairs)
+    console.print(f"Rules agree with the labels on {agree}/{len(pairs)} pages ({agree / len(pairs):.3f}); "
+                  f"{len(labels) - len(pairs)} pages with too little ink left out")
+    for label in sorted(set(labels)):
+        typed = [predicted for predicted, actual in pairs if actual == label]
+        if typed:
+            console.print(f"  {label}: {typed.count(label)}/{len(typed)} typed as {label}")
+
+def train_doc_type(
+    enhance_manifest: Path = typer.Argument(..., help="Enhance manifest with recorded document types"),
+    images_folder: Path = typer.Argument(..., help="Enhance input images folder (e.g. the rotated folder)"),
+    model_name: str = typer.Option("doc_type.joblib", help="File name of the model in models/"),
+    max_depth: int = typer.Option(4, help="Depth of the decision tree"),
+    limit: int = typer.Option(0, help="Use at most this many pages (0 for all)"),
+    report_only: bool = typer.Option(False, help="Only report the rules' agreement with the labels")
+):
+    """Train a small decision tree that picks the CLAHE profile without OCR"""
+    rows, labels, page_rows = [], [], []
+    for entry in srsly.read_jsonl(enhance_manifest):
+        if not entry.get("success") or not entry.get("source"):
+            continue
+        labelled = entry_label(entry)
+        if labelled is None:
+            continue
+        label, analysis = labelled
+        try:
+            features = entry_features(entry, analysis, images_folder / "documents")
+        except (FileNotFoundError, OSError) as e:
+            console.print(f"[yellow]Skipping {entry['source']}: {e}")
+            continue
+        rows.append([features[name] for name in DOC_TYPE_FEATURES])
+        page_rows.append(features)
+        labels.append(label)
+        if limit and len(rows) >= limit:
+            break
+
+    report_rules_agreement(page_rows, labels)
+    if report_only:
+        return
+
+    if len(set(labels)) < 2:
+        raise typer.Exit("Need labelled pages of both document types to train")
+    console.print(f"Training on {len(rows)} pages: " + ", ".join(f"{l}={labels.count(l)}" for l in sorted(set(labels))))
+
+    model = DecisionTreeClassifier(max_depth=max_depth, class_weight="balanced", random_state=0)
+    folds = min(5, min(labels.count(l) for l in set(labels)))
+    if folds >= 2:
+        scores = cross_val_score(model, rows, labels, cv=folds)
+        console.print(f"Cross-validated accuracy: {scores.mean():.3f} (+/- {scores.std():.3f})")
+    model.fit(rows, labels)
+
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    model_path = MODELS_DIR / model_name
+    joblib.dump({"model": model, "features": DOC_TYPE_FEATURES}, model_path)
+    console.print(f"[green]Saved {model_path}; use it with enhance.py --doc-type-model {model_name}")
+
+if __name__ == "__main__":
+    typer.run(train_doc_type)
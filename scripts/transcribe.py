@@ -10,6 +10,7 @@ from rich.console import Console
 from utils.batch import BatchProcessor
 from utils.processor import process_file
 from utils.segment_handler import SegmentHandler
+from utils.image_io import IMAGE_SUFFIXES, load_image
 import os
 
 console = Console()
@@ -226,7 +227,7 @@ def process_image(img_path: Path, out_path: Path) -> dict:
             )
             
             # Load and process image
-            image = Image.open(img_path).convert("RGB")
+            image = load_image(img_path)[0].convert("RGB")
             
             # Get actual transcription from LLM with text density estimation
             estimated_words = transcriber.estimate_text_density(image)
@@ -249,11 +250,10 @@ def process_image(img_path: Path, out_path: Path) -> dict:
                 }
             }
             
-            # Add parent image info
+            # Add parent image info (the page the segment was cut from)
             rel_path = SegmentHandler.get_relative_path(img_path)
-            if 'segments' in str(rel_path):
-                parent_path = rel_path.parents[1]
-                result["parent_image"] = str(parent_path)
+            if rel_path.parent.name.endswith('_segments'):
+                result["parent_image"] = str(SegmentHandler.get_parent_image(rel_path))
             else:
                 result["parent_image"] = str(rel_path)
                 
@@ -276,15 +276,10 @@ def process_document(file_path: str, output_folder: Path) -> dict:
     try:
         input_path = Path(file_path)
         
-        # If this is a source PNG from segments manifest, process it directly
-        if input_path.suffix.lower() == '.png':
-            rel_path = SegmentHandler.get_relative_path(input_path)
-            # Save to folder-level MD file
-            out_path = output_folder / 'documents' / rel_path.with_suffix('.md')
-            return process_image(input_path, out_path)
-            
-        # If this is a single segment file, process it
-        if input_path.suffix.lower() in ['.jpg', '.jpeg']:
+        # A single segment file, or a source page from the segments manifest
+        # (background removal output in any page codec, JPEG with
+        # --output-mode rgb): process it directly
+        if input_path.suffix.lower() in IMAGE_SUFFIXES:
             rel_path = SegmentHandler.get_relative_path(input_path)
             out_path = output_folder / 'documents' / rel_path.with_suffix('.md')
             return process_image(input_path, out_path)
@@ -310,9 +305,11 @@ def process_document(file_path: str, output_folder: Path) -> dict:
             result = process_image(segment, out_path)
             results.append(result)
             
-        # Also process source PNG if it exists
-        source_png = segments_folder.parent / f"{segments_folder.stem[:-9]}.png"
-        if source_png.exists():
+        # Also process the source page if it exists, whatever codec and output
+        # mode background removal used
+        source_pages = [segments_folder.parent / f"{segments_folder.stem[:-9]}{suffix}" for suffix in IMAGE_SUFFIXES]
+        source_png = next((page for page in source_pages if page.exists()), None)
+        if source_png:
             folder_md = output_folder / 'documents' / paths["parent_path"].with_suffix('.md')
             source_result = process_image(source_png, folder_md)
             results.append(source_result)
@@ -12,6 +12,7 @@ from openai import OpenAI
 from utils.batch import BatchProcessor
 from utils.processor import process_file
 from utils.segment_handler import SegmentHandler
+from utils.image_io import IMAGE_SUFFIXES, load_image
 
 # Base 64 encoding format
 def encode_image(image: Image.Image) -> str:
@@ -33,7 +34,7 @@ def process_image(file_path: Path, out_path: Path) -> dict:
             print(f"[cyan]Processing image: {file_path}")
             
             # Load and process image
-            image = Image.open(file_path).convert("RGB")
+            image = load_image(file_path)[0].convert("RGB")
             
             # Encode image for API
             base64_image = encode_image(image)
@@ -106,9 +107,7 @@ def process_document(file_path: str, output_folder: Path) -> dict:
         file_path=str(file_path),
         output_folder=output_folder,
         process_fn=process_fn,
-        file_types={
-            '.png': process_fn
-        }
+        file_types={suffix: process_fn for suffix in IMAGE_SUFFIXES}
     )
 
 def transcribe(
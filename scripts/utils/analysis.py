@@ -0,0 +1,75 @@
+from PIL import Image
+from typing import Optional
+import math
+
+# Decisions (skew angle, document type, yellowing) are stable at this size, so
+# stages analyse a reduced copy and apply results at full size. Split detection
+# is not among them: its edge and density features depend on scale.
+DEFAULT_ANALYSIS_MAX_SIDE = 1500
+
+class AnalysisLevel:
+    """A reduced copy of a page plus the scale back to full resolution"""
+
+    def __init__(self, image: Image.Image, full_size: tuple[int, int]):
+        self.image = image
+        self.full_size = full_size
+        self.scale_x = full_size[0] / image.size[0]
+        self.scale_y = full_size[1] / image.size[1]
+
+    @property
+    def factor(self) -> float:
+        """Linear reduction factor (1.0 when analysing at full resolution)"""
+        return max(self.scale_x, self.scale_y)
+
+    def to_full_x(self, x: float) -> int:
+        return min(self.full_size[0], int(round(x * self.scale_x)))
+
+    def to_full_y(self, y: float) -> int:
+        return min(self.full_size[1], int(round(y * self.scale_y)))
+
+    def to_level(self, length: float) -> int:
+        """Convert a full-resolution pixel length (window, line length...) to this level"""
+        return max(1, int(round(length / self.factor)))
+
+def draft_decode(image: Image.Image, min_side: float) -> Optional[Image.Image]:
+    """
+    Decode a JPEG at reduced size using libjpeg DCT scaling (PIL `draft`).
+
+    Only applies to a JPEG opened from disk whose pixels have not been decoded
+    yet; it is reopened so the caller's handle can still decode at full size
+    later. The smallest 1/2, 1/4 or 1/8 scale whose longest side is still at
+    least `min_side` is used. Returns None when draft decoding does not apply.
+    """
+    if getattr(image, "format", None) != "JPEG" or not getattr(image, "tile", None) or not getattr(image, "filename", None):
+        return None
+    width, height = image.size
+    if max(width, height) < 2 * min_side:
+        return None
+    ratio = min_side / max(width, height)
+    reduced = Image.open(image.filename)
+    reduced.draft(image.mode, (math.ceil(width * ratio), math.ceil(height * ratio)))
+    reduced.load()
+    return reduced
+
+def analysis_level(image: Image.Image, max_side: int = DEFAULT_ANALYSIS_MAX_SIDE) -> AnalysisLevel:
+    """
+    Pick the pyramid level whose longest side is at most `max_side`.
+
+    A JPEG that has not been decoded yet is read with draft decoding, so the
+    full-resolution pixels are only decoded if the caller needs them. Otherwise
+    PIL's integer box reduction is used, which is much cheaper than a resample
+    and keeps average intensities intact. `max_side` of 0 or None disables it.
+    """
+    full_size = image.size
+    factor = math.ceil(max(full_size) / max_side) if max_side else 1
+    if factor <= 1:
+        return AnalysisLevel(image, full_size)
+    drafted = draft_decode(image, max(full_size) / factor)
+    if drafted is not None:
+        image = drafted
+        factor = math.ceil(max(image.size) / max_side)
+        if factor <= 1:
+            return AnalysisLevel(image, full_size)
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGB")
+    return AnalysisLevel(image.reduce(factor), full_size)
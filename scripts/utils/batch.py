@@ -1,12 +1,39 @@
 from pathlib import Path
 from typing import Callable, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from itertools import chain
+import multiprocessing
 from rich.console import Console
 from .manifest import ManifestProcessor
 from .progress import ProgressTracker
+from .hashing import file_signature, params_fingerprint, signature_matches
+from .files import DirectoryIndex
+from . import page_cache
+from .streaming import StageStream, current_stream
+from datetime import datetime
+import os
 import sys
 
 console = Console()
 
+# Each pool worker serves exactly one BatchProcessor. Its processor function
+# and page cache setting are handed over by the pool initializer; under fork
+# the initargs are inherited rather than pickled, so stages may pass lambdas.
+_worker_processor_fn: Optional[Callable] = None
+
+def _init_worker(processor_fn: Callable, write_page_cache: bool):
+    global _worker_processor_fn
+    _worker_processor_fn = processor_fn
+    page_cache.configure(write_page_cache)
+
+def _run_in_worker(full_path: str, output_folder: Path) -> dict:
+    """Run the inherited processor function inside a pool worker"""
+    try:
+        return _worker_processor_fn(full_path, output_folder)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {str(e)}"}
+
 class BatchProcessor:
     """Handles batch processing of files with progress tracking and manifest management"""
     
@@ -18,7 +45,14 @@ class BatchProcessor:
         processor_fn: Callable,
         batch_size: int = 100,
         base_folder: Path = None,
-        use_source: bool = False
+        use_source: bool = False,
+        workers: int = 1,
+        journal: bool = True,
+        manifest_backend: str = "jsonl",
+        params: dict = None,
+        batch_fn: Callable = None,
+        skip_existing: bool = False,
+        output_suffix: str = None
     ):
         self.input_manifest = Path(input_manifest)
         self.output_folder = Path(output_folder)
@@ -27,6 +61,18 @@ class BatchProcessor:
         self.processor_fn = processor_fn
         self.batch_size = batch_size
         self.use_source = use_source
+        self.workers = max(1, int(workers or 1))
+        # Optional (paths, output_folder) -> results hook for stages that work on whole batches
+        self.batch_fn = batch_fn
+        # Entries are redone when the stage parameters change
+        self.params_fingerprint = params_fingerprint(params)
+        # Trust an output already on disk for an input without a manifest entry
+        # (a crashed run can leave a partially written file behind). Outputs are
+        # named like the input, with `output_suffix` if the stage sets one.
+        self.skip_existing = skip_existing
+        self.output_suffix = output_suffix
+        # Output folders are listed once per run to answer those checks
+        self.output_index = DirectoryIndex()
         
         # Setup folders and files
         self.output_folder.mkdir(parents=True, exist_ok=True)
@@ -35,10 +81,20 @@ class BatchProcessor:
         
         # Initialize manifest processors
         self.input_proc = ManifestProcessor(manifest_path=self.input_manifest, progress_file=None)
-        self.output_proc = ManifestProcessor(manifest_path=self.manifest_file, progress_file=self.progress_file)
+        self.output_proc = ManifestProcessor(
+            manifest_path=self.manifest_file,
+            progress_file=self.progress_file,
+            journal=journal,
+            backend=manifest_backend
+        )
         
     def process(self) -> Dict:
         """Run the batch processing"""
+        self.output_index.refresh()
+        stream = current_stream()
+        if stream is not None:
+            return self._process_stream(stream)
+
         documents = []
         skipped_count = 0
         
@@ -47,33 +103,13 @@ class BatchProcessor:
         console.print(f"Input manifest: {self.input_manifest}")
         console.print(f"Output folder: {self.output_folder}")
         
-        for doc in self.input_proc.stream_entries():
-            # Skip directory entries
-            if doc.get("type") == "directory":
+        paths = [path for doc in self.input_proc.stream_entries() for path in self._doc_paths(doc)]
+        # Skip if already processed and neither input nor parameters changed
+        for path, entry in self._split_pending(paths):
+            if entry is not None:
+                skipped_count += 1
                 continue
-
-            paths_to_process = []
-            
-            # Get document paths based on configuration
-            if self.use_source and "source" in doc:
-                paths_to_process.append(doc["source"])
-            elif "outputs" in doc and doc["outputs"]:
-                # Handle both string and dict outputs
-                for out_path in doc["outputs"]:
-                    if isinstance(out_path, str):
-                        paths_to_process.append(out_path)
-                    elif isinstance(out_path, dict) and "path" in out_path:
-                        paths_to_process.append(out_path["path"])
-            elif doc.get("path"):  # Fallback for direct paths
-                paths_to_process.append(doc["path"])
-                
-            # Process collected paths
-            for path in paths_to_process:
-                # Skip if already processed
-                if path in self.output_proc.entries:
-                    skipped_count += 1
-                    continue
-                documents.append({"path": path})
+            documents.append({"path": path})
 
         total_files = len(documents)
         stats = {
@@ -97,6 +133,7 @@ class BatchProcessor:
             progress_fields=stats
         )
 
+        executor = None if self.batch_fn else self._create_executor()
         try:
             with tracker.progress as progress:
                 current_batch = []
@@ -105,65 +142,255 @@ class BatchProcessor:
                     current_batch.append(doc)
                     
                     if len(current_batch) >= self.batch_size:
-                        self._process_batch(current_batch, stats, progress, tracker.task)
+                        self._process_batch(current_batch, stats, progress, tracker.task, executor)
                         current_batch = []
                         self.output_proc.write_progress(stats)
 
                 # Process remaining files
                 if current_batch:
-                    self._process_batch(current_batch, stats, progress, tracker.task)
+                    self._process_batch(current_batch, stats, progress, tracker.task, executor)
 
             # Ensure final manifest is saved after all processing
-            self.output_proc._write_manifest(self.manifest_file)
+            self.output_proc.compact()
             self.output_proc.write_progress(stats)
             self._print_stats(stats)
             return stats
 
         except KeyboardInterrupt:
             console.print("\n[yellow]Processing interrupted by user. Saving progress...")
-            self.output_proc._write_manifest(self.manifest_file)  # Save manifest
+            self.output_proc.compact()  # Save manifest
             self.output_proc.write_progress(stats)  # Save progress
             sys.exit(1)
         except Exception as e:
             console.print(f"\n[red]Error occurred: {e}")
+            self.output_proc.close_journal()  # Journal is replayed on next run
             self.output_proc.write_progress(stats)
             raise
+        finally:
+            if executor:
+                executor.shutdown(wait=True, cancel_futures=True)
 
-    def _process_batch(self, batch: List[dict], stats: dict, progress, task):
-        """Process a batch of files"""
-        for doc in batch:
+    def _process_stream(self, stream: StageStream) -> Dict:
+        """Process entries as they arrive from the scheduler, publishing each result downstream"""
+        stats = {"total": 0, "skipped": 0, "processed": 0, "failed": 0}
+        source = "upstream stage" if stream.input_queue else str(self.input_manifest)
+        console.print(f"[blue]{self.process_name}: streaming from {source} to {self.output_folder}")
+        # Once the upstream stage is done its manifest is complete, so a
+        # second pass over it picks up any entry that was not streamed
+        docs = self.input_proc.stream_entries()
+        if stream.input_queue:
+            docs = chain(stream.input_docs(), docs)
+        # Other stages run in threads of this process, which is not safe to
+        # fork, so --workers uses threads here
+        pool = ThreadPoolExecutor(
+            max_workers=self.workers,
+            # The page cache setting is per thread: hand this stage's on
+            initializer=page_cache.configure,
+            initargs=(page_cache.writing(),)
+        ) if self.workers > 1 else None
+        if pool:
+            console.print(f"Using {self.workers} worker threads")
+        in_flight = deque()
+        seen = set()
+        try:
+            for doc in docs:
+                paths = [path for path in self._doc_paths(doc) if path not in seen]
+                seen.update(paths)
+                for path, entry in self._split_pending(paths):
+                    stats["total"] += 1
+                    if entry is not None:
+                        stats["skipped"] += 1
+                        stream.publish(entry)
+                        continue
+                    full_path = str(self._resolve_path(Path(path)))
+                    if pool is None:
+                        self._finish_streamed(path, lambda: self.processor_fn(full_path, self.output_folder), stats, stream)
+                        continue
+                    in_flight.append((path, pool.submit(self.processor_fn, full_path, self.output_folder)))
+                    # Keep every worker busy without reading far ahead of them
+                    while len(in_flight) >= 2 * self.workers:
+                        path, future = in_flight.popleft()
+                        self._finish_streamed(path, future.result, stats, stream)
+                if stats["total"] and stats["total"] % self.batch_size == 0:
+                    self.output_proc.write_progress(stats)
+            while in_flight:
+                path, future = in_flight.popleft()
+                self._finish_streamed(path, future.result, stats, stream)
+            self.output_proc.compact()
+            self.output_proc.write_progress(stats)
+            console.print(f"[green]{self.process_name}: done. Processed: {stats['processed']}, "
+                          f"Skipped: {stats['skipped']}, Failed: {stats['failed']}")
+            return stats
+        except Exception:
+            self.output_proc.close_journal()  # Journal is replayed on next run
+            self.output_proc.write_progress(stats)
+            raise
+        finally:
+            if pool:
+                pool.shutdown(wait=True, cancel_futures=True)
+            stream.close()
+
+    def _finish_streamed(self, path: str, get_result: Callable[[], dict], stats: dict, stream: StageStream):
+        """Record one streamed result and pass it downstream"""
+        try:
+            result = get_result()
+        except Exception as e:
+            console.print(f"[red]Error processing {path}: {e}")
+            stats["failed"] += 1
+            return
+        self._record_result(Path(path), result, stats)
+        stream.publish(result)
+
+    def _doc_paths(self, doc: dict) -> List[str]:
+        """Get the input paths a manifest entry contributes to this stage"""
+        # Skip directory entries and files a rescan found removed
+        if doc.get("type") in ("directory", "removed"):
+            return []
+
+        paths_to_process = []
+        
+        # Get document paths based on configuration
+        if self.use_source and "source" in doc:
+            paths_to_process.append(doc["source"])
+        elif "outputs" in doc and doc["outputs"]:
+            # Handle both string and dict outputs
+            for out_path in doc["outputs"]:
+                if isinstance(out_path, str):
+                    paths_to_process.append(out_path)
+                elif isinstance(out_path, dict) and "path" in out_path:
+                    paths_to_process.append(out_path["path"])
+        elif doc.get("path"):  # Fallback for direct paths
+            paths_to_process.append(doc["path"])
+        return paths_to_process
+
+    def _split_pending(self, paths: List[str]) -> List[tuple]:
+        """
+        Pair each input path with its output entry if that entry is still
+        current, or None if the path has to be (re)processed. Paths without
+        any entry are found with one indexed lookup for the whole list.
+        """
+        new_paths = set(self.output_proc.pending_sources(paths))
+        result = []
+        for path in paths:
+            entry = None if path in new_paths else self.output_proc.get_entry(path)
+            if entry is not None and not self._is_current(entry, Path(path)):
+                entry = None
+            if entry is None and self.skip_existing:
+                entry = self._existing_output_entry(path)
+            result.append((path, entry))
+        return result
+
+    def _existing_output_entry(self, path: str) -> Optional[dict]:
+        """Record an output found on disk as a skipped entry, or return None if there is none"""
+        rel_path = Path(path)
+        if "documents" in rel_path.parts:
+            rel_path = Path(*rel_path.parts[rel_path.parts.index("documents") + 1:])
+        out_rel = rel_path.with_suffix(self.output_suffix) if self.output_suffix else rel_path
+        if not self.output_index.exists(self.output_folder / "documents" / out_rel):
+            return None
+        try:
+            signature = file_signature(self._resolve_path(Path(path)))
+        except OSError:
+            return None
+        entry = {
+            "source": str(rel_path),
+            "outputs": [str(out_rel)],
+            "processed_at": datetime.now().isoformat(),
+            "success": True,
+            "skipped": True,
+            "input": signature,
+            "params_fingerprint": self.params_fingerprint
+        }
+        self.output_proc.save_entry(entry)
+        return entry
+
+    def _is_current(self, entry: dict, path: Path) -> bool:
+        """Check a manifest entry against the current input file and stage parameters"""
+        recorded = entry.get("input")
+        if not recorded:
+            # Entries written before input hashes were recorded are trusted as-is
+            return True
+        if entry.get("params_fingerprint") != self.params_fingerprint:
+            return False
+        full_path = self._resolve_path(path)
+        unchanged, stat_changed = signature_matches(full_path, recorded)
+        if unchanged and stat_changed:
+            # Touched but identical: refresh the stat so it is not re-hashed next run
+            st = os.stat(full_path)
+            entry["input"] = {**recorded, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            self.output_proc.save_entry(entry)
+        return unchanged
+
+    def _create_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Create a forked process pool when more than one worker is requested"""
+        if self.workers <= 1:
+            return None
+        try:
+            mp_context = multiprocessing.get_context("fork")
+        except ValueError:
+            console.print("[yellow]Process pools need the 'fork' start method; running serially")
+            return None
+        console.print(f"Using {self.workers} worker processes")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(self.processor_fn, page_cache.writing())
+        )
+
+    def _resolve_path(self, path: Path) -> Path:
+        """Build the full input path for a manifest path"""
+        # Fix path resolution - remove double 'documents' if present
+        if self.base_folder:
+            if 'documents' in str(self.base_folder):
+                # Base folder already has documents
+                full_path = self.base_folder / path
+            else:
+                # Need to add documents
+                full_path = self.base_folder / 'documents' / path
+        else:
+            full_path = path
+
+        # Ensure extension is preserved
+        if path.suffix:
+            full_path = full_path.with_suffix(path.suffix)
+        return full_path
+
+    def _process_batch(self, batch: List[dict], stats: dict, progress, task, executor: ProcessPoolExecutor = None):
+        """Process a batch of files, fanning out to the process pool if one is given"""
+        if self.batch_fn:
+            paths = [Path(doc["path"]) for doc in batch]
             try:
+                results = self.batch_fn([str(self._resolve_path(path)) for path in paths], self.output_folder)
+            except Exception as e:
+                console.print(f"[red]Error processing batch: {e}")
+                results = [{"error": f"{type(e).__name__}: {str(e)}"} for _ in paths]
+            for path, result in zip(paths, results):
+                self._record_result(path, result, stats)
+                progress.update(task, advance=1, **stats)
+            return
+
+        if executor:
+            # Submit the whole batch, then collect in submission order so the
+            # manifest is written by the parent only
+            futures = []
+            for doc in batch:
                 path = Path(doc["path"])
-                
-                # Fix path resolution - remove double 'documents' if present
-                if self.base_folder:
-                    if 'documents' in str(self.base_folder):
-                        # Base folder already has documents
-                        full_path = self.base_folder / path
-                    else:
-                        # Need to add documents
-                        full_path = self.base_folder / 'documents' / path
-                else:
-                    full_path = path
-
-                # Ensure extension is preserved
-                if path.suffix:
-                    full_path = full_path.with_suffix(path.suffix)
-                
-                result = self.processor_fn(str(full_path), self.output_folder)
-                
-                # Preserve source path in result
-                if not result.get("source"):
-                    result["source"] = str(path)
-                self.output_proc.save_entry(result)
-                
-                if result.get("skipped"):
-                    stats["skipped"] += 1
-                elif result.get("error"):
+                futures.append((path, executor.submit(_run_in_worker, str(self._resolve_path(path)), self.output_folder)))
+            for path, future in futures:
+                try:
+                    self._record_result(path, future.result(), stats)
+                except Exception as e:
+                    console.print(f"[red]Error processing {path}: {e}")
                     stats["failed"] += 1
-                else:
-                    stats["processed"] += 1
-                    
+                progress.update(task, advance=1, **stats)
+            return
+
+        for doc in batch:
+            try:
+                path = Path(doc["path"])
+                result = self.processor_fn(str(self._resolve_path(path)), self.output_folder)
+                self._record_result(path, result, stats)
                 progress.update(task, advance=1, **stats)
                 
             except Exception as e:
@@ -171,6 +398,21 @@ class BatchProcessor:
                 stats["failed"] += 1
                 progress.update(task, advance=1, **stats)
 
+    def _record_result(self, path: Path, result: dict, stats: dict):
+        """Save a processor result to the output manifest and update stats"""
+        # Preserve source path in result
+        if not result.get("source"):
+            result["source"] = str(path)
+        result["params_fingerprint"] = self.params_fingerprint
+        self.output_proc.save_entry(result)
+        
+        if result.get("skipped"):
+            stats["skipped"] += 1
+        elif result.get("error"):
+            stats["failed"] += 1
+        else:
+            stats["processed"] += 1
+
     def _print_stats(self, stats: dict):
         """Print final statistics"""
         console.print(f"\n[green]Processing completed. Final statistics:")
@@ -1,14 +1,110 @@
 from pathlib import Path
-from typing import List, Dict
-
-def batch_check_files(files_to_check: List[Path], batch_size: int = 100) -> Dict[Path, bool]:
-    """Check existence of multiple files in batches to reduce disk seeks"""
-    results = {}
-    for i in range(0, len(files_to_check), batch_size):
-        batch = files_to_check[i:i + batch_size]
-        for path in batch:
-            results[path] = path.exists()
-    return results
+from typing import Dict, Iterable, List, Optional
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Linux ioctl that clones a file's extents (btrfs, XFS, bcachefs...)
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+class DirectoryIndex:
+    """
+    Answers file existence queries from directory listings.
+
+    Each directory is read once with os.scandir and the names of its files
+    (not subdirectories) kept in a set, so checking N outputs costs one
+    listing per folder instead of N stat() calls. Listings are cached; call
+    add() for files written since, or refresh() to re-read.
+    """
+
+    def __init__(self):
+        self._listings: Dict[str, frozenset] = {}
+        self._added: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def _names(self, directory: str) -> frozenset:
+        names = self._listings.get(directory)
+        if names is None:
+            try:
+                with os.scandir(directory) as it:
+                    names = frozenset(entry.name for entry in it if entry.is_file())
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                names = frozenset()
+            with self._lock:
+                self._listings[directory] = names
+        return names
+
+    def exists(self, path: Path) -> bool:
+        directory, name = os.path.split(os.fspath(path))
+        directory = directory or "."
+        return name in self._names(directory) or name in self._added.get(directory, ())
+
+    def missing(self, paths: Iterable[Path]) -> List[Path]:
+        return [path for path in paths if not self.exists(path)]
+
+    def add(self, path: Path):
+        """Record a file written after its directory was listed"""
+        directory, name = os.path.split(os.fspath(path))
+        with self._lock:
+            self._added.setdefault(directory or ".", set()).add(name)
+
+    def refresh(self, directory: Optional[Path] = None):
+        """Forget one cached listing, or all of them"""
+        with self._lock:
+            if directory is None:
+                self._listings.clear()
+                self._added.clear()
+            else:
+                self._listings.pop(os.fspath(directory), None)
+                self._added.pop(os.fspath(directory), None)
+
+def _reflink(src: Path, dst: Path):
+    if fcntl is None:
+        raise OSError("reflink not supported")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+def link_or_copy(src: Path, dst: Path, hardlink: bool = True) -> str:
+    """
+    Make dst an unchanged copy of src without re-encoding it.
+
+    Tries a copy-on-write reflink, then a hardlink (unless `hardlink` is
+    False), then a plain copy, and returns which one was used. The file is
+    placed atomically, and an existing dst is replaced rather than
+    overwritten in place, so a previous hardlink never modifies its source.
+    Only allow hardlinks where every writer of either path replaces the file
+    instead of rewriting it, since both names share one inode.
+    """
+    src, dst = Path(src), Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    # Renaming a hardlink over itself is a no-op that would leave tmp behind
+    if hardlink and dst.exists() and os.path.samefile(src, dst):
+        return "hardlink"
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    if tmp.exists():
+        tmp.unlink()
+    methods = [("reflink", _reflink), ("hardlink", os.link), ("copy", shutil.copyfile)]
+    if not hardlink:
+        methods.pop(1)
+    for method, fn in methods:
+        try:
+            fn(src, tmp)
+        except OSError:
+            if method == "copy":
+                raise
+            continue
+        os.replace(tmp, dst)
+        return method
 
 def ensure_dirs(path: Path):
     """Ensure all parent directories exist"""
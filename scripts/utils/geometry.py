@@ -0,0 +1,103 @@
+from PIL import Image
+from typing import Optional, Sequence
+import numpy as np
+import cv2
+
+# PIL resample filters and their OpenCV counterparts
+INTERPOLATION = {
+    Image.NEAREST: cv2.INTER_NEAREST,
+    Image.BILINEAR: cv2.INTER_LINEAR,
+    Image.BICUBIC: cv2.INTER_CUBIC,
+    Image.LANCZOS: cv2.INTER_LANCZOS4
+}
+
+class GeometryPlan:
+    """
+    A page's geometry as one affine transform from source to output pixels.
+
+    Stages add their crop or rotation with crop() / rotate() instead of
+    resampling, and the page is rendered once from the source pixels with
+    render(). Crops alone never resample: a plan that is an integer translation
+    is rendered with a plain crop.
+    """
+
+    def __init__(self, size: Sequence[int], matrix: Optional[np.ndarray] = None):
+        self.size = (int(size[0]), int(size[1]))
+        self.matrix = np.eye(3) if matrix is None else np.asarray(matrix, dtype=np.float64)
+
+    @classmethod
+    def identity(cls, size: Sequence[int]) -> "GeometryPlan":
+        return cls(size)
+
+    def _then(self, matrix: np.ndarray, size: Sequence[int]) -> "GeometryPlan":
+        return GeometryPlan(size, matrix @ self.matrix)
+
+    def crop(self, box: Sequence[int]) -> "GeometryPlan":
+        """Keep the (x1, y1, x2, y2) region of the current output"""
+        x1, y1, x2, y2 = box
+        shift = np.array([[1, 0, -x1], [0, 1, -y1], [0, 0, 1]], dtype=np.float64)
+        return self._then(shift, (x2 - x1, y2 - y1))
+
+    def rotate(self, angle: float, center: Sequence[float] = None, expand: bool = False) -> "GeometryPlan":
+        """
+        Rotate the current output counter-clockwise by `angle` degrees around
+        `center`, like cv2.getRotationMatrix2D (pixel centres at integer
+        coordinates). The default centre is the middle of the page, as in PIL's
+        Image.rotate. With expand the output grows to hold the whole rotated
+        page, as Image.rotate(expand=True) does.
+        """
+        width, height = self.size
+        if center is None:
+            center = ((width - 1) / 2, (height - 1) / 2)
+        rotation = np.vstack([cv2.getRotationMatrix2D(tuple(map(float, center)), angle, 1.0), [0, 0, 1]])
+        size = self.size
+        if expand:
+            corners = np.array([[0, 0, 1], [width - 1, 0, 1], [0, height - 1, 1], [width - 1, height - 1, 1]], dtype=np.float64).T
+            mapped = rotation @ corners
+            x_min, y_min = mapped[0].min(), mapped[1].min()
+            size = (int(round(mapped[0].max() - x_min)) + 1, int(round(mapped[1].max() - y_min)) + 1)
+            rotation = np.array([[1, 0, -x_min], [0, 1, -y_min], [0, 0, 1]]) @ rotation
+        return self._then(rotation, size)
+
+    def then(self, other: "GeometryPlan") -> "GeometryPlan":
+        """Apply another plan (expressed on this plan's output) after this one"""
+        return self._then(other.matrix, other.size)
+
+    def integer_offset(self) -> Optional[tuple[int, int]]:
+        """(x, y) of the output's top-left corner in the source if the plan is a plain crop"""
+        linear = self.matrix[:2, :2]
+        offset = -self.matrix[:2, 2]
+        if not np.allclose(linear, np.eye(2), atol=1e-9) or not np.allclose(offset, np.round(offset), atol=1e-6):
+            return None
+        return int(round(offset[0])), int(round(offset[1]))
+
+    def render(self, image: Image.Image, resample: int = Image.BILINEAR, fill=None) -> Image.Image:
+        """Produce the output from the source pixels in a single resampling pass"""
+        offset = self.integer_offset()
+        if offset is not None:
+            x, y = offset
+            if (x, y) == (0, 0) and self.size == image.size:
+                return image
+            return image.crop((x, y, x + self.size[0], y + self.size[1]))
+        if fill is None:
+            fill = 255 if image.mode in ("L", "RGB") else 0
+        channels = len(image.getbands())
+        border = (fill,) * channels if np.isscalar(fill) else tuple(fill)
+        warped = cv2.warpAffine(
+            np.asarray(image), self.matrix[:2], self.size,
+            flags=INTERPOLATION.get(resample, cv2.INTER_LINEAR),
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=border
+        )
+        return Image.fromarray(warped)
+
+    def to_dict(self) -> dict:
+        """Manifest form: output size and the 2x3 source-to-output matrix"""
+        return {
+            "size": list(self.size),
+            "matrix": [[round(float(v), 6) for v in row] for row in self.matrix[:2]]
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "GeometryPlan":
+        return cls(values["size"], np.vstack([np.asarray(values["matrix"], dtype=np.float64), [0, 0, 1]]))
@@ -0,0 +1,51 @@
+from pathlib import Path
+from typing import Optional
+import os
+import srsly
+import xxhash
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_hash(path: Path) -> str:
+    """Fast xxh3 content hash of a file, streamed in 1MB chunks"""
+    h = xxhash.xxh3_64()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def params_fingerprint(params: Optional[dict]) -> str:
+    """
+    Stable fingerprint of a stage's parameters (its STAGE_PARAMS), recorded
+    with every manifest entry so BatchProcessor redoes entries when it changes.
+    Only values the stage actually reads belong in STAGE_PARAMS; its "version"
+    is bumped when the stage's logic changes output on its own.
+    """
+    return xxhash.xxh3_64(srsly.json_dumps(params or {}, sort_keys=True).encode("utf-8")).hexdigest()
+
+def file_signature(path: Path) -> dict:
+    """Record size, mtime and content hash of an input file for the manifest"""
+    st = os.stat(path)
+    return {
+        "hash": file_hash(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns
+    }
+
+def signature_matches(path: Path, recorded: dict) -> tuple[bool, bool]:
+    """Compare a file against its recorded signature.
+
+    Returns (unchanged, stat_changed). Size and mtime are checked first so an
+    untouched file is never opened; the hash is only computed when the stat
+    differs but the size does not.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        # Missing input: nothing new to process
+        return True, False
+    if st.st_size != recorded.get("size"):
+        return False, True
+    if st.st_mtime_ns == recorded.get("mtime_ns"):
+        return True, False
+    return file_hash(path) == recorded.get("hash"), True
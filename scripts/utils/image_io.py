@@ -0,0 +1,98 @@
+from PIL import Image
+from pathlib import Path
+from typing import Optional
+import time
+import numpy as np
+
+from . import page_cache
+
+try:
+    import pillow_jxl  # noqa: F401  Registers the JPEG XL plugin with PIL
+except ImportError:
+    pillow_jxl = None
+
+# Codecs for images passed between stages. "jpeg" keeps the historical
+# output; the others are lossless and trade file size for encode time.
+IMAGE_FORMATS = {
+    "jpeg": {"suffix": ".jpg", "save": {"format": "JPEG"}},
+    "png": {"suffix": ".png", "save": {"format": "PNG"}},
+    # zlib level 1: much faster to write than the default 6, slightly larger
+    "png-fast": {"suffix": ".png", "save": {"format": "PNG", "compress_level": 1}},
+    # Lossless WebP at its fastest effort (exact keeps colour under transparent
+    # pixels); pages must be under 16384 px a side and grayscale comes back RGB
+    "webp": {"suffix": ".webp", "save": {"format": "WEBP", "lossless": True, "exact": True, "quality": 0, "method": 0}},
+    "jxl": {"suffix": ".jxl", "save": {"format": "JXL", "lossless": True, "effort": 2}},
+    # Raw array, read back as a memory map: no encode or decode at all
+    "npy": {"suffix": ".npy", "save": None},
+}
+
+# Every suffix an image stage may be handed by the previous one
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.jxl', '.npy')
+
+def check_format(image_format: str) -> str:
+    """Validate an --image-format value"""
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}. Choose from {', '.join(IMAGE_FORMATS)}")
+    if image_format == "jxl" and pillow_jxl is None:
+        raise ValueError("The jxl image format needs pillow-jxl-plugin")
+    return image_format
+
+def image_suffix(image_format: str) -> str:
+    return IMAGE_FORMATS[image_format]["suffix"]
+
+def save_image(image: Image.Image, path: Path, image_format: str, quality: int = 100) -> tuple[Path, dict]:
+    """
+    Encode a page with one of IMAGE_FORMATS, replacing the suffix of `path`.
+    `quality` only applies to JPEG. Returns (written path, codec stats for the manifest).
+    """
+    path = Path(path).with_suffix(image_suffix(image_format))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    if image_format == "npy":
+        np.save(path, np.asarray(image))
+    else:
+        save_kwargs = dict(IMAGE_FORMATS[image_format]["save"])
+        if image_format == "jpeg":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            save_kwargs["quality"] = quality
+        image.save(path, **save_kwargs)
+    stats = {
+        "format": image_format,
+        "encode_ms": round((time.perf_counter() - start) * 1000, 1),
+        "bytes": path.stat().st_size
+    }
+    # A raw .npy page is already memory-mapped when read back
+    if page_cache.writing() and image_format != "npy":
+        stats["page_cache"] = page_cache.store(path, image)
+    return path, stats
+
+def load_image(path: Path, lazy: bool = False) -> tuple[Image.Image, dict]:
+    """
+    Open a page written by any image stage. Raw .npy pages and pages with a
+    valid page cache entry are memory-mapped instead of decoded (format
+    "page_cache"). Other pixels are decoded up front so the decode time can be
+    reported, except for a JPEG opened with `lazy` (to keep draft decoding
+    available), whose decode_ms is None. Returns (image, codec stats for the manifest).
+    """
+    path = Path(path)
+    start = time.perf_counter()
+    cached = page_cache.load(path)
+    if cached is not None:
+        image = cached
+        image_format = "page_cache"
+    elif path.suffix.lower() == ".npy":
+        array = np.load(path, mmap_mode="r")
+        # Mode (L, RGB, RGBA) follows from the array shape
+        image = Image.fromarray(array)
+        image_format = "npy"
+    else:
+        image = Image.open(path)
+        image_format = (image.format or path.suffix.lstrip(".")).lower()
+        if lazy and image.format == "JPEG":
+            return image, {"format": image_format, "decode_ms": None}
+        image.load()
+    return image, {
+        "format": image_format,
+        "decode_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
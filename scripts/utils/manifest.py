@@ -5,17 +5,47 @@ import os
 from rich.console import Console
 import tempfile
 import shutil
+from typing import Iterable, Iterator, List, Optional
+from .manifest_store import SqliteManifestStore
 
 console = Console()
 
 class ManifestProcessor:
-    def __init__(self, manifest_path: Path, progress_file: Path = None):
+    def __init__(
+        self,
+        manifest_path: Path,
+        progress_file: Path = None,
+        journal: bool = False,
+        fsync_every: int = 100,
+        backend: str = "jsonl"
+    ):
+        if backend not in ("jsonl", "sqlite"):
+            raise ValueError(f"Unknown manifest backend: {backend}")
         self.manifest_path = Path(manifest_path)
         self.progress_file = progress_file
-        self.total_files = self.count_lines()
+        self.backend = backend
+        # SQLite commits every entry itself, so the journal is JSONL-only
+        self.journal = journal and backend == "jsonl"
+        self.fsync_every = fsync_every
+        self.journal_path = self.manifest_path.with_suffix('.journal.jsonl')
+        self._journal_file = None
+        self._unsynced = 0
         self.processed = 0 if not progress_file else self.get_last_progress()
-        self.entries = {}
-        self._load_existing_entries()
+        if backend == "sqlite":
+            self.entries = SqliteManifestStore(self.manifest_path.with_suffix('.sqlite'))
+            self.entries.sync_from_jsonl(self.manifest_path, self._entry_key)
+            self.total_files = len(self.entries)
+        else:
+            self.total_files = self.count_lines()
+            self.entries = {}
+            self._load_existing_entries()
+        # A journal left behind by a crashed run is replayed on load and folded
+        # back into the manifest so nothing after the last compaction is lost.
+        # Only the manifest's writer (journal=True) does this; readers must not
+        # compact a journal another stage may still be appending to.
+        if journal and self.journal_path.exists():
+            self._replay_journal()
+            self.compact()
 
     def count_lines(self) -> int:
         """Fast line count without loading content"""
@@ -63,32 +93,108 @@ class ManifestProcessor:
         if "source" not in entry:
             return
             
-        source = entry["source"]
-        if source in self.entries:
-            # Only update if entry has changed
-            if self.entries[source] != entry:
-                self.entries[source] = entry
-        else:
-            self.entries[source] = entry
+        key = self._entry_key(entry["source"])
+        # Only update if entry has changed
+        if self.entries.get(key) == entry:
+            return
+        self.entries[key] = entry
 
+        if self.journal:
+            self._append_to_journal(entry)
         # Write entire manifest atomically if needed
-        if len(self.entries) % 100 == 0:
+        elif self.backend == "jsonl" and len(self.entries) % 100 == 0:
             self._write_manifest(manifest_path or self.manifest_path)
 
+    def has_entry(self, source: str) -> bool:
+        """Check whether a source already has a manifest entry"""
+        return self._entry_key(source) in self.entries
+
+    def get_entry(self, source: str) -> Optional[dict]:
+        """Get the manifest entry for a source, if any"""
+        return self.entries.get(self._entry_key(source))
+
+    def iter_entries(self, success: Optional[bool] = None) -> Iterator[dict]:
+        """Iterate stored entries, optionally filtered by success"""
+        if self.backend == "sqlite":
+            yield from self.entries.values(success=success)
+            return
+        for entry in self.entries.values():
+            if success is None or bool(entry.get("success")) == success:
+                yield entry
+
+    def pending_sources(self, sources: Iterable[str], retry_failed: bool = False) -> List[str]:
+        """Return the sources that are not yet done, preserving input order"""
+        sources = list(sources)
+        keys = [self._entry_key(s) for s in sources]
+        if self.backend == "sqlite":
+            done = self.entries.existing(keys, success_only=retry_failed)
+        else:
+            done = {k for k in keys if k in self.entries and
+                    (not retry_failed or self.entries[k].get("success"))}
+        return [s for s, k in zip(sources, keys) if k not in done]
+
+    def compact(self):
+        """Fold the journal into the manifest, keeping the latest entry per source"""
+        self.close_journal()
+        self._write_manifest(self.manifest_path)
+        if self.journal_path.exists():
+            self.journal_path.unlink()
+        if self.backend == "sqlite":
+            self.entries.mark_jsonl_synced(self.manifest_path)
+
+    def close_journal(self):
+        """Flush, fsync and close the journal file if open"""
+        if self._journal_file is None:
+            return
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+        self._journal_file.close()
+        self._journal_file = None
+        self._unsynced = 0
+
+    def _append_to_journal(self, entry: dict):
+        """Append one entry to the journal, fsyncing every `fsync_every` entries"""
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_path, 'a')
+        self._journal_file.write(srsly.json_dumps(entry) + '\n')
+        # Flush per entry so a killed process loses nothing; fsync in batches
+        self._journal_file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            os.fsync(self._journal_file.fileno())
+            self._unsynced = 0
+
+    def _replay_journal(self):
+        """Apply journal entries on top of the loaded manifest entries"""
+        replayed = 0
+        with open(self.journal_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = srsly.json_loads(line)
+                except ValueError:
+                    # Torn final line from a crash mid-write
+                    continue
+                if "source" in entry:
+                    self.entries[self._entry_key(entry["source"])] = entry
+                    replayed += 1
+        console.print(f"[yellow]Replayed {replayed} journal entries from {self.journal_path}")
+
+    @staticmethod
+    def _entry_key(source: str) -> str:
+        """Store using source path as key without project prefix"""
+        path = Path(source)
+        if "documents" in path.parts:
+            # Get path after 'documents'
+            return str(Path(*path.parts[path.parts.index("documents")+1:]))
+        return str(path)
+
     def _load_existing_entries(self):
         """Load existing entries into memory for deduplication"""
         self.entries = {}
         if self.manifest_path.exists():
             for entry in srsly.read_jsonl(self.manifest_path):
                 if "source" in entry:
-                    # Store using source path as key without project prefix
-                    path = Path(entry["source"])
-                    if "documents" in path.parts:
-                        # Get path after 'documents'
-                        key = str(Path(*path.parts[path.parts.index("documents")+1:]))
-                    else:
-                        key = str(path)
-                    self.entries[key] = entry
+                    self.entries[self._entry_key(entry["source"])] = entry
 
     def _write_manifest(self, manifest_path: Path):
         """Write all entries atomically"""
@@ -96,6 +202,8 @@ class ManifestProcessor:
         with open(temp_path, 'w') as f:
             for entry in self.entries.values():
                 f.write(srsly.json_dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
         temp_path.replace(manifest_path)
 
     def print_status(self):
@@ -0,0 +1,148 @@
+import sqlite3
+import srsly
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+from rich.console import Console
+
+console = Console()
+
+class SqliteManifestStore:
+    """Dict-like manifest entry store backed by SQLite.
+
+    Entries are keyed by normalized source path, with indexed `parent_image`
+    and `success` columns, so existence and success checks need no loaded
+    manifest. The JSONL manifest stays the interchange format: it is imported
+    when it changes on disk and exported again on compaction. Until the first
+    compaction the store itself is the only record of a run.
+    """
+
+    QUERY_CHUNK = 500
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                source TEXT PRIMARY KEY,
+                parent_image TEXT,
+                success INTEGER,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_parent_image ON entries(parent_image);
+            CREATE INDEX IF NOT EXISTS idx_entries_success ON entries(success);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def _row(key: str, entry: dict) -> tuple:
+        success = entry.get("success")
+        return (
+            key,
+            entry.get("parent_image"),
+            None if success is None else int(bool(success)),
+            srsly.json_dumps(entry)
+        )
+
+    def __contains__(self, key: str) -> bool:
+        cur = self.conn.execute("SELECT 1 FROM entries WHERE source = ?", (key,))
+        return cur.fetchone() is not None
+
+    def __getitem__(self, key: str) -> dict:
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key: str, entry: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries (source, parent_image, success, data) VALUES (?, ?, ?, ?)",
+            self._row(key, entry)
+        )
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key: str, default=None) -> Optional[dict]:
+        row = self.conn.execute("SELECT data FROM entries WHERE source = ?", (key,)).fetchone()
+        return srsly.json_loads(row[0]) if row else default
+
+    def keys(self) -> Iterator[str]:
+        for (key,) in self.conn.execute("SELECT source FROM entries ORDER BY rowid"):
+            yield key
+
+    def values(self, success: Optional[bool] = None) -> Iterator[dict]:
+        if success is None:
+            cur = self.conn.execute("SELECT data FROM entries ORDER BY rowid")
+        else:
+            cur = self.conn.execute("SELECT data FROM entries WHERE success = ? ORDER BY rowid", (int(success),))
+        for (data,) in cur:
+            yield srsly.json_loads(data)
+
+    def existing(self, keys: Iterable[str], success_only: bool = False) -> set:
+        """Return the subset of keys that have an entry (optionally a successful one)"""
+        keys = list(keys)
+        found = set()
+        for i in range(0, len(keys), self.QUERY_CHUNK):
+            chunk = keys[i:i + self.QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            sql = f"SELECT source FROM entries WHERE source IN ({placeholders})"
+            if success_only:
+                sql += " AND success = 1"
+            found.update(key for (key,) in self.conn.execute(sql, chunk))
+        return found
+
+    def clear(self):
+        self.conn.execute("DELETE FROM entries")
+        self.conn.commit()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        self.conn.commit()
+
+    def sync_from_jsonl(self, manifest_path: Path, key_fn: Callable[[str], str]):
+        """Re-import the JSONL manifest only if it changed since the last sync"""
+        manifest_path = Path(manifest_path)
+        if not manifest_path.exists():
+            # A JSONL this store was synced from has been deleted: start over.
+            # With no sync recorded the entries are this store's own (a first
+            # run that stopped before compaction wrote the JSONL), so keep them.
+            if self.get_meta("jsonl_stat"):
+                self.clear()
+                self.set_meta("jsonl_stat", "")
+            return
+        if self.get_meta("jsonl_stat") == self._jsonl_stat(manifest_path):
+            return
+
+        console.print(f"[blue]Importing {manifest_path} into {self.db_path}")
+        with self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (source, parent_image, success, data) VALUES (?, ?, ?, ?)",
+                (self._row(key_fn(entry["source"]), entry)
+                 for entry in srsly.read_jsonl(manifest_path) if "source" in entry)
+            )
+        self.mark_jsonl_synced(manifest_path)
+
+    def mark_jsonl_synced(self, manifest_path: Path):
+        """Record the JSONL manifest's current size/mtime as in sync with the store"""
+        self.set_meta("jsonl_stat", self._jsonl_stat(Path(manifest_path)))
+
+    @staticmethod
+    def _jsonl_stat(manifest_path: Path) -> str:
+        st = manifest_path.stat()
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def close(self):
+        self.conn.close()
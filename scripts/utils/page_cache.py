@@ -0,0 +1,105 @@
+from PIL import Image
+from pathlib import Path
+from typing import Optional
+import json
+import os
+import threading
+import numpy as np
+
+from .files import link_or_copy
+
+# Stages only write cache entries when asked to (--page-cache); readers always
+# use an entry that is still valid. The scheduler runs stages as threads of one
+# process, so the setting is per thread (BatchProcessor passes it to its workers)
+_local = threading.local()
+
+# Modes whose pixels map one-to-one onto a uint8 array
+CACHED_MODES = ("L", "RGB", "RGBA")
+
+def configure(write: bool):
+    _local.write = write
+
+def writing() -> bool:
+    """Whether pages saved from this thread also get a cache entry"""
+    return getattr(_local, "write", False)
+
+def cache_paths(image_path: Path) -> Optional[tuple[Path, Path]]:
+    """
+    (raw, header) paths caching a stage output, or None if the image is not
+    inside a stage's documents folder. <assets>/<stage>/documents/a/b.jpg is
+    cached as <assets>/page_cache/<stage>/documents/a/b.jpg.raw (+ .json).
+    """
+    parts = Path(image_path).parts
+    if "documents" not in parts:
+        return None
+    i = parts.index("documents")
+    if i < 2:
+        return None
+    stage_dir = Path(*parts[:i])
+    base = stage_dir.parent / "page_cache" / stage_dir.name / Path(*parts[i:])
+    return base.with_name(base.name + ".raw"), base.with_name(base.name + ".json")
+
+def _stamp(path: Path) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def _write_header(header_path: Path, header: dict):
+    tmp_path = header_path.with_name(header_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(header))
+    os.replace(tmp_path, header_path)
+
+def store(image_path: Path, image: Image.Image) -> bool:
+    """Keep a raw copy of the page just written to `image_path` (L, RGB or RGBA only)"""
+    paths = cache_paths(image_path)
+    if paths is None or image.mode not in CACHED_MODES:
+        return False
+    raw_path, header_path = paths
+    raw_path.parent.mkdir(parents=True, exist_ok=True)
+    array = np.asarray(image)
+    tmp_path = raw_path.with_name(raw_path.name + ".tmp")
+    array.tofile(tmp_path)
+    os.replace(tmp_path, raw_path)
+    _write_header(header_path, {
+        "shape": list(array.shape),
+        "dtype": str(array.dtype),
+        "mode": image.mode,
+        # The encoded file this copy mirrors; a rewrite of it invalidates the copy
+        "source": _stamp(image_path)
+    })
+    return True
+
+def link(src_path: Path, dst_path: Path) -> bool:
+    """Reuse the cache entry of `src_path` for a byte-identical `dst_path`"""
+    src, dst = cache_paths(src_path), cache_paths(dst_path)
+    header = _valid_header(src_path, src)
+    if header is None or dst is None:
+        return False
+    dst[0].parent.mkdir(parents=True, exist_ok=True)
+    # Hardlinks are safe here: store() always replaces a raw file, never rewrites it
+    link_or_copy(src[0], dst[0])
+    _write_header(dst[1], {**header, "source": _stamp(dst_path)})
+    return True
+
+def _valid_header(image_path: Path, paths) -> Optional[dict]:
+    if paths is None:
+        return None
+    try:
+        header = json.loads(paths[1].read_text())
+        if header["source"] != _stamp(image_path):
+            return None
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+    return header
+
+def load(image_path: Path) -> Optional[Image.Image]:
+    """The cached page as an image over a read-only memory map, or None on a miss"""
+    paths = cache_paths(image_path)
+    header = _valid_header(image_path, paths)
+    if header is None:
+        return None
+    try:
+        array = np.memmap(paths[0], dtype=header["dtype"], mode="r", shape=tuple(header["shape"]))
+    except (FileNotFoundError, ValueError):
+        return None
+    # L and RGBA images share the mapped buffer; RGB is unpacked to PIL's 4-byte layout
+    return Image.fromarray(array)
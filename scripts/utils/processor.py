@@ -2,6 +2,8 @@ from pathlib import Path
 from datetime import datetime
 from typing import Callable, Any
 from rich.console import Console
+from .hashing import file_signature
+from .image_io import IMAGE_SUFFIXES
 
 console = Console()
 
@@ -11,7 +13,12 @@ def process_file(
     process_fn: Callable[[Path, Path], Any],
     file_types: dict = None
 ) -> dict:
-    """Generic file processor with robust error handling"""
+    """Generic file processor with robust error handling.
+
+    The input's size, mtime and content hash are recorded under "input" so
+    BatchProcessor can tell when a source changed (it also decides whether
+    existing outputs may be trusted, see its skip_existing option).
+    """
     file_path = Path(file_path)  # Ensure file_path is a Path object
     
     # Always preserve the input path structure but remove any 'documents' prefix
@@ -36,21 +43,13 @@ def process_file(
         if not file_path.exists():
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        # Accept common image formats
-        if file_types and file_path.suffix.lower() not in ['.jpg', '.jpeg', '.png', '.tif', '.tiff']:
+        # Accept common image formats and the intermediate codecs
+        if file_types and file_path.suffix.lower() not in IMAGE_SUFFIXES:
             raise ValueError(f"Unsupported file type: {file_path.suffix}")
         
         out_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # For skipped files, keep the expected output path
-        if out_path.exists():
-            manifest_entry.update({
-                "success": True,
-                "skipped": True
-            })
-            return manifest_entry
+        manifest_entry["input"] = file_signature(file_path)
             
-        # Process only if file doesn't exist
         result = process_fn(file_path, out_path)
         if isinstance(result, dict):
             # Clean up paths in result to remove documents/ prefix
@@ -0,0 +1,86 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
+import os
+import re
+
+DOCUMENT_SUFFIXES = ('.pdf', '.jpg', '.jpeg', '.tif', '.tiff', '.png', '.jxl')
+
+def natural_sort_key(s: str):
+    """Sort strings alphanumerically like Finder."""
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+
+def _file_entry(rel_path: str, entry: os.DirEntry) -> dict:
+    st = entry.stat()
+    return {
+        "path": rel_path,
+        "type": "file",
+        "mtime": st.st_mtime,
+        "size": st.st_size
+    }
+
+def scan_subtree(root: Path, rel_dir: str = "") -> List[dict]:
+    """
+    List every folder and document file below root/rel_dir.
+
+    Uses os.scandir so file types come from the directory listing itself and
+    each document costs a single stat() for size and mtime.
+    """
+    entries = []
+    stack = [rel_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(root / current if current else root) as it:
+                for entry in it:
+                    rel_path = f"{current}/{entry.name}" if current else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append({"path": rel_path, "type": "directory"})
+                        stack.append(rel_path)
+                    elif entry.name.lower().endswith(DOCUMENT_SUFFIXES):
+                        entries.append(_file_entry(rel_path, entry))
+        except (FileNotFoundError, PermissionError):
+            # Folder removed or unreadable mid-scan
+            continue
+    return entries
+
+def scan_documents(documents_dir: Path, threads: int = 8) -> List[dict]:
+    """Scan the documents tree, one thread per top-level folder, sorted naturally"""
+    documents_dir = Path(documents_dir)
+    entries = []
+    subtrees = []
+    with os.scandir(documents_dir) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                entries.append({"path": entry.name, "type": "directory"})
+                subtrees.append(entry.name)
+            elif entry.name.lower().endswith(DOCUMENT_SUFFIXES):
+                entries.append(_file_entry(entry.name, entry))
+
+    # Directory listing on a NAS is latency bound, so threads overlap the round trips
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        for subtree_entries in executor.map(lambda d: scan_subtree(documents_dir, d), subtrees):
+            entries.extend(subtree_entries)
+
+    entries.sort(key=lambda e: natural_sort_key(e["path"]))
+    return entries
+
+def diff_entries(previous: Iterable[dict], current: Iterable[dict]) -> Dict[str, List[dict]]:
+    """
+    Compare two scans by (path, size, mtime).
+    Returns {"added", "changed", "removed"} lists of file entries.
+    """
+    before = {e["path"]: e for e in previous if e.get("type") == "file"}
+    added, changed = [], []
+    seen = set()
+    for entry in current:
+        if entry.get("type") != "file":
+            continue
+        seen.add(entry["path"])
+        old = before.get(entry["path"])
+        if old is None:
+            added.append(entry)
+        elif old.get("size") != entry["size"] or old.get("mtime") != entry["mtime"]:
+            changed.append(entry)
+    removed = [e for path, e in before.items() if path not in seen]
+    return {"added": added, "changed": changed, "removed": removed}
@@ -1,11 +1,12 @@
 from pathlib import Path
 from PIL import Image
-from typing import Dict, Union
+from typing import Dict, Optional, Union
 import shutil
 import os
 import json
 import tempfile
 from rich.console import Console  # Add this import
+from .image_io import load_image
 
 console = Console()
 
@@ -41,7 +42,7 @@ class SegmentHandler:
             if not full_path.exists():
                 raise FileNotFoundError(f"Segment not found: {full_path}")
                 
-            img = Image.open(full_path)
+            img, _ = load_image(full_path)
             if img.mode != 'RGB':
                 img = img.convert('RGB')
             return img
@@ -102,6 +103,15 @@ class SegmentHandler:
             return Path(*parts[parts.index('documents')+1:])
         return file_path
 
+    @staticmethod
+    def get_parent_image(segment_path: Union[str, Path]) -> Path:
+        """
+        The page a segment was cut from, named as in the background removal
+        manifest: a/b_segments/b_segment_0.jpg belongs to a/b.jpg
+        """
+        segments_folder = Path(segment_path).parent
+        return segments_folder.parent / f"{segments_folder.name[:-len('_segments')]}.jpg"
+
     @staticmethod 
     def make_segment_name(base_name: str, segment_index: int) -> str:
         """Create standardized segment filename"""
@@ -130,20 +140,43 @@ class SegmentHandler:
             lock_file.unlink()
 
     @staticmethod
-    def is_complete(folder: Path) -> bool:
-        """Check if a folder was completely processed"""
+    def _read_done(folder: Path) -> Optional[dict]:
+        try:
+            with open(folder / ".done") as f:
+                done = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return done if isinstance(done, dict) else None
+
+    @staticmethod
+    def is_complete(folder: Path, metadata: dict = None) -> bool:
+        """Check if a folder was completely processed (for the same metadata, if given)"""
         done_file = folder / ".done"
-        return done_file.exists() and not SegmentHandler.is_processing(folder)
+        if not done_file.exists() or SegmentHandler.is_processing(folder):
+            return False
+        if metadata is None:
+            return True
+        done = SegmentHandler._read_done(folder)
+        return done is not None and done.get("metadata") == metadata
+
+    @staticmethod
+    def completed_result(folder: Path, metadata: dict = None) -> Optional[dict]:
+        """The result recorded when the folder was completed for this metadata, if any"""
+        if not SegmentHandler.is_complete(folder, metadata):
+            return None
+        done = SegmentHandler._read_done(folder)
+        result = done.get("result") if done else None
+        return result if isinstance(result, dict) else None
 
     @staticmethod
-    def mark_complete(folder: Path, metadata: dict = None) -> None:
-        """Mark folder as completely processed"""
+    def mark_complete(folder: Path, metadata: dict = None, result=None) -> None:
+        """Mark folder as completely processed, keeping the metadata and result it was done with"""
         done_file = folder / ".done"
-        if metadata:
-            with open(done_file, 'w') as f:
-                json.dump(metadata, f)
-        else:
-            done_file.touch()
+        with open(done_file, 'w') as f:
+            json.dump({
+                "metadata": metadata,
+                "result": result if isinstance(result, dict) else None
+            }, f)
 
     @staticmethod
     def process_safely(folder: Path, process_fn, metadata: dict = None):
@@ -152,10 +185,23 @@ class SegmentHandler:
             # Create folder first
             folder.mkdir(parents=True, exist_ok=True)
 
-            # If already complete and not processing, skip
-            if SegmentHandler.is_complete(folder):
+            # If already complete for this input and not processing, skip and
+            # hand back the result recorded then, so the caller's manifest
+            # entry still lists the segments
+            previous = SegmentHandler.completed_result(folder, metadata)
+            if previous is not None:
                 console.print(f"[yellow]Skipping completed folder: {folder}")
-                return True
+                return previous
+
+            # Completed for a different input or parameters (or without a
+            # recorded result): clear stale segments and redo
+            if (folder / ".done").exists() and not SegmentHandler.is_processing(folder):
+                console.print(f"[yellow]Input or parameters changed, reprocessing: {folder}")
+                for item in folder.glob("*"):
+                    if item.is_file():
+                        item.unlink()
+                    elif item.is_dir():
+                        shutil.rmtree(item)
 
             # If interrupted mid-processing, clean up folder contents but keep folder
             if SegmentHandler.is_processing(folder):
@@ -170,7 +216,7 @@ class SegmentHandler:
             SegmentHandler.start_processing(folder)
             try:
                 result = process_fn()
-                SegmentHandler.mark_complete(folder, metadata)
+                SegmentHandler.mark_complete(folder, metadata, result)
                 return result
             finally:
                 SegmentHandler.finish_processing(folder)
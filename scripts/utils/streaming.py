@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+import queue
+import threading
+
+# Marks the end of a stage's output stream
+END_OF_STREAM = object()
+
+_local = threading.local()
+
+class StageStream:
+    """Connects an in-process stage to the stages up and down stream of it.
+
+    Manifest entries flow through bounded queues, so a slow consumer blocks
+    its producer (backpressure) instead of letting pages pile up in memory.
+    A stage without an input queue reads its input manifest as usual.
+    """
+
+    def __init__(self, name: str, input_queue: Optional[queue.Queue] = None, output_queues: List[queue.Queue] = None):
+        self.name = name
+        self.input_queue = input_queue
+        self.output_queues = output_queues or []
+        self.published = 0
+        self._closed = False
+        self._drained = input_queue is None
+
+    def input_docs(self) -> Iterator[dict]:
+        """Yield upstream manifest entries until the upstream stage finishes"""
+        if self._drained:
+            return
+        while True:
+            doc = self.input_queue.get()
+            if doc is END_OF_STREAM:
+                self._drained = True
+                return
+            yield doc
+
+    def publish(self, entry: dict):
+        """Send a manifest entry to every downstream stage (blocks when they are full)"""
+        for q in self.output_queues:
+            q.put(entry)
+        self.published += 1
+
+    def close(self):
+        """Tell downstream stages that no more entries are coming"""
+        if self._closed:
+            return
+        self._closed = True
+        for q in self.output_queues:
+            q.put(END_OF_STREAM)
+
+    def finish(self):
+        """Close outputs and discard unread input so upstream never blocks on us"""
+        self.close()
+        for _ in self.input_docs():
+            pass
+
+def current_stream() -> Optional[StageStream]:
+    """The stream the current thread's stage should use, if run by the scheduler"""
+    return getattr(_local, "stream", None)
+
+@contextmanager
+def stream_context(stream: StageStream):
+    """Run a stage CLI in this thread against the given stream"""
+    _local.stream = stream
+    try:
+        yield stream
+    finally:
+        _local.stream = None
@@ -0,0 +1,193 @@
+"""
+Watch Mode
+
+Keeps the pipeline running next to the scanner: new or re-scanned pages in the
+documents folder are pushed through a project.yml workflow (crop, split,
+rotate, enhance, remove_background, segment, transcribe by default) as soon
+as they have finished copying, instead of waiting for the next batch run.
+
+How it works:
+- The documents folder is rescanned with the manifest scanner and diffed
+  against the documents manifest, so only added or changed files are picked up.
+- A file counts as settled once its size and mtime are unchanged between two
+  scans and it has not been written to for `--debounce` seconds. Files still
+  being copied stay out of the manifest and are picked up on a later scan.
+- Settled changes are written to the documents manifest and to its
+  <manifest>_changes.jsonl, and the workflow is run with the documents
+  manifest var pointed at the changes file. Stages stream the new pages to
+  each other through the scheduler and merge them into their own manifests.
+- With watchdog installed (inotify on Linux, FSEvents on macOS) filesystem
+  events trigger a rescan right away; otherwise the folder is polled every
+  `--interval` seconds. Network shares often drop events, so the poll always
+  runs as a backstop.
+"""
+
+import typer
+import srsly
+import os
+import time
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from rich.console import Console
+from scheduler import load_project, resolve_vars, run_workflow
+from build_documents_manifest import changes_path, write_changes
+from utils.scanner import DOCUMENT_SUFFIXES, scan_documents, diff_entries
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Polling only
+    Observer = None
+    FileSystemEventHandler = object
+
+console = Console()
+
+class RescanHandler(FileSystemEventHandler):
+    """Wake the watch loop when a document file is touched"""
+
+    def __init__(self, wake: threading.Event):
+        self.wake = wake
+
+    def on_any_event(self, event):
+        paths = [getattr(event, "src_path", ""), getattr(event, "dest_path", "")]
+        if event.is_directory or any(str(p).lower().endswith(DOCUMENT_SUFFIXES) for p in paths):
+            self.wake.set()
+
+def start_observer(documents_dir: Path, wake: threading.Event):
+    """Start a watchdog observer, or return None to fall back to polling"""
+    if Observer is None:
+        return None
+    try:
+        observer = Observer()
+        observer.schedule(RescanHandler(wake), str(documents_dir), recursive=True)
+        observer.start()
+        return observer
+    except OSError as e:
+        # inotify watch limit reached, unsupported filesystem...
+        console.print(f"[yellow]Filesystem events unavailable ({e}), polling instead")
+        return None
+
+class Debouncer:
+    """Tracks candidate files until their size and mtime stop changing"""
+
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self.pending: Dict[str, tuple] = {}
+
+    def settle(self, candidates: List[dict], now: float) -> List[dict]:
+        """Return the candidates that are safe to process; remember the rest"""
+        settled = []
+        pending = {}
+        for entry in candidates:
+            signature = (entry["size"], entry["mtime"])
+            stable = self.pending.get(entry["path"]) == signature
+            if stable and now - entry["mtime"] >= self.debounce:
+                settled.append(entry)
+            else:
+                pending[entry["path"]] = signature
+        # Files that vanished or were settled are dropped from tracking
+        self.pending = pending
+        return settled
+
+def merge_manifest(previous: List[dict], current: List[dict], settled: List[dict]) -> List[dict]:
+    """
+    The new documents manifest: the current scan, except that files still
+    being written keep their previous entry (or stay out if they are new)
+    """
+    settled_paths = {e["path"] for e in settled}
+    before = {e["path"]: e for e in previous}
+    merged = []
+    for entry in current:
+        if entry.get("type") != "file" or entry["path"] in settled_paths:
+            merged.append(entry)
+        elif entry["path"] in before:
+            merged.append(before[entry["path"]])
+    return merged
+
+def write_manifest(path: Path, entries: List[dict]):
+    """Write atomically so a running stage never reads a partial manifest"""
+    tmp_path = path.with_suffix('.jsonl.tmp')
+    srsly.write_jsonl(tmp_path, entries)
+    os.replace(tmp_path, path)
+
+def scan_once(documents_dir: Path, documents_manifest: Path, debouncer: Debouncer, threads: int) -> Optional[dict]:
+    """Rescan, update the manifests and return the settled changes (None if nothing to do)"""
+    previous = list(srsly.read_jsonl(documents_manifest)) if documents_manifest.exists() else []
+    current = scan_documents(documents_dir, threads=threads)
+    changes = diff_entries(previous, current)
+
+    settled = debouncer.settle(changes["added"] + changes["changed"], time.time())
+    if debouncer.pending:
+        console.print(f"Waiting for {len(debouncer.pending)} file(s) to finish writing")
+    if not settled and not changes["removed"]:
+        return None
+
+    settled_paths = {e["path"] for e in settled}
+    settled_changes = {
+        "added": [e for e in changes["added"] if e["path"] in settled_paths],
+        "changed": [e for e in changes["changed"] if e["path"] in settled_paths],
+        "removed": changes["removed"]
+    }
+    write_changes(changes_path(documents_manifest), settled_changes)
+    write_manifest(documents_manifest, merge_manifest(previous, current, settled))
+    return settled_changes
+
+def watch(
+    project_file: Path = typer.Argument(Path("project.yml"), help="Project file describing commands and workflows"),
+    workflow: str = typer.Option("watch", help="Workflow to run on new pages"),
+    interval: float = typer.Option(30.0, help="Seconds between rescans of the documents folder"),
+    debounce: float = typer.Option(10.0, help="Seconds a file must be untouched before it is processed"),
+    threads: int = typer.Option(8, help="Threads scanning top-level folders in parallel"),
+    queue_size: int = typer.Option(32, help="Max manifest entries buffered between two streaming stages"),
+    once: bool = typer.Option(False, help="Process what is pending once and exit")
+):
+    """Watch the documents folder and run new or changed pages through the workflow"""
+    project_file = project_file.resolve()
+    _, project_vars = load_project(project_file)
+    project_root = project_file.parent
+    documents_dir = (project_root / resolve_vars(project_vars["documents_folder"], project_vars)).resolve()
+    documents_manifest = (project_root / resolve_vars(project_vars["documents_manifest"], project_vars)).resolve()
+    documents_manifest.parent.mkdir(parents=True, exist_ok=True)
+    changes_manifest = changes_path(documents_manifest)
+
+    wake = threading.Event()
+    observer = start_observer(documents_dir, wake)
+    mode = "filesystem events" if observer else f"polling every {interval:g}s"
+    console.print(f"[blue]Watching {documents_dir} ({mode}), running workflow {workflow}")
+
+    debouncer = Debouncer(debounce)
+    try:
+        while True:
+            changes = scan_once(documents_dir, documents_manifest, debouncer, threads)
+            if changes:
+                console.print(
+                    f"[green]Added: {len(changes['added'])}, changed: {len(changes['changed'])}, "
+                    f"removed: {len(changes['removed'])}"
+                )
+            if changes and (changes["added"] or changes["changed"]):
+                failed = run_workflow(
+                    project_file, workflow, queue_size=queue_size,
+                    overrides={"documents_manifest": str(changes_manifest)}
+                )
+                if failed:
+                    console.print(f"[red]Failed: {', '.join(failed)}")
+
+            if once and not debouncer.pending:
+                break
+            # Pending files are rechecked after the debounce, not the full interval
+            timeout = min(interval, debounce) if debouncer.pending else interval
+            wake.wait(timeout)
+            if wake.is_set():
+                wake.clear()
+                # Let a burst of events (a multi-page scan) arrive before rescanning
+                time.sleep(min(1.0, debounce))
+    except KeyboardInterrupt:
+        console.print("\n[yellow]Stopped watching")
+    finally:
+        if observer:
+            observer.stop()
+            observer.join()
+
+if __name__ == "__main__":
+    typer.run(watch)